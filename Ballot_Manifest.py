@@ -4,8 +4,11 @@ Ballot Manifest Data Entry Software
 The goal of this software is to create an easy to use interface for creating, updating, and removing entries
 in a ballot manifest that will be used for a Risk Limiting Audit (RLA).
 
-This software uses the tkinter module for rendering a graphical user interface (GUI) and uses the pandas module
-for editing and sorting data frames of information.
+This software uses the tkinter module for rendering a graphical user interface (GUI). The manifest data itself is kept
+in a ManifestStore (see manifest_store.py), which uses the pandas module for reading and writing the .csv file. Loading
+pandas takes most of the start up time, so it is only imported when a manifest is loaded or created, and the screens
+that are not shown at start up are built the first time they are shown. Run with --measure-startup to print the time it
+takes for the window to be ready.
 
 All GUI variables are declared in the __init__ method of the BallotManifestGui class, all "views" are generated in the
 views methods, and all functions and data frame manipulation occurs in the remaining methods.
@@ -15,11 +18,21 @@ Contact Jonathan Layman at jlayman@arapahoegov.com
 """
 
 
-import pandas as pd
+import time
+STARTED = time.perf_counter()
+
+import argparse
+import os
+import queue
+import sys
+from manifest_layout import COLUMN_NAMES, SQLITE_EXTENSIONS, BATCHES_PER_CONTAINER, parse_label, parse_count
+from manifest_metrics import METRICS, timed
+from manifest_server import RemoteManifestStore, ManifestConflict, parse_address, DEFAULT_PORT, TOKEN_VARIABLE
 from tkinter import *
 from tkinter import ttk
 from tkinter import messagebox
 from tkinter import filedialog
+from tkinter import simpledialog
 from tkinter.scrolledtext import ScrolledText
 
 
@@ -37,12 +50,22 @@ class BallotManifestGui:
         # This sets the display for the top part of the window. It adds the Arapahoe County Logo and the Title Text
         self.frame_header = ttk.Frame(master)
         self.frame_header.pack()
-        self.logo = PhotoImage(file='Data/ArapahoeLogo.png').subsample(20, 20)
+        self.logo_file = 'Data/ArapahoeLogo.png'
+        self.small_logo_file = 'Data/ArapahoeLogo_small.png'
+        self.logo = self.load_logo()
         self.arapahoe_logo = ttk.Label(self.frame_header, image=self.logo).grid(row=0, column=0, rowspan=2,
                                                                                 pady=(5, 25))
         self.title_text = ttk.Label(self.frame_header, font=('Arial', 18, 'bold'), wraplength=400,
                                     text='Ballot Manifest Data Entry').grid(row=1, column=1, padx=25)
 
+        # Establish Status Bar Settings
+        # This is the line at the bottom of the window that shows what the background writer is doing. Messages from
+        # the writer thread are put on self.status_queue and shown by the self.poll_status() method.
+        self.status_text = ttk.Label(master, text='', anchor='w', relief='sunken')
+        self.status_text.pack(side=BOTTOM, fill=X)
+        self.status_queue = queue.Queue()
+        self.status_interval = 250
+
         # Establish Load File Frame Settings
         # This is the landing page of the program that prompts for a filename stored under the self.filename variable.
         # The self.content_textbox variable is the text input where a filename can be loaded.
@@ -57,7 +80,8 @@ class BallotManifestGui:
 
         # Establish Form Settings
         # This page is the form that the user will enter the information on the container label.
-        # The self.labels and self.batch_entries will be determined after a label is scanned.
+        # The self.labels and self.batch_entries are created the first time the form is shown and relabeled after each
+        # label is scanned.
         self.frame_form = ttk.Frame(master)
         self.scan_text = ttk.Label(self.frame_form, text='Scan Label: ')
         self.scan_label = ttk.Entry(self.frame_form, width=25, show='*')
@@ -84,45 +108,47 @@ class BallotManifestGui:
         self.menu_bar.add_cascade(menu=self.help_, label='Help')
         self.file.add_command(label='Create New From Template', command=lambda: self.load_from_template_view())
         self.file.add_command(label='Load Manifest', command=lambda: self.load_view())
+        self.file.add_command(label='Connect to Manifest Server', command=lambda: self.connect_to_server())
         self.file.add_command(label='Edit or Remove Previous Entry', command=lambda: self.edit_or_remove_view())
         self.file.entryconfig('Edit or Remove Previous Entry', state='disabled')
+        self.file.add_command(label='Export Manifest to CSV', command=lambda: self.export_csv())
+        self.file.entryconfig('Export Manifest to CSV', state='disabled')
+        self.file.add_command(label='Check Manifest', command=lambda: self.check_manifest_view())
+        self.file.entryconfig('Check Manifest', state='disabled')
+        self.file.add_command(label='Create RLA Pull List', command=lambda: self.create_pull_list())
+        self.file.entryconfig('Create RLA Pull List', state='disabled')
+        self.file.add_command(label='Reconcile With Tabulation', command=lambda: self.reconcile_view())
+        self.file.entryconfig('Reconcile With Tabulation', state='disabled')
         self.file.add_command(label='Save and Quit', command=lambda: self.save_and_quit())
         self.file.entryconfig('Save and Quit', state='disabled')
         self.help_.add_command(label='How to use this software', command=lambda: self.how_to_use_view())
+        self.help_.add_command(label='Performance', command=lambda: self.performance_view())
         self.help_.add_separator()
         self.help_.add_command(label='About', command=lambda: self.about_view())
 
-        # Establish Edit or Remove Settings
-        # This is the for the edit or remove page. The self.scanner_entry and self.starting_batch_entry variables
-        # are the text input locations that will be used for looking up an entry.
-        self.frame_edit = ttk.Frame(master)
-        self.instruction_text = ttk.Label(self.frame_edit, text='To Edit or Remove an entry: enter the scanner and'
-                                                                'starting batch number, then select "Edit" or "Remove"',
-                                          wraplength=250)
-        self.scanner_prompt = ttk.Label(self.frame_edit, text='Scanner: ')
-        self.starting_batch_prompt = ttk.Label(self.frame_edit, text='First Batch in Container: ')
-        self.scanner_entry = ttk.Entry(self.frame_edit, width=25)
-        self.starting_batch_entry = ttk.Entry(self.frame_edit, width=25)
-        self.edit_button = ttk.Button(self.frame_edit, text='Edit', command=lambda: self.edit_entry())
-        self.remove_button = ttk.Button(self.frame_edit, text='Remove', command=lambda: self.remove_entry())
-
-        # Establish Load From New Template Settings
-        # These are the settings for the load from a new template screen.
-        self.frame_load_template = ttk.Frame(master)
-        self.load_template_text = ttk.Label(self.frame_load_template, text='To create a new ballot manifest from the '
-                                                                           'manifest template: click the "Create From '
-                                                                           'Template" button below', wraplength=350)
-        self.load_template_button = ttk.Button(self.frame_load_template, text='Create From Template',
-                                               command=lambda: self.create_from_template())
+        # Establish Edit or Remove and Load From New Template Settings
+        # These screens are not shown at start up, so their widgets are created by self.create_edit_frame() and
+        # self.create_load_template_frame() the first time they are shown.
+        self.frame_edit = None
+        self.frame_load_template = None
 
-        # Establish Pandas DataFrame Variables
-        # These variables can be changed to change the county using the software and the column names of the ballot
-        # manifest.
+        # Establish Manifest Variables
+        # The self.county variable can be changed to change the county using the software. The self.store variable
+        # holds the ManifestStore for the loaded ballot manifest, and self.column_names are the columns of the .csv.
         self.county = 'Arapahoe'
-        self.df = None
-        self.column_names = ['County', 'Scanner', 'ICC Batch', 'Ballot Count', 'Container Number', 'Seal 1', 'Seal 2']
+        self.store = None
+        self.column_names = COLUMN_NAMES
+        self.manifest_filetypes = [('csv files', '*.csv'), ('SQLite manifests', ' '.join('*' + extension for extension
+                                                                                         in SQLITE_EXTENSIONS))]
         self.printed_label = None
 
+        # Establish Journal Settings
+        # Saves and removes are appended to the store's journal instead of rewriting the whole .csv. The journal is
+        # compacted back into the .csv every self.compact_interval milliseconds and when Save and Quit is selected.
+        self.compact_interval = 5 * 60 * 1000
+        self.master.after(self.compact_interval, self.scheduled_compaction)
+        self.master.after(self.status_interval, self.poll_status)
+
         # Render load View
         self.load_view()
 
@@ -132,15 +158,17 @@ class BallotManifestGui:
     def clear_view(self):
         self.frame_load.pack_forget()
         self.frame_form.pack_forget()
-        self.frame_edit.pack_forget()
-        self.frame_load_template.pack_forget()
+        if self.frame_edit is not None:
+            self.frame_edit.pack_forget()
+        if self.frame_load_template is not None:
+            self.frame_load_template.pack_forget()
 
     # This view is the screen prompting to load a ballot manifest into the software.
     # The self.select_button will call the self.locate_file() method, and the self.load_button will call the
     # self.load_to_form() method.
     def load_view(self):
         self.clear_view()
-        self.df = None
+        self.close_store()
         self.filename = None
         self.update_menu_view()
         self.frame_load.pack()
@@ -182,11 +210,41 @@ class BallotManifestGui:
         self.form_clear.config(state='disabled')
         self.generate_batch_widgets()
 
+    # This creates the widgets for the edit or remove page the first time it is shown. The self.scanner_entry and
+    # self.starting_batch_entry variables are the text input locations that will be used for looking up an entry.
+    def create_edit_frame(self):
+        self.frame_edit = ttk.Frame(self.master)
+        self.instruction_text = ttk.Label(self.frame_edit, text='To Edit or Remove an entry: enter the scanner and'
+                                                                'starting batch number, then select "Edit" or "Remove"',
+                                          wraplength=250)
+        self.scanner_prompt = ttk.Label(self.frame_edit, text='Scanner: ')
+        self.starting_batch_prompt = ttk.Label(self.frame_edit, text='First Batch in Container: ')
+        self.scanner_entry = ttk.Entry(self.frame_edit, width=25)
+        self.starting_batch_entry = ttk.Entry(self.frame_edit, width=25)
+        self.edit_button = ttk.Button(self.frame_edit, text='Edit', command=lambda: self.edit_entry())
+        self.remove_button = ttk.Button(self.frame_edit, text='Remove', command=lambda: self.remove_entry())
+        self.search_prompt = ttk.Label(self.frame_edit, text='Seal or Container Number: ')
+        self.search_entry = ttk.Entry(self.frame_edit, width=25)
+        self.search_entry.bind('<Return>', lambda event: self.search_manifest())
+        self.search_button = ttk.Button(self.frame_edit, text='Search', command=lambda: self.search_manifest())
+        self.search_results = ttk.Label(self.frame_edit, text='', wraplength=400, justify='left')
+
+    # This creates the widgets for the load from a new template screen the first time it is shown.
+    def create_load_template_frame(self):
+        self.frame_load_template = ttk.Frame(self.master)
+        self.load_template_text = ttk.Label(self.frame_load_template, text='To create a new ballot manifest from the '
+                                                                           'manifest template: click the "Create From '
+                                                                           'Template" button below', wraplength=350)
+        self.load_template_button = ttk.Button(self.frame_load_template, text='Create From Template',
+                                               command=lambda: self.create_from_template())
+
     # This view is for the edit or remove screen selected from the file drop down menu. It is only available once a
     # ballot manifest has been loaded. The self.edit_button will call the self.edit_entry() method and the
     # self.remove_button will call the self.remove_entry() method.
     def edit_or_remove_view(self):
         self.clear_view()
+        if self.frame_edit is None:
+            self.create_edit_frame()
         self.frame_edit.pack(fill=BOTH, expand=1)
         self.instruction_text.grid(row=0, column=1, columnspan=2, pady=20)
         self.scanner_prompt.grid(row=1, column=1, sticky='e')
@@ -195,24 +253,57 @@ class BallotManifestGui:
         self.starting_batch_entry.grid(row=2, column=2)
         self.edit_button.grid(row=3, column=1)
         self.remove_button.grid(row=3, column=2)
+        self.search_prompt.grid(row=4, column=1, sticky='e', pady=(30, 0))
+        self.search_entry.grid(row=4, column=2, pady=(30, 0))
+        self.search_button.grid(row=5, column=2, pady=5)
+        self.search_results.grid(row=6, column=1, columnspan=2, sticky='w')
 
     # This view is for creating a new ballot manifest from a a template. The self.load_template_button will call the
     # self.create_from_template() method.
     def load_from_template_view(self):
         self.clear_view()
+        if self.frame_load_template is None:
+            self.create_load_template_frame()
         self.frame_load_template.pack()
         self.load_template_text.grid(row=1, column=0, pady=25)
         self.load_template_button.grid(row=2, column=0)
 
     # This is used to dynamically verify which option in the file drop down menu are active. It will only activate them
-    # if there is an active data frame.
+    # if there is an active manifest.
     def update_menu_view(self):
-        if self.df is not None:
+        if self.store is not None:
             self.file.entryconfig('Edit or Remove Previous Entry', state='normal')
             self.file.entryconfig('Save and Quit', state='normal')
         else:
             self.file.entryconfig('Edit or Remove Previous Entry', state='disabled')
             self.file.entryconfig('Save and Quit', state='disabled')
+        if self.store is not None and not isinstance(self.store, RemoteManifestStore):
+            self.file.entryconfig('Export Manifest to CSV', state='normal')
+            self.file.entryconfig('Check Manifest', state='normal')
+            self.file.entryconfig('Create RLA Pull List', state='normal')
+            self.file.entryconfig('Reconcile With Tabulation', state='normal')
+        else:
+            self.file.entryconfig('Export Manifest to CSV', state='disabled')
+            self.file.entryconfig('Check Manifest', state='disabled')
+            self.file.entryconfig('Create RLA Pull List', state='disabled')
+            self.file.entryconfig('Reconcile With Tabulation', state='disabled')
+
+    # This loads the county logo for the header. Shrinking the full size logo is slow on older workstations, so the
+    # shrunken logo is saved next to it the first time and used from then on. If the shrunken copy cannot be saved (for
+    # example on a read only drive) the logo is shrunk each time instead.
+    def load_logo(self):
+        if (os.path.exists(self.small_logo_file) and
+                os.path.getmtime(self.small_logo_file) >= os.path.getmtime(self.logo_file)):
+            try:
+                return PhotoImage(file=self.small_logo_file)
+            except TclError:
+                pass
+        logo = PhotoImage(file=self.logo_file).subsample(20, 20)
+        try:
+            logo.write(self.small_logo_file, format='png')
+        except (TclError, OSError):
+            pass
+        return logo
 
     # This view is an informational pop-up with basic information about the software.
     def about_view(self):
@@ -231,51 +322,137 @@ class BallotManifestGui:
         use_text.pack()
         use_text.config(state='disabled')
 
-    # The following methods are used to read and manipulate the data entered into this software. Many pandas
-    # data frame methods are called and used to sort and store data.
+    # This view is a pop-up listing the problems found by the manifest integrity check (see manifest_check.py). The rows
+    # of the manifest file and its journal are checked as they are stored, once the writer has journaled every change,
+    # because the containers in memory have already been cleaned up when the manifest was loaded.
+    def check_manifest_view(self):
+        from manifest_check import check_manifest, summarize_issues
+        from manifest_store import read_manifest_rows
+        if self.store.writer is not None:
+            self.store.writer.wait_for(self.store.writer.queued, 20)
+        try:
+            if os.path.exists(self.filename):
+                issues = check_manifest(read_manifest_rows(self.filename, self.county))
+            else:
+                issues = check_manifest(self.store.to_frame())
+        except ValueError as error:
+            messagebox.showerror('Ballot Manifest - Error', str(error))
+            return
+        check_window = Toplevel(self.master)
+        check_window.geometry('700x400+75+40')
+        check_window.title('Manifest Check')
+        check_text = ScrolledText(check_window, width=135, height=50, wrap='none')
+        check_text.insert(1.0, summarize_issues(issues))
+        if not issues.empty:
+            check_text.insert(END, '\n\n' + issues.head(1000).to_string(index=False))
+        check_text.pack()
+        check_text.config(state='disabled')
+        self.status_text.config(text='Manifest check found {} problems'.format(len(issues)))
+
+    # This view is called from the reconcile with tabulation option in the file menu. It prompts for the batch export
+    # from the tabulation system and where to save the report, compares the export with the manifest (see
+    # manifest_reconcile.py) and shows a pop-up with the totals and the first differences found.
+    @timed('reconcile')
+    def reconcile_view(self):
+        export_file = self.dialog(filedialog.askopenfilename, title='Select the Tabulation Batch Export',
+                                  filetypes=[('csv files', '*.csv')])
+        if not export_file:
+            return
+        filename = self.dialog(filedialog.asksaveasfilename, title='Save the Reconciliation Report',
+                               filetypes=[('csv files', '*.csv')],
+                               defaultextension='.csv',
+                               initialfile='Reconciliation')
+        if not filename:
+            return
+        from manifest_reconcile import Reconciliation
+        try:
+            reconciliation = Reconciliation(self.store.to_frame(), export_file)
+            differences = reconciliation.write_report(filename)
+        except (ValueError, OSError) as error:
+            self.dialog(messagebox.showerror, 'Ballot Manifest - Error', str(error))
+            return
+        reconcile_window = Toplevel(self.master)
+        reconcile_window.geometry('700x400+75+40')
+        reconcile_window.title('Reconciliation')
+        reconcile_text = ScrolledText(reconcile_window, width=135, height=50, wrap='none')
+        reconcile_text.insert(1.0, reconciliation.summary() + '\nEvery difference was written to ' + filename)
+        if not differences.empty:
+            reconcile_text.insert(END, '\n\n' + differences.to_string(index=False))
+        reconcile_text.pack()
+        reconcile_text.config(state='disabled')
+        self.status_text.config(text='Reconciliation found {} differences'.format(reconciliation.differences()))
+
+    # This view is a pop-up showing how long each operator action has been taking (see manifest_metrics.py), split into
+    # time spent in the window, on DataFrames and on files. The Refresh button updates it.
+    def performance_view(self):
+        performance_window = Toplevel(self.master)
+        performance_window.geometry('700x300+75+40')
+        performance_window.title('Performance')
+        performance_text = ScrolledText(performance_window, width=135, height=15, wrap='none')
+
+        def refresh():
+            performance_text.config(state='normal')
+            performance_text.delete(1.0, END)
+            performance_text.insert(1.0, METRICS.report())
+            performance_text.config(state='disabled')
+
+        ttk.Button(performance_window, text='Refresh', command=refresh).pack(side=BOTTOM, pady=5)
+        performance_text.pack(fill=BOTH, expand=1)
+        refresh()
+
+    # The following methods are used to read and manipulate the data entered into this software. The data is stored
+    # and sorted by the ManifestStore in self.store.
 
     # This method is called from the self.form_view() and the self.generate_form() methods. It
-    # is used to dynamically label the batch numbers in the form according to their starting batch number. It starts by
-    # removing any existing data from the relevant variables. It then creates a list of the 15 batches from the start
-    # point it is given. The self.form_view() method does not provide a starting point, so a default starting point of 1
-    # is used. The self.generate_form() method does provide a starting point which is determined from the label.
+    # is used to dynamically label the batch numbers in the form according to their starting batch number. The 15 batch
+    # labels and entries are created and placed on the form the first time, and after that the same widgets are reused
+    # for every label that is scanned, so the form does not grow or slow down over a long day of scanning. Each call
+    # relabels the batches from the start point it is given and empties the entries. The self.form_view() method does
+    # not provide a starting point, so a default starting point of 1 is used. The self.generate_form() method does
+    # provide a starting point which is determined from the label.
     def generate_batch_widgets(self, start=1):
-        for label in self.labels:
-            label.destroy()
-        del self.labels[:]
-        del self.batch_entries[:]
-        for i in range(start, start + 15):
-            self.labels.append(ttk.Label(self.frame_form, text='Batch ' + str(i) + ':'))
-            self.batch_entries.append(ttk.Entry(self.frame_form, width=25))
-        for index, label in enumerate(self.labels, start=4):
-            label.grid(row=index, column=0, sticky='w', padx=10, pady=2)
-        for index, entry in enumerate(self.batch_entries, start=4):
-            entry.grid(row=index, column=1, sticky='w')
+        if not self.labels:
+            for row in range(4, 4 + BATCHES_PER_CONTAINER):
+                label = ttk.Label(self.frame_form)
+                entry = ttk.Entry(self.frame_form, width=25)
+                label.grid(row=row, column=0, sticky='w', padx=10, pady=2)
+                entry.grid(row=row, column=1, sticky='w')
+                self.labels.append(label)
+                self.batch_entries.append(entry)
+        for batch, label, entry in zip(range(start, start + BATCHES_PER_CONTAINER), self.labels, self.batch_entries):
+            label.config(text='Batch ' + str(batch) + ':')
+            entry.config(state='normal')
+            entry.delete(0, END)
             entry.config(state='disabled')
 
     # This method is called by the self.scan_submit() method and the edit view screen. It takes data from a scanned
-    # barcode (3 of 9 format) and splits the data. The raw data looks like: 01/L1/LICC 01-1
+    # barcode (3 of 9 format) and splits the data with manifest_store.parse_label(). The raw data looks like:
+    # 01/L1/LICC 01-1
     # The split point is "/L". The first part of the data is the Scanner Number, The second part is the first batch in
     # the container, and the third part is the name of the container.
     #
-    # After splitting the data, this method checks the data frame to make sure the length of the split data is 3 because
-    # each barode has 3 parts. This will reduce the risk of scanning a wrong barcode. This method then checks to see if
-    # #there is a matching entry, and if there is, it prompts the user to confirm that they want to overwrite the
-    # exiting data. If the user answers "Yes" or if there is no matching data, it passes back to the
+    # The parser checks that the barcode has 3 parts. This will reduce the risk of scanning a wrong barcode. This method
+    # then checks to see if there is a matching entry, and if there is, it prompts the user to confirm that they want to
+    # overwrite the exiting data. If the user answers "Yes" or if there is no matching data, it passes back to the
     # self.generate_form() or self.form_view() methods as appropriate.
+    @timed('load_label')
     def load_label(self):
-        self.printed_label = self.scan_label.get().split('/L')
-        self.printed_label[0] = int(self.printed_label[0])
-        self.printed_label[1] = int(self.printed_label[1])
-        if len(self.printed_label) != 3:
+        try:
+            self.printed_label = list(parse_label(self.scan_label.get()))
+        except ValueError:
+            self.printed_label = None
+        if self.printed_label is None:
             self.form_view()
         else:
-            if (self.county, self.printed_label[0], self.printed_label[1]) in self.df.index:
-                result = messagebox.askyesno('Entry Found in Manifest', 'This entry already exists in the manifest, '
-                                                                        'would you like to overwrite it?')
+            if (self.printed_label[0], self.printed_label[1]) in self.store:
+                result = self.dialog(messagebox.askyesno, 'Entry Found in Manifest',
+                                     'This entry already exists in the manifest, would you like to overwrite it?')
                 if result:
-                    for i in range(15):
-                        self.df.drop((self.county, self.printed_label[0], self.printed_label[1] + i), inplace=True)
+                    try:
+                        self.store.remove(self.printed_label[0], self.printed_label[1])
+                    except (ManifestConflict, OSError) as error:
+                        self.show_store_error(error)
+                        return
                     self.generate_form()
                 else:
                     self.form_view()
@@ -301,20 +478,34 @@ class BallotManifestGui:
             entry.config(state='normal')
 
     # This method is called from the self.select_button. It opens up a dialog to locate a file on the computer, and then
-    # checks to see if that file is a .csv. If the File is a .csv it will save the filename under the self.filename
-    # variable and load the contents of that file as the main data frame under the self.df variable.
+    # checks to see if that file is a .csv or an SQLite manifest. If it is, it will save the filename under the
+    # self.filename variable and open the manifest under the self.store variable. For a .csv, any records left in the
+    # journal (for example after a crash) are replayed on top of the .csv, and the memory used by the manifest is shown
+    # in the status bar.
+    @timed('locate_file')
     def locate_file(self):
-        self.filename = filedialog.askopenfile()
-        if self.filename is not None and self.filename.name[-3:] == 'csv':
+        self.filename = self.dialog(filedialog.askopenfile, filetypes=self.manifest_filetypes)
+        if self.filename is not None and self.filename.name.lower().endswith(('.csv',) + SQLITE_EXTENSIONS):
             self.filename = self.filename.name
-            self.df = pd.read_csv(self.filename, index_col=['County', 'Scanner', 'ICC Batch'])
-            self.df.sort_index(inplace=True)
+            self.close_store()
+            from manifest_store import ManifestStore, open_manifest
+            try:
+                self.store = open_manifest(self.filename, self.county)
+            except ValueError as error:
+                self.filename = None
+                self.dialog(messagebox.showerror, 'Ballot Manifest - Error',
+                            'The manifest could not be loaded. ' + str(error))
+                return
+            self.store.start_writer(self.status_queue.put)
+            if type(self.store) is ManifestStore:
+                self.status_text.config(text='Loaded {} containers using {:.1f} MB of memory'.format(
+                    len(self.store), self.store.memory_usage() / 1e6))
             self.content_textbox.config(state='normal')
             self.content_textbox.insert(0, self.filename)
             self.content_textbox.config(state='disabled')
         else:
-            messagebox.showerror(title='Ballot Manifest - Error',
-                                 message='Please select a CSV file')
+            self.dialog(messagebox.showerror, title='Ballot Manifest - Error',
+                        message='Please select a CSV or SQLite manifest file')
 
     # This method is called by the self.create_from_template() method and the self.load_button. It checks that there is
     # content in the self.filename variable, and if there is, it clears the screen and displays the form.
@@ -323,36 +514,94 @@ class BallotManifestGui:
             self.clear_view()
             self.form_view()
 
-    # This method is called by the self.form_save button. It creates a new data frame in a local variable called
-    # new_data. It uses list comprehension to populate the form based off of the information gathered from the form.
-    # The method then appends the data to the main data frame, sorts the data, and then saves it back to the .csv. If
-    # the .csv is open, than this method will be denied access to the file and not be able to save. However, the data
-    # frame will remain intact.
+    # This method is called by the self.form_save button. It gathers the ballot counts and seals from the form and
+    # checks that every ballot count is a whole number (a blank count means the batch is not used) and that at least one
+    # batch has a count. It then stores them as a single container in self.store. The container is written to the
+    # journal by the background writer, so the form is ready for the next label straight away. The .csv itself is only
+    # rewritten when the journal is compacted.
+    @timed('submit_form')
     def submit_form(self):
-        new_data = pd.DataFrame(columns=self.column_names)
-        new_data['County'] = [self.county for i in range(15)]
-        new_data['Scanner'] = [self.printed_label[0] for i in range(15)]
-        new_data['ICC Batch'] = [self.printed_label[1] + i for i in range(15)]
-        new_data['Ballot Count'] = [entry.get() for entry in self.batch_entries]
-        new_data['Container Number'] = [self.printed_label[2] for i in range(15)]
-        new_data['Seal 1'] = [self.seal_entry_1.get() for i in range(15)]
-        new_data['Seal 2'] = [self.seal_entry_2.get() for i in range(15)]
-        new_data.set_index(keys=['County', 'Scanner', 'ICC Batch'], inplace=True)
-        self.df = self.df.append(new_data)
-        self.df.sort_index(inplace=True)
-        self.df.to_csv(self.filename)
-        messagebox.showinfo('Ballot Manifest', 'Form successfully submitted')
+        try:
+            counts = [parse_count(entry.get()) for entry in self.batch_entries]
+        except ValueError:
+            self.dialog(messagebox.showerror, 'Ballot Manifest - Error',
+                        'Every ballot count must be a whole number. Leave the count blank for a batch that is not '
+                        'used.')
+            return
+        if all(count is None for count in counts):
+            self.dialog(messagebox.showerror, 'Ballot Manifest - Error',
+                        'Enter the ballot count of at least one batch before saving the container.')
+            return
+        seal_1, seal_2 = self.seal_entry_1.get().strip(), self.seal_entry_2.get().strip()
+        try:
+            conflicts = self.store.seal_conflicts(self.printed_label[0], self.printed_label[1], seal_1, seal_2)
+        except OSError as error:
+            self.show_store_error(error)
+            return
+        if conflicts and not self.dialog(
+                messagebox.askyesno, 'Ballot Manifest - Duplicate Seal',
+                '\n'.join('Seal {} is already used on {} (scanner {:02d}, batch {}).'.format(
+                    seal, container.container_number, container.scanner, container.batch)
+                          for seal, container in conflicts) + '\n\nSave this container anyway?'):
+            return
+        try:
+            self.store.put(self.printed_label[0], self.printed_label[1], self.printed_label[2], counts, seal_1, seal_2)
+        except (ManifestConflict, OSError) as error:
+            self.show_store_error(error)
+            return
+        self.status_text.config(text='Saving ' + self.printed_label[2] + '...')
         self.form_view()
 
-    # This method is called from the file menu. It saves a copy of the main data frame to the .csv file. A copy is saved
-    # every time the submit form button is pressed, so saving here is redundant. This method then kills the master
-    # window.
+    # This method shows a dialog and returns the operator's answer. While the dialog waits for the operator, the clock
+    # of the action that opened it is stopped (see manifest_metrics.py).
+    def dialog(self, show, *args, **kwargs):
+        with METRICS.paused():
+            return show(*args, **kwargs)
+
+    # This method is called from the file menu. It compacts the journal, saving a full copy of the manifest to the .csv
+    # file, and waits for the writer to finish. This method then kills the master window.
     def save_and_quit(self):
-        if self.df is not None:
-            self.df.to_csv(self.filename)
+        self.close_store()
+        METRICS.write()
         self.master.destroy()
         quit()
 
+    # This method folds the journal into the .csv file. It does nothing if there is no manifest loaded or nothing has
+    # been journaled since the last compaction.
+    def compact_journal(self):
+        if self.store is not None:
+            self.store.compact()
+
+    # This method is called by the compaction timer started in __init__. It compacts the journal, saves the metrics and
+    # then schedules itself to run again, even if something failed, so compaction never stops for the session.
+    def scheduled_compaction(self):
+        try:
+            self.compact_journal()
+            if not METRICS.write() and METRICS.write_error is not None:
+                self.status_text.config(text='Could not save the performance metrics: {}'.format(METRICS.write_error))
+        finally:
+            self.master.after(self.compact_interval, self.scheduled_compaction)
+
+    # This method compacts the manifest that is currently loaded and stops its background writer before another
+    # manifest is loaded or the software is closed.
+    def close_store(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    # This method is called every self.status_interval milliseconds. It shows the newest message from the background
+    # writer in the status bar. The writer thread never touches tkinter directly.
+    def poll_status(self):
+        message = None
+        while True:
+            try:
+                message = self.status_queue.get_nowait()
+            except queue.Empty:
+                break
+        if message is not None:
+            self.status_text.config(text=message)
+        self.master.after(self.status_interval, self.poll_status)
+
     # This method is called from the self.edit_button. It prompts the user to enter the scanner number and the starting
     # batch number. If the data entered does not match a possible entry, the software will show an error explaining how
     # to load a proper batch. If a data is a possible match, it will generate a fake bar code that is fed into the
@@ -377,49 +626,167 @@ class BallotManifestGui:
     # This method is called by the self.remove_button. It matches the data similar to the self.edit_entry() method.
     # If a match is found it will prompt the user if they want to remove the entry, or it will inform the user that
     # There is no such entry (even if the search criteria is valid)
+    @timed('remove_entry')
     def remove_entry(self):
         list_of_scanners = ['01', '02', '03', '04', '05', '06', '07', '08', '09' '10']
-        print(self.df)
-        print('Check 1')
         if self.scanner_entry.get() in list_of_scanners and int(self.starting_batch_entry.get()) % 15 == 1:
-            if (self.county, int(self.scanner_entry.get()), int(self.starting_batch_entry.get())) in self.df.index:
-                result = messagebox.askyesno('Entry Found in Manifest', 'Are you sure you want to remove this entry?')
+            if (int(self.scanner_entry.get()), int(self.starting_batch_entry.get())) in self.store:
+                result = self.dialog(messagebox.askyesno, 'Entry Found in Manifest',
+                                     'Are you sure you want to remove this entry?')
                 if result:
-                    scanner = int(self.scanner_entry.get())
-                    batch = int(self.starting_batch_entry.get())
-                    for i in range(15):
-                        self.df.drop((self.county, scanner, batch + i), inplace=True)
-                    print(self.df)
-                    print(self.filename)
-                    self.df.to_csv(self.filename)
+                    try:
+                        self.store.remove(int(self.scanner_entry.get()), int(self.starting_batch_entry.get()))
+                    except (ManifestConflict, OSError) as error:
+                        self.show_store_error(error)
+                        return
                     self.scanner_entry.delete(0, END)
                     self.starting_batch_entry.delete(0, END)
                     self.clear_view()
                     self.form_view()
             else:
-                messagebox.showerror('No Entry Found',
-                                     'Your submission does not match any existing entry in the manifest')
+                self.dialog(messagebox.showerror, 'No Entry Found',
+                            'Your submission does not match any existing entry in the manifest')
+
+    # This method is called by the self.search_button or by pressing Enter in the self.search_entry. It looks up the
+    # seal or container number entered and lists the containers that use it with their batches. If exactly one container
+    # is found, its scanner and first batch are filled in so it can be edited or removed straight away.
+    @timed('search')
+    def search_manifest(self):
+        text = self.search_entry.get().strip()
+        if not text:
+            return
+        try:
+            containers = self.store.search_containers(text)
+        except OSError as error:
+            self.show_store_error(error)
+            return
+        if not containers:
+            self.search_results.config(text='No container has the seal or container number ' + text)
+            return
+        lines = []
+        for container in containers:
+            batches = [container.batch + offset for offset, count in enumerate(container.counts) if count is not None]
+            lines.append('{}: scanner {:02d}, batches {}, seals {} / {}'.format(
+                container.container_number, container.scanner,
+                '{}-{}'.format(batches[0], batches[-1]) if batches else 'none entered',
+                container.seal_1 or '-', container.seal_2 or '-'))
+        self.search_results.config(text='\n'.join(lines))
+        if len(containers) == 1:
+            self.scanner_entry.delete(0, END)
+            self.scanner_entry.insert(0, '{:02d}'.format(containers[0].scanner))
+            self.starting_batch_entry.delete(0, END)
+            self.starting_batch_entry.insert(0, str(containers[0].batch))
+
+    # This method is called from the export manifest to csv option in the file menu. It writes a sorted copy of the
+    # manifest to a .csv file for the RLA tool. This is how an SQLite manifest is turned into a .csv.
+    @timed('export_csv')
+    def export_csv(self):
+        filename = self.dialog(filedialog.asksaveasfilename, title='Export the Ballot Manifest to CSV',
+                               filetypes=[('csv files', '*.csv')],
+                               defaultextension='.csv',
+                               initialfile='Ballot Manifest Export')
+        if filename:
+            self.store.to_csv(filename)
+            self.status_text.config(text='Exported manifest to ' + filename)
+
+    # This method is called from the create RLA pull list option in the file menu. It reads the ballot numbers drawn by
+    # the RLA tool from a file and writes the pull list, grouped by container, for the retrieval teams. The ballot
+    # index is kept by the store, so after the first pull list it is not built again.
+    def create_pull_list(self):
+        draws_file = filedialog.askopenfilename(title='Select the Ballot Numbers Drawn for the RLA',
+                                                filetypes=[('text files', '*.txt'), ('csv files', '*.csv')])
+        if not draws_file:
+            return
+        filename = filedialog.asksaveasfilename(title='Save the RLA Pull List',
+                                                filetypes=[('csv files', '*.csv')],
+                                                defaultextension='.csv',
+                                                initialfile='Pull List')
+        if not filename:
+            return
+        from manifest_rla import read_draws, write_pull_list
+        try:
+            pull_list = self.store.ballot_index().pull_list(read_draws(draws_file))
+        except ValueError as error:
+            messagebox.showerror('Ballot Manifest - Error', str(error))
+            return
+        write_pull_list(pull_list, filename)
+        self.status_text.config(text='Wrote {} ballots to {}'.format(len(pull_list), filename))
+
+    # This method is called from the connect to manifest server option in the file menu. It prompts for the address of a
+    # manifest server (see manifest_server.py) and uses the manifest on that server instead of a local .csv, so several
+    # workstations can enter containers into the same manifest. The server's token is asked for too, and defaults to
+    # the MANIFEST_SERVER_TOKEN environment variable.
+    def connect_to_server(self):
+        address = simpledialog.askstring('Connect to Manifest Server', 'Server address (host:port):',
+                                         initialvalue='localhost:' + str(DEFAULT_PORT), parent=self.master)
+        if not address:
+            return
+        token = simpledialog.askstring('Connect to Manifest Server', 'Server token (blank if the server has none):',
+                                       initialvalue=os.environ.get(TOKEN_VARIABLE, ''), show='*', parent=self.master)
+        if token is None:
+            return
+        try:
+            store = RemoteManifestStore(*parse_address(address), token=token or None)
+        except (OSError, ValueError) as error:
+            messagebox.showerror('Ballot Manifest - Error', 'Could not connect to the manifest server: ' + str(error))
+            return
+        self.close_store()
+        self.store = store
+        self.filename = store.filename
+        self.status_text.config(text='Connected to ' + store.address)
+        self.clear_view()
+        self.load_to_form()
+
+    # This method is called when the manifest server refuses a change because another workstation changed the same
+    # container, or when the server does not answer. A refused change was not saved, but a change the server did not
+    # answer may have been, so in both cases the form is reset for the label to be scanned again.
+    def show_store_error(self, error):
+        if isinstance(error, ManifestConflict):
+            self.dialog(messagebox.showerror, 'Container Changed', str(error))
+        else:
+            self.dialog(messagebox.showerror, 'Ballot Manifest - Error',
+                        'The manifest server did not confirm the change: {}\n\nScan the label again to see whether it '
+                        'was saved.'.format(error))
+        self.clear_view()
+        self.form_view()
 
     # This method is called from the create new from template option in the file menu. It prompts the user to select
     # a location and provides a default name of "Ballot Manifest.csv". Once a file location and name is selected it will
-    # create a new data frame from the column list outlined in self.column_names and exports that to a csv. Finally,
-    # this method loads the newly created template into the entry form.
+    # create a new, empty manifest with the columns outlined in self.column_names, either as a csv or, if an SQLite file
+    # type is chosen, as an SQLite database. Finally, this method loads the newly created template into the entry form.
     def create_from_template(self):
         directory = filedialog.asksaveasfilename(title='Select a Location and Name for the Ballot Manifest',
-                                                 filetypes=[('csv files', '*.csv')],
+                                                 filetypes=self.manifest_filetypes,
                                                  defaultextension='.csv',
                                                  initialfile='Ballot Manifest')
-        new_from_template = pd.DataFrame(columns=self.column_names)
-        new_from_template.to_csv(directory, index=False)
-        self.df = new_from_template.set_index(keys=['County', 'Scanner', 'ICC Batch'])
+        if not directory:
+            return
+        self.close_store()
+        from manifest_store import create_manifest
+        self.store = create_manifest(directory, self.county)
+        self.store.start_writer(self.status_queue.put)
         self.filename = directory
         self.load_to_form()
 
 
-# This function launches the program by creating a tkinter root, and then calling the BallotManifestGui class.
-def main():
+# This function launches the program by creating a tkinter root, and then calling the BallotManifestGui class. With
+# --measure-startup it prints how long it took from the start of the program until the window was drawn, and closes.
+# With --metrics FILE the operator actions are timed (see manifest_metrics.py) and the timings are saved to FILE.
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ballot Manifest Data Entry Software')
+    parser.add_argument('--measure-startup', action='store_true', help='print the start up time and exit')
+    parser.add_argument('--metrics', metavar='FILE', help='time operator actions and save the timings to FILE (JSON)')
+    args = parser.parse_args(argv)
+    if args.metrics:
+        METRICS.enable(args.metrics)
     root = Tk()
     manifest_gui = BallotManifestGui(root)
+    if args.measure_startup:
+        root.update()
+        print('Window ready in {:.3f} seconds (pandas loaded: {})'.format(time.perf_counter() - STARTED,
+                                                                        'pandas' in sys.modules))
+        root.destroy()
+        return
     root.mainloop()
 
 
@@ -0,0 +1,169 @@
+"""
+Ballot Manifest Benchmarks
+
+This script measures how the manifest operations scale as the manifest grows, without opening the GUI. For each
+manifest size it generates a synthetic manifest with the real columns and container barcodes, then times:
+
+    load        opening the manifest file (the Load Manifest path)
+    submit      saving a new container (the Save button)
+    overwrite   scanning a label for an existing container and saving it again
+    remove      removing a container (the Remove button)
+    save        writing the full manifest (Save and Quit)
+
+The results are written to a JSON file so runs can be compared before each election to catch slower scans.
+
+Usage:
+    python manifest_benchmark.py --sizes 1000 10000 100000 1000000 --output benchmark_results.json
+"""
+
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from manifest_store import (COLUMN_NAMES, BATCHES_PER_CONTAINER, apply_schema, format_label, parse_label,
+                            frame_to_containers, open_manifest, create_manifest)
+
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+
+# This function builds a synthetic manifest data frame with about the given number of batches, spread evenly over the
+# scanners. Every container is full, container numbers follow the "ICC {scanner}-{n}" pattern used by the labels, and
+# every container has its own pair of seals. The same seed always gives the same manifest.
+def synthetic_manifest(batches, scanners=10, county='Arapahoe', seed=0):
+    random = np.random.default_rng(seed)
+    containers_per_scanner = max(1, -(-batches // (scanners * BATCHES_PER_CONTAINER)))
+    batches_per_scanner = containers_per_scanner * BATCHES_PER_CONTAINER
+    scanner = np.repeat(np.arange(1, scanners + 1), batches_per_scanner)
+    batch = np.tile(np.arange(1, batches_per_scanner + 1), scanners)
+    container = (batch + BATCHES_PER_CONTAINER - 1) // BATCHES_PER_CONTAINER
+    seal = (scanner - 1) * containers_per_scanner + container
+    df = pd.DataFrame({'County': county,
+                       'Scanner': scanner,
+                       'ICC Batch': batch,
+                       'Ballot Count': random.integers(1, 151, len(batch)),
+                       'Container Number': ['ICC {:02d}-{}'.format(s, c) for s, c in zip(scanner, container)],
+                       'Seal 1': ['A{:07d}'.format(value) for value in seal],
+                       'Seal 2': ['B{:07d}'.format(value) for value in seal]}, columns=COLUMN_NAMES)
+    return apply_schema(df)
+
+
+# This function returns the barcodes of containers that are in the synthetic manifest, picked at random.
+def existing_labels(df, count, seed=0):
+    first_batches = df[(df['ICC Batch'] - 1) % BATCHES_PER_CONTAINER == 0]
+    picks = first_batches.sample(min(count, len(first_batches)), random_state=seed)
+    return [format_label(scanner, batch, container) for scanner, batch, container
+            in zip(picks['Scanner'], picks['ICC Batch'], picks['Container Number'])]
+
+
+# This function returns the barcodes of containers that come after the end of the synthetic manifest.
+def new_labels(df, count):
+    last_batch = int(df['ICC Batch'].max())
+    labels = []
+    for index in range(count):
+        scanner = index % int(df['Scanner'].max()) + 1
+        batch = last_batch + 1 + (index // int(df['Scanner'].max())) * BATCHES_PER_CONTAINER
+        labels.append(format_label(scanner, batch, 'ICC {:02d}-{}'.format(scanner, (batch + 14) // 15)))
+    return labels
+
+
+# This function calls operation once for each item and returns the timing summary in microseconds.
+def time_each(operation, items):
+    times = []
+    for item in items:
+        start = time.perf_counter()
+        operation(item)
+        times.append((time.perf_counter() - start) * 1e6)
+    return summarize(times)
+
+
+def summarize(times):
+    ordered = sorted(times)
+    return {'operations': len(times),
+            'mean_us': statistics.fmean(times),
+            'median_us': statistics.median(times),
+            'p95_us': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            'max_us': ordered[-1]}
+
+
+# This function runs every benchmark for one manifest size and returns the results. The manifest is written to
+# directory with the given extension, which chooses the storage backend (.csv or .sqlite).
+def run_size(batches, directory, extension='.csv', operations=200, seed=0):
+    counts = [100] * BATCHES_PER_CONTAINER
+    df = synthetic_manifest(batches, seed=seed)
+    filename = os.path.join(directory, 'Benchmark {}{}'.format(batches, extension))
+    store = create_manifest(filename)
+    store.upsert(frame_to_containers(df))
+    store.close()
+    results = {'batches': len(df), 'containers': len(df) // BATCHES_PER_CONTAINER, 'file_bytes':
+               os.path.getsize(filename)}
+
+    start = time.perf_counter()
+    store = open_manifest(filename)
+    results['load'] = summarize([(time.perf_counter() - start) * 1e6])
+
+    def submit(label):
+        scanner, batch, container = parse_label(label)
+        store.put(scanner, batch, container, counts, 'SEAL-1', 'SEAL-2')
+
+    def overwrite(label):
+        scanner, batch, container = parse_label(label)
+        if (scanner, batch) in store:
+            store.remove(scanner, batch)
+        store.put(scanner, batch, container, counts, 'SEAL-1', 'SEAL-2')
+
+    def remove(label):
+        scanner, batch, _ = parse_label(label)
+        if (scanner, batch) in store:
+            store.remove(scanner, batch)
+
+    results['submit'] = time_each(submit, new_labels(df, operations))
+    results['overwrite'] = time_each(overwrite, existing_labels(df, operations, seed))
+    results['remove'] = time_each(remove, existing_labels(df, operations, seed + 1))
+
+    start = time.perf_counter()
+    store.to_csv(os.path.join(directory, 'Benchmark Save.csv'))
+    results['save'] = summarize([(time.perf_counter() - start) * 1e6])
+    store.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ballot manifest operations at several sizes.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='manifest sizes in batches')
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], default='csv', help='the storage backend to use')
+    parser.add_argument('--operations', type=int, default=200, help='how many times to time each scan operation')
+    parser.add_argument('--seed', type=int, default=0, help='the random seed for the synthetic manifests')
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the JSON results')
+    args = parser.parse_args(argv)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'backend': args.backend,
+              'python': platform.python_version(),
+              'pandas': pd.__version__,
+              'platform': platform.platform(),
+              'results': []}
+    extension = '.sqlite' if args.backend == 'sqlite' else '.csv'
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            results = run_size(size, directory, extension, args.operations, args.seed)
+            report['results'].append(results)
+            print('{:>9} batches: load {:8.1f} ms  submit {:7.1f} us  overwrite {:7.1f} us  remove {:7.1f} us  '
+                  'save {:8.1f} ms'.format(results['batches'], results['load']['mean_us'] / 1000,
+                                           results['submit']['median_us'], results['overwrite']['median_us'],
+                                           results['remove']['median_us'], results['save']['mean_us'] / 1000))
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print('Results written to ' + args.output)
+
+
+if __name__ == '__main__':
+    main()
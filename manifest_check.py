@@ -0,0 +1,187 @@
+"""
+Ballot Manifest Integrity Check
+
+Before a ballot manifest is handed to the Risk Limiting Audit it should be checked as a whole. This module looks for:
+
+    Invalid key            a Scanner or ICC Batch that is not a number
+    Blank ballot count     a batch without a ballot count
+    Invalid ballot count   a ballot count that is not a whole number
+    Duplicate batch        the same ICC Batch entered more than once for a scanner
+    Missing batches        a gap in the ICC Batch numbers of a scanner
+    Container start        a container that does not start at batch 1, 16, 31 and so on
+    Container size         a container that holds batches from more than one group of 15
+    Container number       a container number that does not match "ICC {scanner}-{n}" for its batches
+    Mixed containers       batches from the same group of 15 with different container numbers
+    Inconsistent seals     batches of the same container with different seal numbers
+    Missing seal           a container without a seal number
+    Duplicate seal         a seal number used on more than one container
+
+Every check works on whole columns at once (sorting, group by and differences between rows) instead of looping over
+the rows, so a manifest with a million batches is checked in about a second.
+
+The check is available from the File menu in the GUI and from the command line:
+    python manifest_check.py "Ballot Manifest.csv" --output "Manifest Check.csv"
+"""
+
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from manifest_store import INDEX_NAMES, BATCHES_PER_CONTAINER, read_manifest_rows
+
+
+ISSUE_COLUMNS = ['Check', 'County', 'Scanner', 'ICC Batch', 'Container Number', 'Message']
+
+
+# This function runs every check on a manifest data frame (indexed by County, Scanner and ICC Batch or not) and returns
+# a data frame with one row per problem found, in the ISSUE_COLUMNS layout. An empty data frame means the manifest
+# passed every check.
+def check_manifest(df):
+    if list(df.index.names) == INDEX_NAMES:
+        df = df.reset_index()
+    df = df.reset_index(drop=True)
+    issues = []
+
+    # Each check reports the rows of frame where rows is True. The message is either text or a function that builds the
+    # message from the reported rows, so messages are only built for the problems found.
+    def report(check, rows, message, frame=df):
+        rows = np.asarray(rows, dtype=bool)
+        if rows.any():
+            found = frame[rows]
+            issues.append(pd.DataFrame({'Check': check,
+                                        'County': found['County'].astype(object),
+                                        'Scanner': found['Scanner'].astype(object),
+                                        'ICC Batch': found['ICC Batch'].astype(object),
+                                        'Container Number': found['Container Number'].astype(object),
+                                        'Message': message(found) if callable(message) else message}))
+
+    # Check that the key columns and the ballot counts are numbers.
+    scanner = pd.to_numeric(df['Scanner'], errors='coerce')
+    batch = pd.to_numeric(df['ICC Batch'], errors='coerce')
+    counts = pd.to_numeric(df['Ballot Count'], errors='coerce')
+    invalid_key = scanner.isna() | batch.isna() | (scanner % 1 > 0) | (batch % 1 > 0)
+    report('Invalid key', invalid_key, 'Scanner and ICC Batch must be whole numbers')
+    blank = df['Ballot Count'].isna()
+    report('Blank ballot count', blank, 'The batch has no ballot count')
+    report('Invalid ballot count', (counts.isna() & ~blank) | (counts < 0) | (counts % 1 > 0),
+           'Ballot Count must be a whole number of ballots')
+
+    # Sort the batches of each scanner and compare each batch with the one before it.
+    rows = df[~invalid_key].assign(Scanner=scanner[~invalid_key].astype(np.int64),
+                                   **{'ICC Batch': batch[~invalid_key].astype(np.int64)})
+    county_codes = pd.factorize(rows['County'].astype(object).fillna(''))[0]
+    order = np.lexsort((rows['ICC Batch'].to_numpy(), rows['Scanner'].to_numpy(), county_codes))
+    rows = rows.iloc[order].reset_index(drop=True)
+    county_codes = county_codes[order]
+    scanners = rows['Scanner'].to_numpy()
+    batches = rows['ICC Batch'].to_numpy()
+    previous = np.concatenate(([0], batches[:-1]))
+    same_scanner = np.concatenate(([False], (county_codes[1:] == county_codes[:-1]) &
+                                   (scanners[1:] == scanners[:-1])))
+    rows['First Missing'] = np.where(same_scanner, previous + 1, 1)
+    report('Duplicate batch', same_scanner & (batches == previous),
+           'ICC Batch is entered more than once for this scanner', rows)
+    report('Missing batches', batches > rows['First Missing'].to_numpy(),
+           lambda found: 'Batches ' + found['First Missing'].astype(str) + ' to ' +
+           (found['ICC Batch'] - 1).astype(str) + ' are missing', rows)
+
+    # Gather each container (county, scanner and container number) into one row.
+    containers = rows.groupby([county_codes, scanners, rows['Container Number'].astype(object).fillna('')],
+                              sort=False)
+    summary = containers.agg(**{'County': ('County', 'first'), 'Scanner': ('Scanner', 'first'),
+                                'ICC Batch': ('ICC Batch', 'min'), 'Last Batch': ('ICC Batch', 'max'),
+                                'Container Number': ('Container Number', 'first'),
+                                'Seal 1': ('Seal 1', 'first'), 'Seal 2': ('Seal 2', 'first'),
+                                'Seal 1 Values': ('Seal 1', 'nunique'), 'Seal 2 Values': ('Seal 2', 'nunique')})
+    summary = summary.reset_index(drop=True)
+    start = summary['ICC Batch']
+    report('Container start', (start - 1) % BATCHES_PER_CONTAINER != 0,
+           'The container does not start at the first batch of a group of ' + str(BATCHES_PER_CONTAINER), summary)
+    report('Container size', (summary['Last Batch'] - 1) // BATCHES_PER_CONTAINER !=
+           (start - 1) // BATCHES_PER_CONTAINER,
+           'The container holds batches from more than one group of ' + str(BATCHES_PER_CONTAINER), summary)
+    summary['Expected'] = ('ICC ' + summary['Scanner'].astype(str).str.zfill(2) + '-' +
+                           ((start + BATCHES_PER_CONTAINER - 1) // BATCHES_PER_CONTAINER).astype(str))
+    report('Container number', summary['Container Number'].astype(object) != summary['Expected'],
+           lambda found: 'Expected container number ' + found['Expected'], summary)
+    report('Inconsistent seals', (summary['Seal 1 Values'] > 1) | (summary['Seal 2 Values'] > 1),
+           'Batches in this container have different seal numbers', summary)
+
+    # Each group of 15 batches should belong to a single container.
+    blocks = summary.assign(Block=(start - 1) // BATCHES_PER_CONTAINER)
+    mixed = blocks.duplicated(['County', 'Scanner', 'Block'], keep=False)
+    report('Mixed containers', mixed, 'Another container number is used in the same group of ' +
+           str(BATCHES_PER_CONTAINER) + ' batches', blocks)
+
+    # Seal numbers should be filled in and should not be used on more than one container.
+    for column in ('Seal 1', 'Seal 2'):
+        seal = summary[column].astype(object)
+        report('Missing seal', seal.isna() | (seal.astype(str).str.strip() == ''), column + ' is blank', summary)
+    # The seals of every row are compared, not just the first row of each container, so a seal that was changed on a
+    # single batch to one used on another container is still found.
+    # Each seal column is reduced to its distinct (container, seal) pairs using integer codes before any text is
+    # compared.
+    group = containers.ngroup().to_numpy().astype(np.int64)
+    pairs = []
+    for column in ('Seal 1', 'Seal 2'):
+        if isinstance(rows[column].dtype, pd.CategoricalDtype):
+            codes, values = rows[column].cat.codes.to_numpy(), rows[column].cat.categories
+        else:
+            codes, values = pd.factorize(rows[column])
+        width = len(values) + 1
+        used = np.unique(group * width + codes + 1)
+        used = used[used % width > 0]
+        pairs.append(pd.DataFrame({'Group': used // width,
+                                   'Seal': pd.Index(values).astype(str).str.strip().to_numpy()[used % width - 1]}))
+    pairs = pd.concat(pairs, ignore_index=True)
+    pairs = pairs[pairs['Seal'] != ''].drop_duplicates()
+    shared = pairs[pairs.duplicated('Seal', keep=False)].sort_values(['Seal', 'Group'])
+    owners = summary.iloc[shared['Group'].to_numpy()].assign(Seal=shared['Seal'].to_numpy()).reset_index(drop=True)
+    report('Duplicate seal', np.ones(len(owners), dtype=bool),
+           lambda found: 'Seal ' + found['Seal'] + ' is used on more than one container', owners)
+
+    if not issues:
+        return pd.DataFrame(columns=ISSUE_COLUMNS)
+    return pd.concat(issues, ignore_index=True)[ISSUE_COLUMNS]
+
+
+# This function returns a short summary of the issues found, with the number of problems for each check.
+def summarize_issues(issues):
+    if issues.empty:
+        return 'No problems were found in the manifest.'
+    lines = ['{} problems were found in the manifest:'.format(len(issues))]
+    for check, count in issues['Check'].value_counts(sort=False).items():
+        lines.append('    {:<22}{}'.format(check, count))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check a ballot manifest before it is used for the RLA.')
+    parser.add_argument('manifest', help='the ballot manifest .csv or .sqlite')
+    parser.add_argument('--output', help='write every problem found to this .csv file')
+    args = parser.parse_args(argv)
+
+    try:
+        df = read_manifest_rows(args.manifest)
+    except ValueError as error:
+        print(error)
+        return 1
+    start = time.perf_counter()
+    issues = check_manifest(df)
+    elapsed = time.perf_counter() - start
+    print(summarize_issues(issues))
+    print('Checked {} batches in {:.2f} seconds'.format(len(df), elapsed))
+    if args.output:
+        issues.to_csv(args.output, index=False)
+        print('Problems written to ' + args.output)
+    elif not issues.empty:
+        print(issues.head(20).to_string(index=False))
+    return 1 if len(issues) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""
+Ballot Manifest Bulk Import
+
+This script loads ballot counts into a ballot manifest without using the entry form, for example from batch counts
+exported by the tabulation system. Each input record is one ICC batch with these fields:
+
+    Label          the container barcode data, for example 01/L1/LICC 01-1
+    ICC Batch      the batch number, which must be one of the 15 batches in the container
+    Ballot Count   the number of ballots in the batch
+    Seal 1         (optional) the first seal number on the container
+    Seal 2         (optional) the second seal number on the container
+
+Records can be read from a .csv file (with a header row) or a .jsonl file (one JSON object per line), or from standard
+input when the input is "-". The input is read a line at a time and checked in chunks. Lines that cannot be read (a
+.csv row with too many fields or a line that is not a JSON object), records that fail a check, and the records of a
+container that disagree on its container number or seals are written to a rejects report along with the line number
+and the reason. All of the accepted records are merged into the manifest at once.
+
+Usage:
+    python manifest_import.py "Ballot Manifest.csv" counts.csv
+    python manifest_import.py "Ballot Manifest.csv" - --format jsonl < counts.jsonl
+"""
+
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+import pandas as pd
+
+from manifest_store import (BATCHES_PER_CONTAINER, container_start, frame_to_containers, parse_labels, open_manifest,
+                            create_manifest)
+
+
+INPUT_COLUMNS = ['Label', 'ICC Batch', 'Ballot Count', 'Seal 1', 'Seal 2']
+REJECT_COLUMNS = ['Line', 'Reason'] + INPUT_COLUMNS
+
+
+# This function yields a (line number, record, reason) tuple for each row of a .csv file with a header row. The record
+# is a dictionary of the fields in the row, or None with the reason when the row has more fields than the header.
+def csv_lines(input_file):
+    reader = csv.reader(input_file, skipinitialspace=True)
+    header = [name.strip() for name in next(reader, [])]
+    for fields in reader:
+        if not fields:
+            continue
+        if len(fields) > len(header):
+            yield reader.line_num, None, 'The row has {} fields but the header has {}'.format(len(fields), len(header))
+        else:
+            yield reader.line_num, {name: value or None for name, value in zip(header, fields)}, None
+
+
+# This function yields a (line number, record, reason) tuple for each line of a .jsonl file. The record is None, with
+# the reason, when the line is not a JSON object.
+def jsonl_lines(input_file):
+    for line_number, line in enumerate(input_file, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            yield line_number, None, 'The line is not valid JSON: {}'.format(error)
+            continue
+        if isinstance(record, dict):
+            yield line_number, record, None
+        else:
+            yield line_number, None, 'The line is not a JSON object'
+
+
+# This function reads an input file (or standard input for "-") in chunks of chunk_size lines. For each chunk it yields
+# a data frame of strings with the INPUT_COLUMNS and a Line column holding the line number of each record in the input,
+# and a data frame in the REJECT_COLUMNS layout of the lines that could not be read.
+def read_records(source, input_format, chunk_size):
+    input_file = sys.stdin if source == '-' else open(source, newline='', encoding='utf-8')
+    try:
+        lines = jsonl_lines(input_file) if input_format == 'jsonl' else csv_lines(input_file)
+        while True:
+            rows = list(islice(lines, chunk_size))
+            if not rows:
+                break
+            chunk = pd.DataFrame([record for _, record, _ in rows if record is not None],
+                                 columns=INPUT_COLUMNS, dtype=object)
+            chunk = chunk.where(chunk.isna(), chunk.astype(str))
+            chunk.insert(0, 'Line', [line for line, record, _ in rows if record is not None])
+            unreadable = pd.DataFrame([(line, reason) for line, record, reason in rows if record is None],
+                                      columns=['Line', 'Reason']).reindex(columns=REJECT_COLUMNS)
+            yield chunk, unreadable
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+
+
+# This function checks a chunk of records and splits it into accepted and rejected data frames. The accepted data frame
+# is in the manifest column layout. Every check is done on the whole chunk at once.
+def validate_chunk(chunk, county):
+    label = parse_labels(chunk['Label'])
+    batch = pd.to_numeric(chunk['ICC Batch'], errors='coerce')
+    count = pd.to_numeric(chunk['Ballot Count'], errors='coerce')
+    checks = [
+        (label['Scanner'].isna() | label['Batch'].isna(), 'Label is not a container barcode'),
+        ((label['Batch'] - 1) % BATCHES_PER_CONTAINER != 0, 'Label does not start a container'),
+        (batch.isna() | (batch % 1 != 0), 'ICC Batch is not a whole number'),
+        ((batch < label['Batch']) | (batch >= label['Batch'] + BATCHES_PER_CONTAINER),
+         'ICC Batch is not in the labeled container'),
+        (count.isna() | (count % 1 != 0) | (count < 0), 'Ballot Count is not a whole number of ballots'),
+    ]
+    reason = pd.Series(pd.NA, index=chunk.index, dtype=object)
+    for failed, message in reversed(checks):
+        reason = reason.mask(failed, message)
+    rejected = reason.notna()
+    accepted = chunk.index[~rejected]
+    frame = pd.DataFrame({'County': county,
+                          'Scanner': label['Scanner'][accepted].astype(int),
+                          'ICC Batch': batch[accepted].astype(int),
+                          'Ballot Count': count[accepted].astype(int),
+                          'Container Number': label['Container Number'][accepted],
+                          'Seal 1': chunk['Seal 1'][accepted].fillna(''),
+                          'Seal 2': chunk['Seal 2'][accepted].fillna('')})
+    frame.insert(0, 'Line', chunk['Line'][accepted])
+    rejects = chunk[rejected].assign(Reason=reason[rejected])[REJECT_COLUMNS]
+    return frame, rejects
+
+
+# This function splits the accepted records into the records of containers whose records disagree on the container
+# number or a seal, and the rest. A blank seal does not disagree with anything, and the seals given on any record of a
+# container are filled in on all of its records.
+def split_conflicts(frame):
+    container = [frame['Scanner'], container_start(frame['ICC Batch'])]
+    conflict = frame['Container Number'].groupby(container).transform('nunique') > 1
+    for column in ('Seal 1', 'Seal 2'):
+        seals = frame[column].mask(frame[column].str.strip() == '')
+        conflict |= seals.groupby(container).transform('nunique') > 1
+        frame[column] = seals.groupby(container).transform('first').fillna('')
+    return frame[conflict], frame[~conflict]
+
+
+# This function imports every record from source into the store and returns a summary dictionary. Rejected records are
+# appended to the rejects_file .csv. When the same batch appears more than once, the last record wins.
+def import_records(store, source, input_format='csv', rejects_file=None, chunk_size=50000):
+    accepted = []
+    kept = []
+    records = rejected = 0
+
+    def write_rejects(rejects):
+        if len(rejects) and rejects_file is not None:
+            rejects.to_csv(rejects_file, mode='a' if rejected else 'w', header=not rejected, index=False)
+        return len(rejects)
+
+    for chunk, unreadable in read_records(source, input_format, chunk_size):
+        frame, rejects = validate_chunk(chunk, store.county)
+        records += len(chunk) + len(unreadable)
+        if len(unreadable):
+            rejects = pd.concat([unreadable, rejects], ignore_index=True).sort_values('Line', kind='stable')
+        rejected += write_rejects(rejects)
+        accepted.append(frame)
+        kept.append(chunk.loc[frame.index])
+    if accepted:
+        frame = pd.concat(accepted, ignore_index=True).drop_duplicates(['Scanner', 'ICC Batch'], keep='last')
+        conflicts, frame = split_conflicts(frame)
+        if len(conflicts):
+            kept = pd.concat(kept, ignore_index=True)
+            rejects = kept[kept['Line'].isin(conflicts['Line'])].assign(
+                Reason='The records of this container have different container numbers or seals')
+            rejected += write_rejects(rejects[REJECT_COLUMNS])
+    else:
+        frame = pd.DataFrame(columns=['County', 'Scanner', 'ICC Batch', 'Ballot Count', 'Container Number',
+                                      'Seal 1', 'Seal 2'])
+    containers = store.upsert(frame_to_containers(frame))
+    return {'records': records, 'accepted': records - rejected, 'rejected': rejected, 'containers': containers}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import ballot counts into a ballot manifest.')
+    parser.add_argument('manifest', help='the ballot manifest .csv or .sqlite (created if it does not exist)')
+    parser.add_argument('input', help='a .csv or .jsonl file of label and count records, or - for standard input')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='the input format (default: from the file name)')
+    parser.add_argument('--rejects', help='where to write rejected records (default: next to the manifest)')
+    parser.add_argument('--county', default='Arapahoe', help='the county for new manifests (default: Arapahoe)')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='records to check at a time')
+    args = parser.parse_args(argv)
+
+    input_format = args.format or ('jsonl' if args.input.endswith(('.jsonl', '.json')) else 'csv')
+    rejects_file = args.rejects or os.path.splitext(args.manifest)[0] + ' Rejects.csv'
+    if os.path.exists(rejects_file):
+        os.remove(rejects_file)
+    start = time.perf_counter()
+    if os.path.exists(args.manifest):
+        store = open_manifest(args.manifest, args.county)
+    else:
+        store = create_manifest(args.manifest, args.county)
+    summary = import_records(store, args.input, input_format, rejects_file, args.chunk_size)
+    store.close()
+    print('Imported {accepted} of {records} records into {containers} containers'.format(**summary))
+    if summary['rejected']:
+        print('{} records were rejected, see {}'.format(summary['rejected'], rejects_file))
+    print('Finished in {:.2f} seconds'.format(time.perf_counter() - start))
+    return 1 if summary['rejected'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
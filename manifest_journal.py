@@ -0,0 +1,103 @@
+"""
+Ballot Manifest Journal
+
+Rewriting the whole ballot manifest .csv every time a container is saved gets slower as the manifest grows. Instead,
+every save and remove is appended to a small journal file that sits next to the manifest (for example
+"Ballot Manifest.csv.journal"). Each record is a single line of JSON that is flushed and synced to disk before the
+call returns, so a crash or power loss will not lose a container that was reported as saved.
+
+The journal is folded back into the sorted .csv (compacted) when the user selects Save and Quit and on a timer while
+the software is running. When a manifest is loaded, any records left in the journal are replayed on top of the .csv.
+"""
+
+
+import json
+import os
+
+from manifest_metrics import METRICS
+
+
+# This function builds the journal record for a container (see manifest_store.Container) that was saved from the entry
+# form.
+def save_record(container):
+    return {'op': 'save', 'county': container.county, 'scanner': container.scanner, 'batch': container.batch,
+            'container': container.container_number, 'seal_1': container.seal_1, 'seal_2': container.seal_2,
+            'counts': list(container.counts)}
+
+
+# This function builds the journal record for a container that was removed (or cleared to be overwritten).
+def remove_record(county, scanner, batch):
+    return {'op': 'remove', 'county': county, 'scanner': scanner, 'batch': batch}
+
+
+class ManifestJournal:
+    def __init__(self, filename):
+        # The journal is stored beside the manifest using the manifest filename with a ".journal" extension.
+        self.manifest_filename = filename
+        self.filename = filename + '.journal'
+        self.record_count = 0
+        # The size of the complete records read() found, when the journal ends with a partially written record.
+        self.torn_at = None
+        self._file = None
+
+    # This method appends a single record to the end of the journal. The record is written as one line of JSON, then
+    # flushed and synced so it is on disk before the method returns.
+    def append(self, record):
+        self.append_many([record])
+
+    # This method appends several records with a single flush and sync. If read() found a partially written record at
+    # the end of the journal, it is cut off first so the new records do not join onto it.
+    def append_many(self, records):
+        if not records:
+            return
+        with METRICS.section('io'):
+            if self._file is None:
+                self._file = open(self.filename, 'a', encoding='utf-8')
+                if self.torn_at is not None:
+                    self._file.truncate(self.torn_at)
+                    self.torn_at = None
+            self._file.write(''.join(json.dumps(record) + '\n' for record in records))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self.record_count += len(records)
+
+    def save(self, container):
+        self.append(save_record(container))
+
+    def remove(self, county, scanner, batch):
+        self.append(remove_record(county, scanner, batch))
+
+    # This method reads every complete record in the journal. A partially written last line (from a crash in the middle
+    # of a write) is ignored because it was never reported as saved, and is removed by the next append.
+    def read(self):
+        records = []
+        self.torn_at = None
+        if not os.path.exists(self.filename):
+            return records
+        size = 0
+        with open(self.filename, 'rb') as journal_file:
+            for line in journal_file:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                size += len(line)
+        if size < os.path.getsize(self.filename):
+            self.torn_at = size
+        return records
+
+    # This method empties the journal without touching the manifest .csv.
+    def clear(self):
+        self.close()
+        self.torn_at = None
+        with open(self.filename, 'w', encoding='utf-8') as journal_file:
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self.record_count = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,281 @@
+"""
+Ballot Container Label Generator
+
+Every ballot container gets a label with a Code 39 (3 of 9) barcode that is scanned into the Scan Label box of the entry
+form. The barcode data is the same text the GUI reads with parse_label(), for example:
+    01/L1/LICC 01-1
+which is scanner 01, first batch 1, container ICC 01-1. The labels are built with format_label(), and every label is
+read back with parse_label() before it is drawn, so a label that would not scan into the right container is never
+printed.
+
+Labels are laid out 10 to a letter size page (2 across, 5 down). The pages are drawn by a pool of worker processes and
+written to the PDF one page at a time as they are finished, so only a few pages are ever held in memory no matter how
+many labels are made. PNG pages (one image file per page) can be made instead if Pillow is installed.
+
+Usage:
+    python manifest_labels.py --scanners 10 --first-batch 1 --last-batch 3000 --output "ICC Labels.pdf"
+    python manifest_labels.py --scanners 10 --last-batch 3000 --format png --output "ICC Labels"
+"""
+
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from manifest_store import BATCHES_PER_CONTAINER, container_start, format_label, parse_label
+
+
+# Each Code 39 character is 9 elements, alternating bar and space and starting with a bar. A 1 is a wide element.
+CODE39 = {
+    '0': '000110100', '1': '100100001', '2': '001100001', '3': '101100000', '4': '000110001', '5': '100110000',
+    '6': '001110000', '7': '000100101', '8': '100100100', '9': '001100100', 'A': '100001001', 'B': '001001001',
+    'C': '101001000', 'D': '000011001', 'E': '100011000', 'F': '001011000', 'G': '000001101', 'H': '100001100',
+    'I': '001001100', 'J': '000011100', 'K': '100000011', 'L': '001000011', 'M': '101000010', 'N': '000010011',
+    'O': '100010010', 'P': '001010010', 'Q': '000000111', 'R': '100000110', 'S': '001000110', 'T': '000010110',
+    'U': '110000001', 'V': '011000001', 'W': '111000000', 'X': '010010001', 'Y': '110010000', 'Z': '011010000',
+    '-': '010000101', '.': '110000100', ' ': '011000100', '$': '010101000', '/': '010100010', '+': '010001010',
+    '%': '000101010', '*': '010010100',
+}
+WIDE_RATIO = 3
+
+# The page layout, in points (1/72 inch).
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+LABEL_COLUMNS = 2
+LABEL_ROWS = 5
+LABEL_WIDTH = 288
+LABEL_HEIGHT = 144
+LABELS_PER_PAGE = LABEL_COLUMNS * LABEL_ROWS
+MARGIN_LEFT = (PAGE_WIDTH - LABEL_COLUMNS * LABEL_WIDTH) / 2
+MARGIN_TOP = (PAGE_HEIGHT - LABEL_ROWS * LABEL_HEIGHT) / 2
+QUIET_ZONE = 12
+BARCODE_HEIGHT = 60
+PNG_DPI = 300
+
+
+# This function returns the label for every container: for each scanner from 1 to scanners, one label for each group of
+# BATCHES_PER_CONTAINER batches from first_batch to last_batch. The container numbers follow the "ICC {scanner}-{n}"
+# pattern. first_batch must be the first batch of a container (1, 16, 31 and so on), the same as the entry form and the
+# manifest check expect, or a ValueError is raised straight away.
+def container_labels(scanners, first_batch=1, last_batch=BATCHES_PER_CONTAINER * 100):
+    if first_batch < 1 or container_start(first_batch) != first_batch:
+        raise ValueError('The first batch must be the first batch of a container (1, {}, {} and so on), not {}'.format(
+            1 + BATCHES_PER_CONTAINER, 1 + 2 * BATCHES_PER_CONTAINER, first_batch))
+    return generate_labels(scanners, first_batch, last_batch)
+
+
+# This function yields the labels for container_labels(). Each label is checked with parse_label() and a ValueError is
+# raised if it does not read back as the same container.
+def generate_labels(scanners, first_batch, last_batch):
+    for scanner in range(1, scanners + 1):
+        for batch in range(first_batch, last_batch + 1, BATCHES_PER_CONTAINER):
+            container_number = 'ICC {:02d}-{}'.format(scanner, (batch + BATCHES_PER_CONTAINER - 1) //
+                                                      BATCHES_PER_CONTAINER)
+            label = format_label(scanner, batch, container_number)
+            if parse_label(label) != (scanner, batch, container_number):
+                raise ValueError('The label {!r} does not read back as scanner {}, batch {}, container {}'.format(
+                    label, scanner, batch, container_number))
+            yield label, batch, min(batch + BATCHES_PER_CONTAINER - 1, last_batch)
+
+
+# This function returns the bars of the Code 39 barcode for text as (start, width) pairs in narrow element widths,
+# along with the total width of the barcode. The * start and stop characters are added here.
+def code39_bars(text):
+    invalid = sorted(set(text) - (set(CODE39) - {'*'}))
+    if invalid:
+        raise ValueError('Code 39 cannot encode {} in {!r}'.format(', '.join(map(repr, invalid)), text))
+    bars = []
+    position = 0
+    for character in '*' + text + '*':
+        for element, wide in enumerate(CODE39[character]):
+            width = WIDE_RATIO if wide == '1' else 1
+            if element % 2 == 0:
+                bars.append((position, width))
+            position += width
+        position += 1
+    return bars, position - 1
+
+
+# This function escapes text for a PDF string.
+def pdf_text(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+# This function returns the position of a label on the page, as the left and bottom edge in points.
+def label_origin(number):
+    column = number % LABEL_COLUMNS
+    row = number // LABEL_COLUMNS
+    return MARGIN_LEFT + column * LABEL_WIDTH, PAGE_HEIGHT - MARGIN_TOP - (row + 1) * LABEL_HEIGHT
+
+
+# This function draws one page of labels and returns the compressed PDF content stream. It runs in a worker process.
+def render_pdf_page(labels):
+    commands = []
+    for number, (label, first, last) in enumerate(labels):
+        left, bottom = label_origin(number)
+        scanner, _, container_number = parse_label(label)
+        bars, width = code39_bars(label)
+        narrow = (LABEL_WIDTH - 2 * QUIET_ZONE) / width
+        bar_bottom = bottom + 36
+        commands.append('BT /F1 14 Tf {:.2f} {:.2f} Td ({}) Tj ET'.format(
+            left + QUIET_ZONE, bottom + LABEL_HEIGHT - 24, pdf_text(container_number)))
+        commands.append('BT /F2 10 Tf {:.2f} {:.2f} Td (Scanner {:02d}   Batches {} - {}) Tj ET'.format(
+            left + QUIET_ZONE, bottom + LABEL_HEIGHT - 38, scanner, first, last))
+        for start, bar_width in bars:
+            commands.append('{:.2f} {:.2f} {:.2f} {} re'.format(
+                left + QUIET_ZONE + start * narrow, bar_bottom, bar_width * narrow, BARCODE_HEIGHT))
+        commands.append('f')
+        commands.append('BT /F2 10 Tf {:.2f} {:.2f} Td ({}) Tj ET'.format(
+            left + QUIET_ZONE, bottom + 20, pdf_text(label)))
+    return zlib.compress('\n'.join(commands).encode('latin-1'))
+
+
+# This function draws one page of labels into a PNG file and returns the file name. It runs in a worker process and
+# needs Pillow.
+def render_png_page(labels, filename):
+    from PIL import Image, ImageDraw
+    scale = PNG_DPI / 72
+    image = Image.new('1', (round(PAGE_WIDTH * scale), round(PAGE_HEIGHT * scale)), 1)
+    draw = ImageDraw.Draw(image)
+    for number, (label, first, last) in enumerate(labels):
+        left, bottom = label_origin(number)
+        top = (PAGE_HEIGHT - bottom - LABEL_HEIGHT) * scale
+        scanner, _, container_number = parse_label(label)
+        bars, width = code39_bars(label)
+        narrow = (LABEL_WIDTH - 2 * QUIET_ZONE) * scale / width
+        x = (left + QUIET_ZONE) * scale
+        bar_top = top + (LABEL_HEIGHT - 36 - BARCODE_HEIGHT) * scale
+        draw.text((x, top + 12 * scale), container_number, fill=0)
+        draw.text((x, top + 28 * scale), 'Scanner {:02d}   Batches {} - {}'.format(scanner, first, last), fill=0)
+        for start, bar_width in bars:
+            draw.rectangle([round(x + start * narrow), round(bar_top),
+                            round(x + (start + bar_width) * narrow) - 1, round(bar_top + BARCODE_HEIGHT * scale)],
+                           fill=0)
+        draw.text((x, top + (LABEL_HEIGHT - 30) * scale), label, fill=0)
+    image.save(filename, dpi=(PNG_DPI, PNG_DPI))
+    return filename
+
+
+# This function splits the labels into pages of LABELS_PER_PAGE.
+def label_pages(labels):
+    page = []
+    for label in labels:
+        page.append(label)
+        if len(page) == LABELS_PER_PAGE:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+# This function runs function on every page with a pool of worker processes and yields the results in page order. Only
+# a few pages per worker are sent to the pool at a time, so the pages are drawn about as fast as they are written.
+def render_pages(function, pages, workers=None, extra_args=lambda number: ()):
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for number, page in enumerate(pages):
+            pending.append(executor.submit(function, page, *extra_args(number)))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# This class writes a PDF one page at a time. The page objects are written as soon as they are added, and only their
+# positions in the file are kept until the page list, cross reference table and trailer are written by close().
+class PdfWriter:
+    CATALOG, PAGES, FONT_BOLD, FONT = 1, 2, 3, 4
+
+    def __init__(self, filename):
+        self.file = open(filename, 'wb')
+        self.offsets = {}
+        self.pages = []
+        self.next_object = 5
+        self.file.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self.write_object(self.CATALOG, '<< /Type /Catalog /Pages {} 0 R >>'.format(self.PAGES).encode())
+        self.write_object(self.FONT_BOLD, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold >>')
+        self.write_object(self.FONT, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+
+    def write_object(self, number, body):
+        self.offsets[number] = self.file.tell()
+        self.file.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+
+    def add_page(self, content):
+        contents, page = self.next_object, self.next_object + 1
+        self.next_object += 2
+        self.write_object(contents, b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(content) + content +
+                          b'\nendstream')
+        self.write_object(page, '<< /Type /Page /Parent {} 0 R /MediaBox [0 0 {} {}] /Contents {} 0 R /Resources << '
+                                '/Font << /F1 {} 0 R /F2 {} 0 R >> >> >>'.format(
+                                    self.PAGES, PAGE_WIDTH, PAGE_HEIGHT, contents, self.FONT_BOLD,
+                                    self.FONT).encode())
+        self.pages.append(page)
+
+    def close(self):
+        kids = ' '.join('{} 0 R'.format(page) for page in self.pages)
+        self.write_object(self.PAGES, '<< /Type /Pages /Kids [{}] /Count {} >>'.format(kids, len(self.pages)).encode())
+        xref = self.file.tell()
+        self.file.write(b'xref\n0 %d\n0000000000 65535 f \n' % self.next_object)
+        for number in range(1, self.next_object):
+            self.file.write(b'%010d 00000 n \n' % self.offsets[number])
+        self.file.write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' %
+                        (self.next_object, self.CATALOG, xref))
+        self.file.close()
+
+
+# This function writes the labels to a PDF and returns the number of pages.
+def write_pdf(labels, filename, workers=None):
+    writer = PdfWriter(filename)
+    for content in render_pages(render_pdf_page, label_pages(labels), workers):
+        writer.add_page(content)
+    writer.close()
+    return len(writer.pages)
+
+
+# This function writes the labels to PNG files in directory, one file per page, and returns the number of pages.
+def write_png(labels, directory, workers=None):
+    if importlib.util.find_spec('PIL') is None:
+        raise RuntimeError('PNG labels need Pillow (pip install Pillow). PDF labels do not.')
+    os.makedirs(directory, exist_ok=True)
+
+    def page_filename(number):
+        return (os.path.join(directory, 'Labels Page {:05d}.png'.format(number + 1)),)
+
+    pages = 0
+    for _ in render_pages(render_png_page, label_pages(labels), workers, page_filename):
+        pages += 1
+    return pages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Make Code 39 container labels for the ballot manifest.')
+    parser.add_argument('--scanners', type=int, required=True, help='the number of ICC scanners')
+    parser.add_argument('--first-batch', type=int, default=1, help='the first batch number (default: 1)')
+    parser.add_argument('--last-batch', type=int, required=True, help='the last batch number')
+    parser.add_argument('--format', choices=['pdf', 'png'], default='pdf', help='the output format (default: pdf)')
+    parser.add_argument('--output', default='ICC Labels.pdf', help='the PDF file, or the directory for PNG pages')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        labels = container_labels(args.scanners, args.first_batch, args.last_batch)
+        if args.format == 'png':
+            pages = write_png(labels, args.output, args.workers)
+        else:
+            pages = write_pdf(labels, args.output, args.workers)
+    except (ValueError, RuntimeError) as error:
+        print(error)
+        return 1
+    print('Wrote {} pages of labels to {} in {:.1f} seconds'.format(pages, args.output, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
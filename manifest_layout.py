@@ -0,0 +1,71 @@
+"""
+Ballot Manifest Layout
+
+The columns of the ballot manifest, the Container record, and the container barcode format, shared by every part of the
+software. This module only uses the standard library, so the GUI can start and read labels without loading pandas,
+which takes most of the start up time. The pandas parts of the manifest are in manifest_store.py, which also exports
+everything here.
+"""
+
+
+import math
+import sys
+from collections import namedtuple
+
+
+COLUMN_NAMES = ['County', 'Scanner', 'ICC Batch', 'Ballot Count', 'Container Number', 'Seal 1', 'Seal 2']
+INDEX_NAMES = ['County', 'Scanner', 'ICC Batch']
+BATCHES_PER_CONTAINER = 15
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+
+# A single container of ballots. The counts field is a tuple with one entry per batch in the container, starting with
+# the batch number in the batch field. Batches that are not in the manifest have a count of None.
+Container = namedtuple('Container', ['county', 'scanner', 'batch', 'container_number', 'seal_1', 'seal_2', 'counts'])
+
+
+# This function returns the first batch of the container that holds the given batch. Containers start at batch 1, 16,
+# 31 and so on.
+def container_start(batch):
+    return batch - (batch - 1) % BATCHES_PER_CONTAINER
+
+
+# This function splits the data from a scanned container barcode (3 of 9 format) into its three parts. The raw data
+# looks like: 01/L1/LICC 01-1
+# The split point is "/L". The first part is the Scanner Number, the second part is the first batch in the container,
+# and the third part is the name of the container. A ValueError is raised if the data is not a container barcode.
+def parse_label(text):
+    parts = text.split('/L')
+    if len(parts) != 3:
+        raise ValueError('A container label has 3 parts separated by "/L": ' + repr(text))
+    return int(parts[0]), int(parts[1]), parts[2]
+
+
+# This function turns a ballot count typed into the form (or read from a file) into an int. A blank count returns None,
+# meaning the batch is not used. Anything that is not a whole number of ballots raises a ValueError.
+def parse_count(value):
+    # A pandas missing value can only come from pandas, so pandas is only checked for once it has been imported.
+    pandas = sys.modules.get('pandas')
+    if value is None or (pandas is not None and value is pandas.NA):
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        if not value:
+            return None
+        if not value.isdigit():
+            raise ValueError('Ballot Count must be a whole number: ' + repr(value))
+        return int(value)
+    if value < 0 or value != int(value):
+        raise ValueError('Ballot Count must be a whole number: ' + repr(value))
+    return int(value)
+
+
+# This function builds the barcode data for a container. It is the reverse of parse_label().
+def format_label(scanner, batch, container_number):
+    return '{:02d}/L{}/L{}'.format(scanner, batch, container_number)
+
+
+# This function returns True if filename is an SQLite manifest rather than a .csv manifest.
+def is_sqlite_manifest(filename):
+    return filename.lower().endswith(SQLITE_EXTENSIONS)
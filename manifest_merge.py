@@ -0,0 +1,187 @@
+"""
+Statewide Ballot Manifest Merge
+
+The state audit needs the manifests of every county in a single file, sorted by County, Scanner and ICC Batch. This
+script combines many county manifest .csv files into one statewide manifest without ever holding all of them in memory.
+
+Each county file is read, checked and normalized by a pool of worker processes:
+
+    - it must have every manifest column (other columns are dropped)
+    - County, Scanner and ICC Batch must be filled in, and Scanner and ICC Batch must be whole numbers
+    - ballot counts must be whole numbers (see manifest_store.apply_schema)
+    - the same batch cannot appear twice
+    - text is trimmed, blank seals are written as blank
+
+Each worker writes its rows for each county to a sorted temporary file and reports the county totals (batches,
+containers and ballots) as soon as it is done. The sorted files are then merged into the statewide file one row at a
+time: a county that came from a single file is copied straight across, and a county split over several files is merged
+with a k-way merge (heapq.merge), so only one row per file is held in memory. The same batch in two county files is an
+error that names both files. The statewide file is written to a temporary file and renamed into place, so a failed merge
+never leaves a partial statewide manifest. If any county file fails a check, nothing is written.
+
+Usage:
+    python manifest_merge.py Counties/*.csv --output "Statewide Manifest.csv"
+"""
+
+
+import argparse
+import csv
+import heapq
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from manifest_store import COLUMN_NAMES, INDEX_NAMES, apply_schema, container_start
+
+
+# This function reads one county manifest .csv, checks and normalizes it, and writes the rows of each county in it to a
+# sorted .csv in directory. It runs in a worker process. It returns a list with one dictionary of totals for each
+# county, including the name of its sorted file, or raises ValueError describing the first problem found.
+def prepare_county(filename, directory):
+    df = pd.read_csv(filename, dtype=str, keep_default_na=False, skipinitialspace=True)
+    missing = [column for column in COLUMN_NAMES if column not in df]
+    if missing:
+        raise ValueError('missing columns: ' + ', '.join(missing))
+    df = df[COLUMN_NAMES].apply(lambda column: column.str.strip())
+    for column in INDEX_NAMES:
+        blank = df[column] == ''
+        if blank.any():
+            raise ValueError('{} is blank on {} rows, the first on line {}'.format(
+                column, int(blank.sum()), int(blank.idxmax()) + 2))
+    for column in ('Scanner', 'ICC Batch'):
+        numbers = pd.to_numeric(df[column], errors='coerce')
+        invalid = numbers.isna() | (numbers % 1 > 0)
+        if invalid.any():
+            raise ValueError('{} is not a whole number on line {}: {!r}'.format(
+                column, int(invalid.idxmax()) + 2, df[column][invalid.idxmax()]))
+    df = apply_schema(df.replace({'Ballot Count': {'': None}}))
+    duplicated = df.duplicated(INDEX_NAMES, keep='first')
+    if duplicated.any():
+        row = df[duplicated].iloc[0]
+        raise ValueError('scanner {} batch {} of {} is in the file more than once'.format(
+            row['Scanner'], row['ICC Batch'], row['County']))
+
+    counties = []
+    for county, rows in df.sort_values(INDEX_NAMES, kind='stable').groupby('County', observed=True, sort=True):
+        handle, sorted_file = tempfile.mkstemp(prefix='county-', suffix='.csv', dir=directory)
+        with os.fdopen(handle, 'w', newline='', encoding='utf-8') as county_file:
+            rows.to_csv(county_file, index=False, header=False)
+        starts = container_start(rows['ICC Batch'].astype(int))
+        counties.append({'county': str(county), 'source': filename, 'file': sorted_file, 'batches': len(rows),
+                         'containers': len(set(zip(rows['Scanner'], starts))),
+                         'ballots': int(rows['Ballot Count'].sum())})
+    return counties
+
+
+# This function returns the sort key of a row read from a sorted county file.
+def row_key(row):
+    return row[0], int(row[1]), int(row[2])
+
+
+# This function returns the rows of a sorted county file as (sort key, part, row) tuples, so the merge can tell which
+# file each row came from.
+def tagged_rows(county_file, part):
+    for row in csv.reader(county_file):
+        yield row_key(row), part, row
+
+
+# This function writes the rows of one county to the statewide file. A county from a single file is copied as it is,
+# and a county from several files is merged row by row. It returns the number of containers in the county, or raises
+# ValueError naming both files if a batch is in more than one of them.
+def write_county(parts, output_file):
+    if len(parts) == 1:
+        with open(parts[0]['file'], newline='', encoding='utf-8') as county_file:
+            shutil.copyfileobj(county_file, output_file)
+        return parts[0]['containers']
+    writer = csv.writer(output_file, lineterminator='\n')
+    files = [open(part['file'], newline='', encoding='utf-8') for part in parts]
+    try:
+        containers = 0
+        last_key = last_part = last_container = None
+        for key, part, row in heapq.merge(*[tagged_rows(county_file, part) for part, county_file in enumerate(files)]):
+            if key == last_key:
+                raise ValueError('scanner {} batch {} of {} is in both {} and {}'.format(
+                    key[1], key[2], key[0], parts[last_part]['source'], parts[part]['source']))
+            container = (key[1], container_start(key[2]))
+            if container != last_container:
+                containers += 1
+            last_key, last_part, last_container = key, part, container
+            writer.writerow(row)
+        return containers
+    finally:
+        for county_file in files:
+            county_file.close()
+
+
+def print_totals(label, totals):
+    print('{:<28}{:>10,} batches {:>9,} containers {:>12,} ballots'.format(
+        label, totals['batches'], totals['containers'], totals['ballots']))
+
+
+# This function merges the county manifests in filenames into the statewide manifest output. Totals are printed for each
+# county as it is checked and as it is written. It returns a dictionary of totals for each county, or None if any county
+# file failed a check or a batch is in more than one file (in which case nothing is written).
+def merge_manifests(filenames, output, workers=None):
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output))) as directory:
+        parts = {}
+        failed = False
+        with ProcessPoolExecutor(workers) as executor:
+            futures = {executor.submit(prepare_county, filename, directory): filename for filename in filenames}
+            for future in as_completed(futures):
+                try:
+                    counties = future.result()
+                except ValueError as error:
+                    print('{}: {}'.format(futures[future], error))
+                    failed = True
+                    continue
+                for county in counties:
+                    parts.setdefault(county['county'], []).append(county)
+                    print_totals('Checked {}'.format(county['county']), county)
+        if failed:
+            print('No statewide manifest was written because a county manifest failed its checks')
+            return None
+
+        totals = {}
+        handle, temp_name = tempfile.mkstemp(prefix='.statewide-', suffix='.csv.tmp', dir=directory)
+        try:
+            with os.fdopen(handle, 'w', newline='', encoding='utf-8') as output_file:
+                output_file.write(','.join(COLUMN_NAMES) + '\n')
+                for county in sorted(parts):
+                    totals[county] = {'batches': sum(part['batches'] for part in parts[county]),
+                                      'containers': write_county(parts[county], output_file),
+                                      'ballots': sum(part['ballots'] for part in parts[county])}
+                    print_totals('Wrote {}'.format(county), totals[county])
+                output_file.flush()
+                os.fsync(output_file.fileno())
+        except ValueError as error:
+            print(error)
+            print('No statewide manifest was written because a batch is in more than one county manifest')
+            return None
+        os.replace(temp_name, output)
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Merge county ballot manifests into one statewide manifest.')
+    parser.add_argument('manifests', nargs='+', help='the county manifest .csv files')
+    parser.add_argument('--output', default='Statewide Manifest.csv', help='the statewide manifest to write')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    totals = merge_manifests(args.manifests, args.output, args.workers)
+    if totals is None:
+        return 1
+    statewide = {name: sum(county[name] for county in totals.values()) for name in ('batches', 'containers', 'ballots')}
+    print_totals('Statewide ({} counties)'.format(len(totals)), statewide)
+    print('Wrote {} in {:.1f} seconds'.format(args.output, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""
+Ballot Manifest Metrics
+
+When an operator says the Save button is slow, these metrics show where the time went. Each operator action (scanning
+a label, saving, removing, loading a manifest, exporting a .csv) is timed as a whole, and the parts of it spent on
+DataFrame work ('df') and on reading or writing files ('io') are timed separately. Whatever is left is counted as 'ui',
+the time tkinter and the rest of the handler took. The clock is stopped while a dialog waits for the operator (see
+Metrics.paused()), so the times show how long the software took, not how long the operator took to answer. The
+background writer's work is timed as its own actions, since it does not hold up the window.
+
+The last METRICS_WINDOW times of each action are kept, and are summarized as percentiles and a histogram. The summary
+can be written to a JSON metrics file or shown in the GUI under Help > Performance.
+
+Metrics are off unless METRICS.enable() is called (the GUI does this when started with --metrics). While they are off,
+each timed action costs a single attribute check.
+"""
+
+
+import bisect
+import functools
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from collections import deque
+
+
+METRICS_WINDOW = 1000
+SECTIONS = ('ui', 'df', 'io')
+# The upper edge of each histogram bucket in milliseconds. The last bucket holds everything slower.
+BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+# This class is returned instead of a timer while metrics are off, so timing an action does nothing.
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+# This class times one action. The df and io sections timed on the same thread while the action is running are
+# subtracted from the total to give the ui time.
+class ActionTimer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.sections = {'df': 0.0, 'io': 0.0}
+        self.section_depth = 0
+        self.paused = 0.0
+
+    def __enter__(self):
+        self.outer = getattr(self.metrics.local, 'action', None)
+        self.metrics.local.action = self
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        total = time.perf_counter() - self.start - self.paused
+        self.metrics.local.action = self.outer
+        self.metrics.record(self.name, total, self.sections)
+        return False
+
+
+# This class times a df or io section of the action running on this thread. Only the outermost section is counted, so
+# a section inside another one is not counted twice.
+class SectionTimer:
+    def __init__(self, action, kind):
+        self.action = action
+        self.kind = kind
+
+    def __enter__(self):
+        self.action.section_depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.action.section_depth -= 1
+        if self.action.section_depth == 0:
+            self.action.sections[self.kind] += time.perf_counter() - self.start
+        return False
+
+
+# This class stops the clock of the action running on this thread, for example while a dialog waits for the operator.
+class PauseTimer:
+    def __init__(self, action):
+        self.action = action
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.action.paused += time.perf_counter() - self.start
+        return False
+
+
+class Metrics:
+    def __init__(self, window=METRICS_WINDOW):
+        self.enabled = False
+        self.window = window
+        self.filename = None
+        self.write_error = None
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    # This method turns the metrics on. If filename is given, write() saves the summary there.
+    def enable(self, filename=None):
+        self.filename = filename
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    # This method returns a context manager that times an action with the given name.
+    def timer(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return ActionTimer(self, name)
+
+    # This method returns a context manager that times a 'df' or 'io' section of the action running on this thread. It
+    # does nothing if no action is being timed.
+    def section(self, kind):
+        if not self.enabled:
+            return NULL_TIMER
+        action = getattr(self.local, 'action', None)
+        if action is None:
+            return NULL_TIMER
+        return SectionTimer(action, kind)
+
+    # This method returns a context manager that leaves its time out of the action running on this thread. It is used
+    # around dialogs, so the time an operator takes to answer one is not counted as 'ui'.
+    def paused(self):
+        if not self.enabled:
+            return NULL_TIMER
+        action = getattr(self.local, 'action', None)
+        if action is None:
+            return NULL_TIMER
+        return PauseTimer(action)
+
+    # This method adds one timing (in seconds) to the rolling window of the action.
+    def record(self, name, total, sections):
+        sample = (total * 1000, max(0.0, total - sections['df'] - sections['io']) * 1000, sections['df'] * 1000,
+                  sections['io'] * 1000)
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(sample)
+
+    # This method summarizes the rolling window of every action: the number of times, the percentiles and the mean time
+    # in each section, all in milliseconds, and a histogram of the total times.
+    def summary(self):
+        with self.lock:
+            samples = {name: list(values) for name, values in self.samples.items()}
+        summary = {}
+        for name, values in sorted(samples.items()):
+            totals = sorted(value[0] for value in values)
+            histogram = [0] * (len(BUCKETS_MS) + 1)
+            for total in totals:
+                histogram[bisect.bisect_left(BUCKETS_MS, total)] += 1
+            summary[name] = {'count': len(totals),
+                             'p50_ms': totals[len(totals) // 2],
+                             'p95_ms': totals[min(len(totals) - 1, int(len(totals) * 0.95))],
+                             'p99_ms': totals[min(len(totals) - 1, int(len(totals) * 0.99))],
+                             'max_ms': totals[-1]}
+            for position, section in enumerate(SECTIONS, start=1):
+                summary[name]['mean_{}_ms'.format(section)] = statistics.fmean(value[position] for value in values)
+            summary[name]['histogram'] = {'<={:g}ms'.format(edge): count for edge, count
+                                          in zip(BUCKETS_MS, histogram)}
+            summary[name]['histogram']['>{:g}ms'.format(BUCKETS_MS[-1])] = histogram[-1]
+        return summary
+
+    # This method returns the summary as a text table for the debug panel.
+    def report(self):
+        if not self.enabled:
+            return 'Performance metrics are off. Start the software with --metrics to turn them on.'
+        summary = self.summary()
+        if not summary:
+            return 'Nothing has been timed yet.'
+        lines = ['{:<18}{:>7}{:>10}{:>10}{:>10}{:>10}{:>9}{:>9}{:>9}'.format(
+            'Action', 'Count', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'ui ms', 'df ms', 'io ms')]
+        for name, values in summary.items():
+            lines.append('{:<18}{count:>7}{p50_ms:>10.1f}{p95_ms:>10.1f}{p99_ms:>10.1f}{max_ms:>10.1f}'
+                         '{mean_ui_ms:>9.1f}{mean_df_ms:>9.1f}{mean_io_ms:>9.1f}'.format(name[:17], **values))
+        lines.append('')
+        lines.append('ui, df and io are the mean time of each action spent in the window, on DataFrames and on files.')
+        return '\n'.join(lines)
+
+    # This method writes the summary to the metrics file as JSON. The file is replaced in one step, so a program reading
+    # it never sees half of it. Metrics must never stop the software, so if the file cannot be written the error is
+    # kept in self.write_error and False is returned instead of raising it.
+    def write(self, filename=None):
+        filename = filename or self.filename
+        if not self.enabled or filename is None:
+            return False
+        temp_name = None
+        try:
+            directory = os.path.dirname(os.path.abspath(filename))
+            handle, temp_name = tempfile.mkstemp(prefix='.metrics-', suffix='.json.tmp', dir=directory)
+            with os.fdopen(handle, 'w') as temp_file:
+                json.dump({'written': time.strftime('%Y-%m-%dT%H:%M:%S'), 'window': self.window,
+                           'actions': self.summary()}, temp_file, indent=2)
+            os.replace(temp_name, filename)
+        except OSError as error:
+            self.write_error = error
+            if temp_name is not None and os.path.exists(temp_name):
+                os.remove(temp_name)
+            return False
+        self.write_error = None
+        return True
+
+
+# The metrics shared by the whole program.
+METRICS = Metrics()
+
+
+# This decorator times every call of a function (such as a GUI button handler) as an action with the given name.
+def timed(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return function(*args, **kwargs)
+            with ActionTimer(METRICS, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
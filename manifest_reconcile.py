@@ -0,0 +1,248 @@
+"""
+Ballot Manifest Reconciliation
+
+After counting, every ICC batch the tabulation system reports must be in the ballot manifest with the same ballot
+count, and every batch in the manifest must be reported by the tabulation system. This module compares a tabulation
+batch export (a .csv with a row for each batch) with the manifest and reports:
+
+    Not in manifest            a batch the tabulation system reports that is missing from the manifest
+    Not in tabulation          an extra batch in the manifest that the tabulation system does not report
+    Count mismatch             a batch whose ballot count differs between the two
+    Duplicate in tabulation    a batch the tabulation system reports more than once
+    Invalid row                a row of the export with a blank County, or a Scanner or ICC Batch that is not a
+                               whole number
+
+The comparison is a hash join on County, Scanner and ICC Batch. The manifest batches are loaded into a single index of
+64 bit keys, and the export is read a chunk of CHUNK_ROWS rows at a time and looked up in it, so an export with
+millions of rows never has to fit in memory. Only the batches of the manifest that have been seen are remembered
+between chunks. Differences are written to the report as each chunk is finished.
+
+The export columns are found by name (see EXPORT_COLUMNS). If the export has no County column, every row is taken to
+be from the county of the manifest. Reconciling is available from the File menu in the GUI and from the command line:
+    python manifest_reconcile.py "Ballot Manifest.csv" "Tabulation Export.csv" --output "Reconciliation.csv"
+"""
+
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from manifest_store import INDEX_NAMES, read_manifest
+
+
+CHUNK_ROWS = 250000
+RESULTS = ['Not in manifest', 'Not in tabulation', 'Count mismatch', 'Duplicate in tabulation', 'Invalid row']
+RECONCILE_COLUMNS = ['Result', 'County', 'Scanner', 'ICC Batch', 'Container Number', 'Manifest Count',
+                     'Tabulation Count']
+# The names each manifest column may have in a tabulation export. Names are matched without regard to case.
+EXPORT_COLUMNS = {'County': ['County', 'Jurisdiction'],
+                  'Scanner': ['Scanner', 'Tabulator', 'Tabulator Id'],
+                  'ICC Batch': ['ICC Batch', 'Batch', 'Batch Id'],
+                  'Ballot Count': ['Ballot Count', 'Ballots', 'Ballot Total']}
+MAX_SCANNER = 2 ** 16 - 1
+MAX_BATCH = 2 ** 32 - 1
+
+
+# This function returns the join key of each batch: the county's position in counties, the scanner and the batch
+# packed into one 64 bit number. A county that is not in counties (position -1) gives a key that matches nothing.
+def batch_keys(county_codes, scanners, batches):
+    return (np.asarray(county_codes, dtype=np.int64) << 48) | (np.asarray(scanners, dtype=np.int64) << 32) | \
+        np.asarray(batches, dtype=np.int64)
+
+
+# This function finds the export columns holding each manifest column. The names given in columns (a dictionary from
+# manifest column to export column) are used first, then the names in EXPORT_COLUMNS. County maps to None if the export
+# has no county column. A ValueError is raised if any other column cannot be found.
+def export_columns(filename, columns=None):
+    header = pd.read_csv(filename, dtype=str, nrows=0, skipinitialspace=True).columns
+    by_name = {str(name).strip().lower(): name for name in header}
+    found = {}
+    for column, names in EXPORT_COLUMNS.items():
+        if columns and columns.get(column):
+            names = [columns[column]]
+        found[column] = next((by_name[name.lower()] for name in names if name.lower() in by_name), None)
+        if found[column] is None and column != 'County':
+            raise ValueError('The tabulation export has no {} column (looked for {})'.format(
+                column, ', '.join(names)))
+    return found
+
+
+# This function returns a data frame of results in the RECONCILE_COLUMNS layout.
+def result_frame(result, county, scanner, batch, container, manifest_count, tabulation_count):
+    return pd.DataFrame({'Result': result, 'County': county, 'Scanner': scanner, 'ICC Batch': batch,
+                         'Container Number': container,
+                         'Manifest Count': pd.Series(manifest_count, dtype='float64').astype('Int64'),
+                         'Tabulation Count': pd.Series(tabulation_count, dtype='float64').astype('Int64')},
+                        columns=RECONCILE_COLUMNS)
+
+
+# This function returns a column of the export as a float array. Values that are not numbers become NaN.
+def export_numbers(column):
+    if pd.api.types.is_numeric_dtype(column):
+        return column.to_numpy(dtype=float, na_value=np.nan)
+    return pd.to_numeric(column.astype(str).str.strip(), errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+
+# This function returns the values of an export column as they were written in the file, for the report. Numbers read
+# by read_csv are written without a decimal point.
+def export_text(column):
+    if pd.api.types.is_float_dtype(column):
+        return column.astype('Int64').astype(str).to_numpy() if (column.dropna() % 1 == 0).all() else \
+            column.astype(str).to_numpy()
+    return column.astype(str).str.strip().to_numpy()
+
+
+# This class compares a manifest data frame (indexed by County, Scanner and ICC Batch or not) with a tabulation export.
+# results() yields the differences a chunk at a time, and self.totals counts the rows read and each kind of result.
+class Reconciliation:
+    def __init__(self, df, export_file, columns=None, chunksize=CHUNK_ROWS):
+        if list(df.index.names) == INDEX_NAMES:
+            df = df.reset_index()
+        self.export_file = export_file
+        self.chunksize = chunksize
+        self.columns = export_columns(export_file, columns)
+        self.county = df['County'].astype(str).str.strip().to_numpy(dtype=object)
+        self.counties = pd.Index(pd.unique(self.county))
+        if self.columns['County'] is None and len(self.counties) > 1:
+            raise ValueError('The tabulation export has no County column, so the manifest must hold a single county')
+        self.scanner = df['Scanner'].to_numpy(dtype=np.int64)
+        self.batch = df['ICC Batch'].to_numpy(dtype=np.int64)
+        self.container = df['Container Number'].astype(object).to_numpy()
+        self.counts = pd.to_numeric(df['Ballot Count'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        self.keys = pd.Index(batch_keys(self.counties.get_indexer(self.county), self.scanner, self.batch))
+        if not self.keys.is_unique:
+            raise ValueError('The manifest has the same batch more than once. Run the manifest check to find it.')
+        self.totals = {'Manifest batches': len(df), 'Tabulation rows': 0, 'Matched': 0}
+        self.totals.update(dict.fromkeys(RESULTS, 0))
+
+    # This method returns the results for the manifest batches at positions.
+    def manifest_results(self, result, positions, tabulation_count=None):
+        return result_frame(result, self.county[positions], self.scanner[positions], self.batch[positions],
+                            self.container[positions], self.counts[positions],
+                            np.full(len(positions), np.nan) if tabulation_count is None else tabulation_count)
+
+    # This method compares one chunk of the export with the manifest. seen marks the manifest batches already reported
+    # by earlier rows of the export. Numbers are parsed by read_csv; a column is only parsed again as text when some
+    # of its values were not numbers. County is read as a category, so only its distinct names are trimmed. A blank
+    # County has the category code -1, which must not be used to index the categories, and makes the row invalid.
+    def compare_chunk(self, chunk, seen):
+        if self.columns['County'] is None:
+            county = np.full(len(chunk), self.counties[0] if len(self.counties) else '', dtype=object)
+            county_codes = np.zeros(len(chunk), dtype=np.int64)
+            blank = np.zeros(len(chunk), dtype=bool)
+        else:
+            names = chunk[self.columns['County']]
+            trimmed = names.cat.categories.astype(str).str.strip()
+            codes = names.cat.codes.to_numpy()
+            blank = codes < 0
+            blank[~blank] = trimmed.to_numpy(dtype=object)[codes[~blank]] == ''
+            county = np.full(len(chunk), '', dtype=object)
+            county[~blank] = trimmed.to_numpy(dtype=object)[codes[~blank]]
+            county_codes = np.full(len(chunk), -1, dtype=np.int64)
+            county_codes[~blank] = self.counties.get_indexer(trimmed)[codes[~blank]]
+        scanner, batch, counts = (export_numbers(chunk[self.columns[column]])
+                                  for column in ('Scanner', 'ICC Batch', 'Ballot Count'))
+        valid = (~blank & (scanner % 1 == 0) & (scanner >= 0) & (scanner <= MAX_SCANNER) &
+                 (batch % 1 == 0) & (batch >= 0) & (batch <= MAX_BATCH))
+
+        positions = np.full(len(chunk), -1, dtype=np.int64)
+        positions[valid] = self.keys.get_indexer(batch_keys(county_codes[valid], scanner[valid], batch[valid]))
+        matched = positions >= 0
+        duplicate = np.zeros(len(chunk), dtype=bool)
+        duplicate[matched] = seen[positions[matched]] | pd.Series(positions[matched]).duplicated().to_numpy()
+        seen[positions[matched]] = True
+        first = matched & ~duplicate
+        mismatch = np.zeros(len(chunk), dtype=bool)
+        mismatch[first] = ~(self.counts[positions[first]] == counts[first])
+
+        results = []
+        for result, rows in (('Not in manifest', valid & ~matched), ('Invalid row', ~valid)):
+            if rows.any():
+                results.append(result_frame(result, county[rows], export_text(chunk[self.columns['Scanner']][rows]),
+                                            export_text(chunk[self.columns['ICC Batch']][rows]), None,
+                                            np.full(rows.sum(), np.nan), counts[rows]))
+        for result, rows in (('Count mismatch', mismatch), ('Duplicate in tabulation', duplicate)):
+            if rows.any():
+                results.append(self.manifest_results(result, positions[rows], counts[rows]))
+        self.totals['Tabulation rows'] += len(chunk)
+        self.totals['Matched'] += int((first & ~mismatch).sum())
+        return results
+
+    # This method reads the export a chunk at a time and yields a data frame of the differences found in each chunk,
+    # followed by the manifest batches the export never reported.
+    def results(self):
+        seen = np.zeros(len(self.keys), dtype=bool)
+        usecols = [column for column in self.columns.values() if column is not None]
+        dtype = {self.columns['County']: 'category'} if self.columns['County'] is not None else None
+        for chunk in pd.read_csv(self.export_file, usecols=usecols, dtype=dtype, keep_default_na=False, na_values=[''],
+                                 skipinitialspace=True, chunksize=self.chunksize):
+            for frame in self.compare_chunk(chunk, seen):
+                self.totals[frame['Result'].iloc[0]] += len(frame)
+                yield frame
+        unreported = np.flatnonzero(~seen)
+        for start in range(0, len(unreported), self.chunksize):
+            frame = self.manifest_results('Not in tabulation', unreported[start:start + self.chunksize])
+            self.totals['Not in tabulation'] += len(frame)
+            yield frame
+
+    # This method writes every difference to a .csv report and returns the first keep of them as a data frame.
+    def write_report(self, filename, keep=1000):
+        kept = []
+        kept_rows = 0
+        with open(filename, 'w', newline='', encoding='utf-8') as report:
+            report.write(','.join(RECONCILE_COLUMNS) + '\n')
+            for frame in self.results():
+                frame.to_csv(report, header=False, index=False, lineterminator='\n')
+                if kept_rows < keep:
+                    kept.append(frame.head(keep - kept_rows))
+                    kept_rows += len(kept[-1])
+        return pd.concat(kept, ignore_index=True) if kept else result_frame([], [], [], [], [], [], [])
+
+    # This method returns a short summary of the totals.
+    def summary(self):
+        lines = ['Compared {:,} tabulation rows with {:,} manifest batches.'.format(
+            self.totals['Tabulation rows'], self.totals['Manifest batches'])]
+        lines.append('    {:<26}{:>12,}'.format('Matched', self.totals['Matched']))
+        for result in RESULTS:
+            lines.append('    {:<26}{:>12,}'.format(result, self.totals[result]))
+        if not self.differences():
+            lines.append('The manifest and the tabulation export agree.')
+        return '\n'.join(lines)
+
+    def differences(self):
+        return sum(self.totals[result] for result in RESULTS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare a ballot manifest with a tabulation system batch export.')
+    parser.add_argument('manifest', help='the ballot manifest .csv or .sqlite')
+    parser.add_argument('export', help='the tabulation batch export .csv')
+    parser.add_argument('--output', default='Reconciliation.csv', help='the .csv report of every difference')
+    parser.add_argument('--county-column', help='the County column of the export')
+    parser.add_argument('--scanner-column', help='the Scanner column of the export')
+    parser.add_argument('--batch-column', help='the ICC Batch column of the export')
+    parser.add_argument('--count-column', help='the Ballot Count column of the export')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS,
+                        help='export rows read at a time (default: {})'.format(CHUNK_ROWS))
+    args = parser.parse_args(argv)
+
+    columns = {'County': args.county_column, 'Scanner': args.scanner_column, 'ICC Batch': args.batch_column,
+               'Ballot Count': args.count_column}
+    start = time.perf_counter()
+    try:
+        reconciliation = Reconciliation(read_manifest(args.manifest), args.export, columns,
+                                        args.chunk_rows)
+        reconciliation.write_report(args.output)
+    except ValueError as error:
+        print(error)
+        return 1
+    print(reconciliation.summary())
+    print('Wrote {} in {:.1f} seconds'.format(args.output, time.perf_counter() - start))
+    return 1 if reconciliation.differences() else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+Ballot Manifest RLA Ballot Selection
+
+A Risk Limiting Audit draws random ballot numbers from 1 to N, where N is the total number of ballots in the manifest
+and the ballots are numbered in manifest order (County, Scanner, ICC Batch, then the position of the ballot within its
+batch). Each draw has to be turned into the batch and position of the ballot, and then into the container and seals
+the retrieval team has to open.
+
+BallotIndex keeps the containers of a manifest in sorted order with the running total of ballots at the end of each
+container. A list of draws is resolved all at once with a binary search over those totals (numpy searchsorted), so
+100,000 draws against a million batch manifest take a few milliseconds. When a container is saved or removed the index
+is changed in place and only the running totals after that container are added up again, so the index does not have to
+be rebuilt from the manifest.
+
+ManifestStore.ballot_index() builds the index the first time it is needed and keeps it up to date from then on.
+
+A pull list, grouped by container, can be made from the File menu in the GUI or from the command line, with a file of
+ballot numbers (one per line):
+    python manifest_rla.py "Ballot Manifest.csv" draws.txt --output "Pull List.csv"
+"""
+
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from manifest_store import BATCHES_PER_CONTAINER, open_manifest
+
+
+PULL_LIST_COLUMNS = ['Container Number', 'Seal 1', 'Seal 2', 'Scanner', 'ICC Batch', 'Ballot Position',
+                     'Ballot Number']
+
+
+# This function combines a scanner and the first batch of a container into a single number that sorts the same way as
+# the (Scanner, ICC Batch) key.
+def index_key(scanner, batch):
+    return np.int64(scanner) * 2 ** 32 + np.int64(batch)
+
+
+# This function returns the running total of ballots through each of the 15 batches of a container, so the last entry
+# is the number of ballots in the container. Unused batches add nothing.
+def container_totals(container):
+    totals = []
+    total = 0
+    for count in container.counts:
+        total += count or 0
+        totals.append(total)
+    return totals
+
+
+# This function returns the container number and seals of each container as an array with one row per container.
+def container_labels(containers):
+    labels = np.empty((len(containers), 3), dtype=object)
+    if len(containers):
+        labels[:] = [container[3:6] for container in containers]
+    return labels
+
+
+class BallotIndex:
+    def __init__(self, containers=()):
+        ordered = sorted(containers, key=lambda container: (container.scanner, container.batch))
+        self.keys = np.array([index_key(container.scanner, container.batch) for container in ordered], dtype=np.int64)
+        self.labels = container_labels(ordered)
+        self.within = np.array([container_totals(container) for container in ordered],
+                               dtype=np.int64).reshape(-1, BATCHES_PER_CONTAINER)
+        # ends[i] is the number of ballots up to the end of container i. Only the first `valid` entries are up to date;
+        # the rest are added up again the next time they are needed.
+        self.ends = np.zeros(len(ordered), dtype=np.int64)
+        self.valid = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    # This method saves a container into the index, replacing any container with the same scanner and first batch.
+    def update(self, container):
+        self.update_many([container])
+
+    # This method saves many containers at once. Containers already in the index are replaced where they are, and the
+    # new ones are inserted into the sorted arrays together, so a bulk import only moves the arrays once.
+    def update_many(self, containers):
+        latest = {(container.scanner, container.batch): container for container in containers}
+        if not latest:
+            return
+        ordered = [latest[key] for key in sorted(latest)]
+        keys = np.array([index_key(*key) for key in sorted(latest)], dtype=np.int64)
+        labels = container_labels(ordered)
+        within = np.array([container_totals(container) for container in ordered],
+                          dtype=np.int64).reshape(-1, BATCHES_PER_CONTAINER)
+        positions = np.searchsorted(self.keys, keys)
+        existing = positions < len(self.keys)
+        existing[existing] = self.keys[positions[existing]] == keys[existing]
+        if existing.any():
+            self.labels[positions[existing]] = labels[existing]
+            self.within[positions[existing]] = within[existing]
+        new = ~existing
+        if new.any():
+            inserted = positions[new]
+            self.keys = np.insert(self.keys, inserted, keys[new])
+            self.labels = np.insert(self.labels, inserted, labels[new], axis=0)
+            self.within = np.insert(self.within, inserted, within[new], axis=0)
+            self.ends = np.insert(self.ends, inserted, 0)
+        self.valid = min(self.valid, int(positions.min()))
+
+    # This method removes the container that starts at the given scanner and batch, if it is in the index.
+    def remove(self, scanner, batch):
+        key = index_key(scanner, batch)
+        position = int(np.searchsorted(self.keys, key))
+        if position == len(self.keys) or self.keys[position] != key:
+            return
+        self.keys = np.delete(self.keys, position)
+        self.labels = np.delete(self.labels, position, axis=0)
+        self.within = np.delete(self.within, position, axis=0)
+        self.ends = np.delete(self.ends, position)
+        self.valid = min(self.valid, position)
+
+    # This method returns the running totals, adding up only the containers after the first one that changed.
+    def cumulative(self):
+        if self.valid < len(self.ends):
+            before = self.ends[self.valid - 1] if self.valid else 0
+            self.ends[self.valid:] = before + np.cumsum(self.within[self.valid:, -1])
+            self.valid = len(self.ends)
+        return self.ends
+
+    # This method returns the total number of ballots in the manifest (N for the audit).
+    def total(self):
+        ends = self.cumulative()
+        return int(ends[-1]) if len(ends) else 0
+
+    # This method finds the ballots for a sorted array of ballot numbers and returns them in the PULL_LIST_COLUMNS
+    # layout. Searching for the ballot numbers in order is several times faster than searching in random order.
+    def resolve(self, draws):
+        total = self.total()
+        outside = (draws < 1) | (draws > total)
+        if outside.any():
+            raise ValueError('Ballot numbers must be from 1 to {}, found: {}'.format(
+                total, ', '.join(map(str, draws[outside][:5]))))
+        ends = self.cumulative()
+        rows = np.searchsorted(ends, draws, side='left')
+        within = self.within[rows]
+        offsets = draws - (ends[rows] - within[:, -1])
+        batch_offsets = (within < offsets[:, None]).sum(axis=1)
+        before = np.where(batch_offsets > 0, within[np.arange(len(rows)), batch_offsets - 1], 0)
+        labels = self.labels[rows]
+        return pd.DataFrame({'Container Number': pd.Series(labels[:, 0], dtype=object),
+                             'Seal 1': pd.Series(labels[:, 1], dtype=object),
+                             'Seal 2': pd.Series(labels[:, 2], dtype=object),
+                             'Scanner': self.keys[rows] >> 32,
+                             'ICC Batch': (self.keys[rows] & (2 ** 32 - 1)) + batch_offsets,
+                             'Ballot Position': offsets - before,
+                             'Ballot Number': draws}, columns=PULL_LIST_COLUMNS)
+
+    # This method finds the ballots for a list of ballot numbers (1 to total()). It returns a data frame in the
+    # PULL_LIST_COLUMNS layout with one row per draw, in the order the draws were given. A ValueError is raised if any
+    # ballot number is outside the manifest.
+    def locate(self, draws):
+        draws, inverse = np.unique(np.asarray(draws, dtype=np.int64).reshape(-1), return_inverse=True)
+        return self.resolve(draws).iloc[inverse].reset_index(drop=True)
+
+    # This method builds the pull list for the retrieval teams. The ballots are grouped by container, in manifest
+    # order, and a ballot drawn more than once is only listed once.
+    def pull_list(self, draws):
+        return self.resolve(np.unique(np.asarray(draws, dtype=np.int64).reshape(-1)))
+
+
+# This function reads ballot numbers from a text or .csv file with one number per line, in the first column. Lines that
+# are not numbers, such as a header, are skipped.
+def read_draws(filename):
+    column = pd.read_csv(filename, header=None, usecols=[0], dtype=str, skip_blank_lines=True)[0]
+    draws = pd.to_numeric(column.str.strip(), errors='coerce').dropna()
+    return draws.astype(np.int64).to_numpy()
+
+
+# This function writes the pull list to a .csv file, with a blank line between containers so each container can be
+# handed to a retrieval team separately.
+def write_pull_list(pull_list, filename):
+    with open(filename, 'w', newline='') as pull_file:
+        pull_file.write(','.join(PULL_LIST_COLUMNS) + '\n')
+        for _, ballots in pull_list.groupby(['Scanner', 'Container Number'], sort=False, dropna=False):
+            ballots.to_csv(pull_file, header=False, index=False)
+            pull_file.write('\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Find the ballots drawn for a Risk Limiting Audit.')
+    parser.add_argument('manifest', help='the ballot manifest .csv or .sqlite')
+    parser.add_argument('draws', nargs='?', help='a file of ballot numbers drawn by the RLA tool, one per line')
+    parser.add_argument('--output', default='Pull List.csv', help='where to write the pull list')
+    args = parser.parse_args(argv)
+
+    store = open_manifest(args.manifest)
+    start = time.perf_counter()
+    index = store.ballot_index()
+    print('{} ballots in {} containers (index built in {:.2f} seconds)'.format(
+        index.total(), len(index), time.perf_counter() - start))
+    if args.draws:
+        draws = read_draws(args.draws)
+        start = time.perf_counter()
+        try:
+            pull_list = index.pull_list(draws)
+        except ValueError as error:
+            print(error)
+            store.close_without_compacting()
+            return 1
+        print('Found {} ballots in {} containers in {:.1f} ms'.format(
+            len(pull_list), pull_list.groupby(['Scanner', 'Container Number'], dropna=False).ngroups,
+            (time.perf_counter() - start) * 1000))
+        write_pull_list(pull_list, args.output)
+        print('Pull list written to ' + args.output)
+    store.close_without_compacting()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
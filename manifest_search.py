@@ -0,0 +1,119 @@
+"""
+Ballot Manifest Search
+
+During a chain of custody check the audit staff have a seal number or a container number (such as ICC 01-3) in hand
+and need to find the container and its batches. SearchIndex keeps two dictionaries, one from each seal number (Seal 1
+and Seal 2) and one from each container number to the containers that use it, so a search is a dictionary lookup
+instead of a scan of the manifest. Seal numbers and container numbers are matched without regard to case or spaces at
+either end.
+
+The same index finds a seal that is already used on another container when a container is saved, without looking at
+the rest of the manifest.
+
+ManifestStore.search_index() builds the index the first time it is needed, and put(), remove() and upsert() keep it up
+to date from then on. An SQLite manifest (see manifest_sqlite.py) answers the same searches with indexed queries
+instead, so it never has to read the whole manifest. Searching is available on the Edit or Remove screen in the GUI
+and from the command line:
+    python manifest_search.py "Ballot Manifest.csv" A0012345 "ICC 01-3"
+"""
+
+
+import argparse
+import sys
+
+from manifest_layout import format_label
+
+
+# This function returns the form of a seal or container number that is used to look it up. Blank values return None
+# and are not indexed.
+def search_term(value):
+    if value is None:
+        return None
+    term = str(value).strip().upper()
+    return term or None
+
+
+class SearchIndex:
+    def __init__(self, containers=()):
+        self.seals = {}
+        self.container_numbers = {}
+        self.entries = {}
+        for container in containers:
+            self.add(container)
+
+    def __len__(self):
+        return len(self.entries)
+
+    # This method adds a container to the index, replacing what was indexed for the same scanner and first batch.
+    def add(self, container):
+        key = (container.scanner, container.batch)
+        self.remove(*key)
+        seals = {term for term in (search_term(container.seal_1), search_term(container.seal_2)) if term}
+        number = search_term(container.container_number)
+        for seal in seals:
+            self.seals.setdefault(seal, set()).add(key)
+        if number:
+            self.container_numbers.setdefault(number, set()).add(key)
+        self.entries[key] = (seals, number)
+
+    # This method removes the container that starts at the given scanner and batch from the index.
+    def remove(self, scanner, batch):
+        key = (scanner, batch)
+        seals, number = self.entries.pop(key, (set(), None))
+        for seal in seals:
+            self.discard(self.seals, seal, key)
+        if number:
+            self.discard(self.container_numbers, number, key)
+
+    @staticmethod
+    def discard(index, term, key):
+        keys = index.get(term)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[term]
+
+    # This method returns the sorted (scanner, first batch) keys of every container with a seal or container number
+    # matching text.
+    def find(self, text):
+        term = search_term(text)
+        if term is None:
+            return []
+        return sorted(self.seals.get(term, set()) | self.container_numbers.get(term, set()))
+
+    # This method returns the keys of the containers other than (scanner, batch) that use the given seal.
+    def seal_owners(self, seal, scanner=None, batch=None):
+        return sorted(self.seals.get(search_term(seal), set()) - {(scanner, batch)})
+
+
+# This function describes a container and its batches for the search results.
+def describe_container(container):
+    batches = ['    Batch {}: {}'.format(container.batch + offset, count)
+               for offset, count in enumerate(container.counts) if count is not None]
+    return '\n'.join(['{}  (Scanner {:02d}, first batch {}, seals {} / {}, label {})'.format(
+        container.container_number, container.scanner, container.batch, container.seal_1 or '-',
+        container.seal_2 or '-', format_label(container.scanner, container.batch, container.container_number))] +
+        batches)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Find containers in a ballot manifest by seal or container number.')
+    parser.add_argument('manifest', help='the ballot manifest .csv or .sqlite')
+    parser.add_argument('terms', nargs='+', help='seal numbers or container numbers to look up')
+    args = parser.parse_args(argv)
+
+    from manifest_store import open_manifest
+    store = open_manifest(args.manifest)
+    found = 0
+    for term in args.terms:
+        containers = store.search_containers(term)
+        print('{}: {} containers'.format(term, len(containers)))
+        for container in containers:
+            print(describe_container(container))
+        found += len(containers)
+    store.close_without_compacting()
+    return 0 if found else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""
+Ballot Manifest Server
+
+Only one program can safely write to a ballot manifest .csv at a time. The manifest server lets several workstations
+(one per ICC scanner, for example) enter containers into the same manifest. The server owns the ManifestStore and the
+workstations send it containers over a socket.
+
+The server handles one request at a time, so writes never overlap. Every container has a version number that goes up
+each time the container is saved or removed. A workstation sends the version it last saw with each change, and if
+another workstation changed the container in the meantime the change is refused as a conflict instead of silently
+overwriting it. A station that has not looked at a container sends no version, and that is only accepted for a container
+that does not exist yet. For a .csv manifest, changes from all workstations are handed to a background ManifestWriter,
+which writes everything that arrived together with a single sync to disk. The server answers each change as soon as its
+own journal record is synced, without waiting for compactions or for changes that arrived after it. An SQLite manifest
+is written as each change is made.
+
+The protocol is one line of JSON per request and one line of JSON per response. RemoteManifestStore is a client with the
+same methods as ManifestStore, so the GUI and scripts can use either one. If the connection fails, it is opened again
+for the next request.
+
+Anyone who can reach the server can change the manifest, so it only listens on this computer unless it is given a
+shared token (--token, or the MANIFEST_SERVER_TOKEN environment variable). Every request must then carry the same
+token, and a connection that sends a wrong one is closed. The token is sent as plain text, so the server should only
+be reachable on the trusted network of the counting room, never on a public interface.
+
+Usage:
+    python manifest_server.py "Ballot Manifest.csv" --port 8765
+    python manifest_server.py "Ballot Manifest.csv" --host 192.168.1.20 --port 8765 --token <shared token>
+"""
+
+
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import socket
+
+from manifest_layout import Container
+from manifest_metrics import METRICS
+
+
+DEFAULT_PORT = 8765
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+TOKEN_VARIABLE = 'MANIFEST_SERVER_TOKEN'
+
+
+# This exception is raised by RemoteManifestStore when another workstation changed a container since this workstation
+# last looked at it.
+class ManifestConflict(Exception):
+    pass
+
+
+def container_to_dict(container):
+    return None if container is None else container._asdict()
+
+
+def container_from_dict(data):
+    return None if data is None else Container(**dict(data, counts=tuple(data['counts'])))
+
+
+class ManifestServer:
+    def __init__(self, store, host='127.0.0.1', port=DEFAULT_PORT, compact_interval=5 * 60, write_timeout=20,
+                 token=None):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.token = token
+        self.compact_interval = compact_interval
+        self.write_timeout = write_timeout
+        self.versions = {}
+        self.server = None
+        self.compactor = None
+
+    # This method starts listening for workstations. The store's writer thread is started here if it is not already
+    # running.
+    async def start(self):
+        if self.store.writer is None:
+            self.store.start_writer()
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.compactor = asyncio.get_running_loop().create_task(self.compact_periodically())
+        return self
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    # This method stops listening and writes the compacted manifest.
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.compactor is not None:
+            self.compactor.cancel()
+            self.compactor = None
+        await asyncio.get_running_loop().run_in_executor(None, self.store.close)
+
+    async def compact_periodically(self):
+        while self.server is not None:
+            await asyncio.sleep(self.compact_interval)
+            self.store.compact()
+
+    # This method returns True if the request carries the server's token, or the server has no token.
+    def authorized(self, request):
+        if self.token is None:
+            return True
+        token = request.get('token') if isinstance(request, dict) else None
+        return isinstance(token, str) and hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8'))
+
+    # This method reads requests from one workstation until it disconnects. A request without the right token is
+    # answered and the connection is closed.
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not self.authorized(request):
+                        writer.write(json.dumps({'ok': False, 'error': 'unauthorized',
+                                                 'message': 'The manifest server token is wrong'}).encode('utf-8') +
+                                     b'\n')
+                        await writer.drain()
+                        break
+                    response = await self.handle_request(request)
+                except (ValueError, KeyError, TypeError) as error:
+                    response = {'ok': False, 'error': 'bad request', 'message': str(error)}
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # This method carries out a single request. Everything up to the point where the change is handed to the writer
+    # runs without awaiting, so no other request can change the store in between.
+    async def handle_request(self, request):
+        op = request['op']
+        if op == 'info':
+            return {'ok': True, 'county': self.store.county, 'containers': len(self.store)}
+        if op == 'search':
+            return {'ok': True, 'containers': [container_to_dict(container)
+                                               for container in self.store.search_containers(request['text'])]}
+        key = (int(request['scanner']), int(request['batch']))
+        version = self.versions.get(key, 0)
+        if op == 'get':
+            return {'ok': True, 'version': version, 'container': container_to_dict(self.store.get(*key))}
+        if op == 'seal_conflicts':
+            return {'ok': True, 'conflicts': [[seal, container_to_dict(container)] for seal, container
+                                              in self.store.seal_conflicts(key[0], key[1], *request['seals'])]}
+        if op not in ('put', 'remove'):
+            raise ValueError('Unknown request: ' + op)
+        # A station that has not looked at the container sends no version, which is only allowed for a new container.
+        expected = request.get('version')
+        if expected != version if expected is not None else self.store.get(*key) is not None:
+            return {'ok': False, 'error': 'conflict', 'version': version,
+                    'container': container_to_dict(self.store.get(*key)),
+                    'message': 'This container was changed by another station. Scan the label again to see the '
+                               'latest entry.'}
+        if op == 'put':
+            self.store.put(key[0], key[1], request['container'], request['counts'], request['seal_1'],
+                           request['seal_2'])
+        elif self.store.remove(*key) is None:
+            return {'ok': True, 'version': version}
+        self.versions[key] = version + 1
+        if self.store.writer is not None:
+            written = await asyncio.get_running_loop().run_in_executor(
+                None, self.store.writer.wait_for, self.store.writer.queued, self.write_timeout)
+            if not written:
+                return {'ok': False, 'error': 'not saved', 'version': version + 1,
+                        'message': 'The server could not write the change to its journal ({}).'.format(
+                            self.store.writer.error)}
+        return {'ok': True, 'version': version + 1}
+
+
+# This class is a ManifestStore that lives on a manifest server. It remembers the version of every container it has
+# looked at and sends that version with each change, so a change that would overwrite another station's work raises
+# ManifestConflict. The token, if the server has one, is sent with every request.
+class RemoteManifestStore:
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, timeout=30, token=None):
+        self.address = '{}:{}'.format(host, port)
+        self.filename = 'manifest server ' + self.address
+        self.writer = None
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.token = token
+        self.versions = {}
+        self.connection = None
+        self.stream = None
+        self.connect()
+        self.county = self.request({'op': 'info'})['county']
+
+    def __len__(self):
+        return self.request({'op': 'info'})['containers']
+
+    def __contains__(self, key):
+        return self.get(*key) is not None
+
+    def connect(self):
+        self.connection = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.stream = self.connection.makefile('rwb')
+
+    # This method sends one request and returns the response. If the connection fails (including a timeout, after which
+    # the socket cannot be used again) it is closed, the error is raised, and the next request opens a new connection.
+    def request(self, request):
+        message = dict(request, token=self.token) if self.token else request
+        try:
+            if self.stream is None:
+                self.connect()
+            with METRICS.section('io'):
+                self.stream.write(json.dumps(message).encode('utf-8') + b'\n')
+                self.stream.flush()
+                line = self.stream.readline()
+            if not line:
+                raise ConnectionError('The manifest server at {} closed the connection'.format(self.address))
+        except OSError:
+            self.close()
+            raise
+        response = json.loads(line)
+        if 'scanner' in request and 'version' in response:
+            self.versions[(request['scanner'], request['batch'])] = response['version']
+        if response['ok']:
+            return response
+        if response['error'] == 'conflict':
+            raise ManifestConflict(response['message'])
+        if response['error'] == 'not saved':
+            raise OSError(response['message'])
+        if response['error'] == 'unauthorized':
+            self.close()
+            raise PermissionError(response['message'])
+        raise ValueError(response['message'])
+
+    def get(self, scanner, batch):
+        response = self.request({'op': 'get', 'scanner': scanner, 'batch': batch})
+        return container_from_dict(response['container'])
+
+    def put(self, scanner, batch, container_number, counts, seal_1, seal_2):
+        counts = list(counts)
+        self.request({'op': 'put', 'scanner': scanner, 'batch': batch, 'container': container_number,
+                      'counts': counts, 'seal_1': seal_1, 'seal_2': seal_2,
+                      'version': self.versions.get((scanner, batch))})
+        return Container(self.county, scanner, batch, container_number, seal_1, seal_2, tuple(counts))
+
+    def remove(self, scanner, batch):
+        container = self.get(scanner, batch)
+        if container is not None:
+            self.request({'op': 'remove', 'scanner': scanner, 'batch': batch,
+                          'version': self.versions.get((scanner, batch))})
+        return container
+
+    def search_containers(self, text):
+        response = self.request({'op': 'search', 'text': text})
+        return [container_from_dict(container) for container in response['containers']]
+
+    def seal_conflicts(self, scanner, batch, *seals):
+        response = self.request({'op': 'seal_conflicts', 'scanner': scanner, 'batch': batch, 'seals': list(seals)})
+        return [(seal, container_from_dict(container)) for seal, container in response['conflicts']]
+
+    # The server compacts the manifest itself, so there is nothing to do here.
+    def compact(self):
+        pass
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.connection.close()
+            self.stream = None
+            self.connection = None
+
+
+# This function parses a "host:port" address. The host defaults to this computer and the port to DEFAULT_PORT.
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    if not host:
+        host, port = port, ''
+    return host or '127.0.0.1', int(port) if port else DEFAULT_PORT
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Share a ballot manifest between several workstations.')
+    parser.add_argument('manifest', help='the ballot manifest .csv or .sqlite (created if it does not exist)')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='the address to listen on (default: 127.0.0.1). Use the address of the counting room '
+                             'network, not 0.0.0.0')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='the port to listen on')
+    parser.add_argument('--county', default='Arapahoe', help='the county for new manifests (default: Arapahoe)')
+    parser.add_argument('--token', default=os.environ.get(TOKEN_VARIABLE),
+                        help='the token workstations must send (default: the {} environment variable)'.format(
+                            TOKEN_VARIABLE))
+    args = parser.parse_args(argv)
+    if args.host not in LOCAL_HOSTS and not args.token:
+        parser.error('a --token is needed to listen on ' + args.host)
+
+    # The store is only imported here so that workstations using RemoteManifestStore do not have to load pandas.
+    from manifest_store import open_manifest, create_manifest
+    if os.path.exists(args.manifest):
+        store = open_manifest(args.manifest, args.county)
+    else:
+        store = create_manifest(args.manifest, args.county)
+
+    async def serve():
+        server = await ManifestServer(store, args.host, args.port, token=args.token or None).start()
+        print('Serving {} on {}:{}'.format(args.manifest, args.host, server.port))
+        try:
+            await server.serve_forever()
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
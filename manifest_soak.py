@@ -0,0 +1,148 @@
+"""
+Ballot Manifest Entry Form Soak Test
+
+This script drives the entry form the way a full day of scanning does, without anyone at the keyboard. It opens the GUI
+on a new manifest in a temporary folder, then for each container it scans a label, fills in the 15 ballot counts and
+both seals, and saves. After every group of scans it prints:
+
+    widgets     the number of tkinter widgets in the window
+    memory      the memory used by the process, where the operating system reports it
+    scan        the time from scanning a label until the form is ready for counts (median and 95th percentile)
+    save        the time from Save until the form is ready for the next label (median and 95th percentile)
+
+All of these should stay flat for the whole run. At the end the script prints PASS, or FAIL with the reason, and exits
+with status 1 on a failure. The run fails if the number of widgets grew at all, or if the memory grew by more than
+--max-memory-growth megabytes (the saved containers themselves take some memory) from the first report to the last.
+
+The GUI needs a display. Usage:
+    python manifest_soak.py --scans 5000 --report-every 500
+"""
+
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from tkinter import Tk
+
+from Ballot_Manifest import BallotManifestGui
+from manifest_layout import BATCHES_PER_CONTAINER, format_label
+
+
+# This function counts every widget in the window.
+def count_widgets(widget):
+    return 1 + sum(count_widgets(child) for child in widget.winfo_children())
+
+
+# This function returns the memory used by this process in megabytes, or None if it cannot be found.
+def process_memory():
+    if os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    try:
+        import resource
+    except ImportError:
+        return None
+    scale = 1e6 if sys.platform == 'darwin' else 1e3
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def percentile(times, fraction):
+    ordered = sorted(times)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+# This function compares the last report with the first and returns a message for each thing that grew too much. An
+# empty list means the run passed.
+def check_reports(reports, max_memory_growth):
+    if len(reports) < 2:
+        return ['At least two reports are needed to see growth (use more --scans or a smaller --report-every)']
+    first, last = reports[0], reports[-1]
+    failures = []
+    if last['widgets'] > first['widgets']:
+        failures.append('The number of widgets grew from {} to {}'.format(first['widgets'], last['widgets']))
+    if first['memory_mb'] is not None and last['memory_mb'] is not None:
+        growth = last['memory_mb'] - first['memory_mb']
+        if growth > max_memory_growth:
+            failures.append('The memory grew by {:.1f} MB, from {:.1f} MB to {:.1f} MB (the limit is {} MB)'.format(
+                growth, first['memory_mb'], last['memory_mb'], max_memory_growth))
+    return failures
+
+
+# This function scans, fills in and saves the given number of containers and returns one report row for each group of
+# report_every scans.
+def soak(root, gui, scans, report_every, scanners=10):
+    reports = []
+    scan_times = []
+    save_times = []
+    for number in range(scans):
+        scanner = number % scanners + 1
+        batch = 1 + (number // scanners) * BATCHES_PER_CONTAINER
+        label = format_label(scanner, batch, 'ICC {:02d}-{}'.format(scanner, number // scanners + 1))
+
+        start = time.perf_counter()
+        gui.scan_label.insert(0, label)
+        gui.load_label()
+        root.update()
+        scan_times.append((time.perf_counter() - start) * 1000)
+
+        for entry in gui.batch_entries:
+            entry.insert(0, '100')
+        gui.seal_entry_1.insert(0, 'A{:07d}'.format(number))
+        gui.seal_entry_2.insert(0, 'B{:07d}'.format(number))
+        start = time.perf_counter()
+        gui.submit_form()
+        root.update()
+        save_times.append((time.perf_counter() - start) * 1000)
+
+        if (number + 1) % report_every == 0:
+            reports.append({'scans': number + 1, 'widgets': count_widgets(root), 'memory_mb': process_memory(),
+                            'scan_median_ms': statistics.median(scan_times),
+                            'scan_p95_ms': percentile(scan_times, 0.95),
+                            'save_median_ms': statistics.median(save_times),
+                            'save_p95_ms': percentile(save_times, 0.95)})
+            scan_times = []
+            save_times = []
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scan and save containers in the entry form for a long session.')
+    parser.add_argument('--scans', type=int, default=5000, help='how many containers to scan (default: 5000)')
+    parser.add_argument('--report-every', type=int, default=500, help='scans between reports (default: 500)')
+    parser.add_argument('--max-memory-growth', type=float, default=25,
+                        help='megabytes the memory may grow between the first and last report (default: 25)')
+    args = parser.parse_args(argv)
+
+    from manifest_store import create_manifest
+    with tempfile.TemporaryDirectory() as directory:
+        root = Tk()
+        gui = BallotManifestGui(root)
+        gui.filename = os.path.join(directory, 'Soak Manifest.csv')
+        gui.store = create_manifest(gui.filename, gui.county)
+        gui.store.start_writer(gui.status_queue.put)
+        gui.load_to_form()
+        root.update()
+        try:
+            reports = soak(root, gui, args.scans, args.report_every)
+        finally:
+            gui.close_store()
+            root.destroy()
+
+    print('{:>7} {:>8} {:>10} {:>12} {:>10} {:>12} {:>10}'.format('scans', 'widgets', 'memory MB', 'scan median',
+                                                                    'scan p95', 'save median', 'save p95'))
+    for report in reports:
+        memory = '' if report['memory_mb'] is None else '{:.1f}'.format(report['memory_mb'])
+        print('{scans:>7} {widgets:>8} {memory:>10} {scan_median_ms:>9.2f} ms {scan_p95_ms:>7.2f} ms '
+              '{save_median_ms:>9.2f} ms {save_p95_ms:>7.2f} ms'.format(memory=memory, **report))
+    failures = check_reports(reports, args.max_memory_growth)
+    for failure in failures:
+        print(failure)
+    print('FAIL' if failures else 'PASS')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
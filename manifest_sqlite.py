@@ -0,0 +1,239 @@
+"""
+Ballot Manifest SQLite Storage
+
+A ballot manifest can be stored in an SQLite database file (.sqlite, .sqlite3 or .db) instead of a .csv. The database
+has one table, manifest, with the same columns as the .csv and a primary key on (County, Scanner, ICC Batch). Seal 1,
+Seal 2 and Container Number are also indexed (trimmed and in upper case, the same way manifest_search.py matches them),
+so a seal or container number search is an indexed query instead of a read of the whole manifest.
+
+SqliteManifestStore works like ManifestStore, but every save or remove is written straight to the database as a single
+transaction that only touches the 15 rows of that container, so there is no journal and no compaction. Opening the
+database does not read the manifest. Containers are looked up with the primary key as they are needed, and the whole
+manifest is only read when something needs all of it (such as exporting a .csv for the RLA tool).
+
+The manifest can be converted between the two formats from the command line:
+    python manifest_sqlite.py "Ballot Manifest.csv" "Ballot Manifest.sqlite"
+    python manifest_sqlite.py "Ballot Manifest.sqlite" "Ballot Manifest Export.csv"
+"""
+
+
+import argparse
+import os
+import sqlite3
+from collections.abc import MutableMapping
+
+import pandas as pd
+
+from manifest_metrics import METRICS
+from manifest_search import search_term
+from manifest_store import (ManifestStore, Container, COLUMN_NAMES, INDEX_NAMES, BATCHES_PER_CONTAINER, apply_schema,
+                            container_start, frame_to_containers, open_manifest, create_manifest)
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS manifest (
+    "County" TEXT NOT NULL,
+    "Scanner" INTEGER NOT NULL,
+    "ICC Batch" INTEGER NOT NULL,
+    "Ballot Count" INTEGER,
+    "Container Number" TEXT,
+    "Seal 1" TEXT,
+    "Seal 2" TEXT,
+    PRIMARY KEY ("County", "Scanner", "ICC Batch")
+) WITHOUT ROWID
+'''
+SEARCH_COLUMNS = {'seal_1': 'Seal 1', 'seal_2': 'Seal 2', 'container_number': 'Container Number'}
+SEARCH_TERMS = {name: 'UPPER(TRIM("{}"))'.format(column) for name, column in SEARCH_COLUMNS.items()}
+CREATE_INDEXES = ['CREATE INDEX IF NOT EXISTS manifest_{} ON manifest ({})'.format(name, term)
+                  for name, term in SEARCH_TERMS.items()]
+QUOTED_COLUMNS = ', '.join('"{}"'.format(name) for name in COLUMN_NAMES)
+SELECT_CONTAINER = ('SELECT ' + QUOTED_COLUMNS + ' FROM manifest WHERE "County" = ? AND "Scanner" = ? '
+                    'AND "ICC Batch" BETWEEN ? AND ? ORDER BY "ICC Batch"')
+DELETE_CONTAINER = 'DELETE FROM manifest WHERE "County" = ? AND "Scanner" = ? AND "ICC Batch" BETWEEN ? AND ?'
+INSERT_ROW = 'INSERT INTO manifest (' + QUOTED_COLUMNS + ') VALUES (?, ?, ?, ?, ?, ?, ?)'
+SELECT_ALL = 'SELECT ' + QUOTED_COLUMNS + ' FROM manifest ORDER BY "County", "Scanner", "ICC Batch"'
+# These queries return the (scanner, first batch) of each container with a matching seal or container number. The + on
+# County stops SQLite from choosing the primary key (every row of the county) over the seal and container number
+# indexes.
+SELECT_CONTAINER_KEYS = ('SELECT DISTINCT "Scanner", ("ICC Batch" - 1) / {0} * {0} + 1 AS "First Batch" '
+                         'FROM manifest WHERE ({{}}) ORDER BY "Scanner", "First Batch"'
+                         ).format(BATCHES_PER_CONTAINER)
+SELECT_SEARCH = SELECT_CONTAINER_KEYS.format(' OR '.join('{} = ? AND +"County" = ?'.format(term)
+                                                          for term in SEARCH_TERMS.values()))
+SELECT_SEAL = SELECT_CONTAINER_KEYS.format(' OR '.join('{} = ? AND +"County" = ?'.format(SEARCH_TERMS[name])
+                                                       for name in ('seal_1', 'seal_2')))
+
+
+# This class is the containers dictionary of an SqliteManifestStore. Looking up a single container reads it from the
+# database. The first time every container is needed (for example to iterate over them), the whole manifest is read
+# into a normal dictionary that is used from then on. Changes are written to the database by the store, not here.
+class SqliteContainers(MutableMapping):
+    def __init__(self, store):
+        self.store = store
+        self.loaded = None
+
+    def load(self):
+        if self.loaded is None:
+            df = apply_schema(pd.read_sql_query(SELECT_ALL, self.store.connection))
+            self.loaded = {(container.scanner, container.batch): container
+                           for container in frame_to_containers(df)}
+        return self.loaded
+
+    def __getitem__(self, key):
+        if self.loaded is not None:
+            return self.loaded[key]
+        container = self.store.fetch(*key)
+        if container is None:
+            raise KeyError(key)
+        return container
+
+    def __setitem__(self, key, container):
+        if self.loaded is not None:
+            self.loaded[key] = container
+
+    def __delitem__(self, key):
+        if self.loaded is not None:
+            del self.loaded[key]
+        elif self.store.fetch(*key) is None:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        if self.loaded is not None:
+            return len(self.loaded)
+        return self.store.connection.execute(
+            'SELECT COUNT(*) FROM (SELECT DISTINCT "Scanner", ("ICC Batch" - 1) / ? FROM manifest)',
+            (BATCHES_PER_CONTAINER,)).fetchone()[0]
+
+
+class SqliteManifestStore(ManifestStore):
+    def __init__(self, filename, county='Arapahoe'):
+        super().__init__(county)
+        self.filename = filename
+        # The connection may be closed from a different thread than it was opened on (the manifest server does this),
+        # but it is never used by two threads at once.
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(SCHEMA)
+        for statement in CREATE_INDEXES:
+            self.connection.execute(statement)
+        self.containers = SqliteContainers(self)
+
+    # This method reads a single container from the database using the primary key. Like the containers dictionary of a
+    # ManifestStore, it only finds containers by their first batch.
+    def fetch(self, scanner, batch):
+        if container_start(batch) != batch:
+            return None
+        rows = self.connection.execute(SELECT_CONTAINER, (self.county, scanner, batch,
+                                                          batch + BATCHES_PER_CONTAINER - 1)).fetchall()
+        if not rows:
+            return None
+        counts = [None] * BATCHES_PER_CONTAINER
+        for row in rows:
+            counts[row[2] - batch] = row[3]
+        county, scanner, _, _, container_number, seal_1, seal_2 = rows[0]
+        return Container(county, scanner, batch, container_number, seal_1, seal_2, tuple(counts))
+
+    # This method returns the containers with a seal number or container number matching text, sorted by scanner and
+    # first batch. Only the matching rows are read, using the seal and container number indexes.
+    def search_containers(self, text):
+        term = search_term(text)
+        if term is None:
+            return []
+        with METRICS.section('io'):
+            keys = self.connection.execute(SELECT_SEARCH, (term, self.county) * 3).fetchall()
+            return [self.fetch(*key) for key in keys]
+
+    # This method returns a (seal, Container) pair for each seal given that is already used on a container other than
+    # the one that starts at scanner and batch, using the seal indexes. Blank seals are ignored.
+    def seal_conflicts(self, scanner, batch, *seals):
+        conflicts = []
+        with METRICS.section('io'):
+            for seal in dict.fromkeys(seals):
+                term = search_term(seal)
+                if seal and term:
+                    keys = self.connection.execute(SELECT_SEAL, (term, self.county) * 2).fetchall()
+                    conflicts.extend((seal, self.fetch(*key)) for key in keys if key != (scanner, batch))
+        return conflicts
+
+    # This method writes a group of journal records (see manifest_journal.py) to the database in one transaction. A
+    # saved container replaces all 15 rows of that container.
+    def record_many(self, records):
+        with METRICS.section('io'), self.connection:
+            for record in records:
+                batch = record['batch']
+                self.connection.execute(DELETE_CONTAINER, (record['county'], record['scanner'], batch,
+                                                           batch + BATCHES_PER_CONTAINER - 1))
+                if record['op'] == 'save':
+                    self.connection.executemany(INSERT_ROW, [
+                        (record['county'], record['scanner'], batch + offset, count, record['container'],
+                         record['seal_1'], record['seal_2'])
+                        for offset, count in enumerate(record['counts']) if count is not None])
+
+    # This method reads the sorted manifest straight from the database, which already keeps it in primary key order.
+    def to_frame(self):
+        with METRICS.section('io'):
+            df = pd.read_sql_query(SELECT_ALL, self.connection)
+        with METRICS.section('df'):
+            return apply_schema(df).set_index(INDEX_NAMES)
+
+    # Every change is already in the database, so there is no writer thread and nothing to compact.
+    def start_writer(self, status_callback=None):
+        return None
+
+    def compact(self):
+        pass
+
+    def close(self):
+        self.connection.close()
+
+    def close_without_compacting(self):
+        self.close()
+
+    # This method opens an existing manifest database. The county is read from the database if it has any rows.
+    @classmethod
+    def open(cls, filename, county='Arapahoe'):
+        if not os.path.exists(filename):
+            raise FileNotFoundError(filename)
+        store = cls(filename, county)
+        counties = [row[0] for row in store.connection.execute('SELECT DISTINCT "County" FROM manifest LIMIT 2')]
+        if len(counties) > 1:
+            raise ValueError('A manifest store can only hold one county, found: ' + ', '.join(counties))
+        if counties:
+            store.county = counties[0]
+        return store
+
+    # This method creates a new, empty manifest database, replacing any database already at filename.
+    @classmethod
+    def create(cls, filename, county='Arapahoe'):
+        for name in (filename, filename + '-wal', filename + '-shm'):
+            if os.path.exists(name):
+                os.remove(name)
+        return cls(filename, county)
+
+
+# This function copies a manifest from one file to another. The format of each file is chosen from its extension, so
+# this converts a .csv manifest to SQLite and back.
+def convert(source, destination, county='Arapahoe'):
+    source_store = open_manifest(source, county)
+    destination_store = create_manifest(destination, source_store.county)
+    containers = destination_store.upsert(source_store.containers.values())
+    destination_store.close()
+    source_store.close_without_compacting()
+    return containers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert a ballot manifest between .csv and SQLite.')
+    parser.add_argument('source', help='the manifest to read (.csv, .sqlite, .sqlite3 or .db)')
+    parser.add_argument('destination', help='the manifest to write (.csv, .sqlite, .sqlite3 or .db)')
+    parser.add_argument('--county', default='Arapahoe', help='the county for empty manifests (default: Arapahoe)')
+    args = parser.parse_args(argv)
+    containers = convert(args.source, args.destination, args.county)
+    print('Copied {} containers from {} to {}'.format(containers, args.source, args.destination))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,423 @@
+"""
+Ballot Manifest Store
+
+The ManifestStore class holds the ballot manifest for one county without any tkinter code, so it can be used by the
+GUI, by command line scripts, and by benchmarks.
+
+Ballots are stored in containers of 15 ICC batches. The store keeps a dictionary keyed by (Scanner, first ICC Batch in
+the container) that points to a Container record holding the container number, both seals and the 15 ballot counts.
+Inserting, overwriting or removing a container is a single dictionary operation, so it takes the same amount of time
+no matter how large the manifest grows. The sorted pandas data frame used for the .csv is only built when it is needed
+(when the journal is compacted or the manifest is exported).
+
+By default changes are written to the journal as they are made. Calling start_writer() hands all of the writing to a
+background ManifestWriter thread instead (see manifest_writer.py).
+
+Manifests can also be stored in an SQLite database (see manifest_sqlite.py). The open_manifest() and create_manifest()
+functions pick the right kind of store from the file extension.
+
+Every manifest data frame uses the column types in MANIFEST_DTYPES. The county, container number and seal columns are
+categorical, so each distinct value is stored once instead of on every batch, and the number columns use the smallest
+integer types that fit. Ballot counts are always whole numbers; a batch without a count is not in the manifest.
+
+The columns, the Container record and the label format are defined in manifest_layout.py, which does not need pandas,
+and are exported from here as well.
+"""
+
+
+import sys
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from manifest_journal import ManifestJournal, save_record, remove_record
+from manifest_layout import (COLUMN_NAMES, INDEX_NAMES, BATCHES_PER_CONTAINER, SQLITE_EXTENSIONS, Container,
+                             container_start, parse_label, format_label, parse_count, is_sqlite_manifest)
+from manifest_metrics import METRICS
+from manifest_writer import ManifestWriter, atomic_write_csv
+
+
+MANIFEST_DTYPES = {'County': 'category', 'Scanner': 'int16', 'ICC Batch': 'int32', 'Ballot Count': 'Int32',
+                   'Container Number': 'category', 'Seal 1': 'category', 'Seal 2': 'category'}
+
+
+# This function converts the columns of a manifest data frame to the types in MANIFEST_DTYPES. Ballot counts that are
+# not whole numbers raise a ValueError that lists the first few of them. Missing seals become blank.
+def apply_schema(df):
+    df = df.copy()
+    if 'Ballot Count' in df:
+        counts = pd.to_numeric(df['Ballot Count'], errors='coerce')
+        invalid = (counts < 0) | (counts % 1 > 0)
+        unreadable = counts.isna() & df['Ballot Count'].notna()
+        if unreadable.any():
+            invalid |= unreadable & (df['Ballot Count'][unreadable].astype(str).str.strip() != '')
+        if invalid.any():
+            raise ValueError('Ballot Count must be a whole number, found: ' +
+                             ', '.join(map(repr, df['Ballot Count'][invalid].head(5).tolist())))
+        df['Ballot Count'] = counts
+    for column in ('Seal 1', 'Seal 2'):
+        if column in df:
+            df[column] = df[column].astype(object).where(df[column].notna(), '')
+    for column, dtype in MANIFEST_DTYPES.items():
+        if column in df:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+# This function returns an empty manifest data frame with the manifest columns and types.
+def empty_frame():
+    return apply_schema(pd.DataFrame(columns=COLUMN_NAMES))
+
+
+# This function is the same as parse_label() for a whole pandas series of barcodes at once. It returns a data frame
+# with Scanner, Batch and Container Number columns. Rows that are not valid labels have missing values.
+def parse_labels(labels):
+    parts = labels.astype(str).str.split('/L', expand=True, regex=False)
+    parts = parts.reindex(columns=range(3))
+    valid = labels.notna() & parts[2].notna() & (labels.astype(str).str.count('/L') == 2)
+    return pd.DataFrame({'Scanner': pd.to_numeric(parts[0].where(valid), errors='coerce'),
+                         'Batch': pd.to_numeric(parts[1].where(valid), errors='coerce'),
+                         'Container Number': parts[2].where(valid)}, index=labels.index)
+
+
+# This function groups the rows of a manifest data frame (with County, Scanner, ICC Batch, Ballot Count, Container
+# Number, Seal 1 and Seal 2 columns) into Containers by scanner and the first batch in the container. The container
+# number and seals are taken from the first row of each container.
+def frame_to_containers(df):
+    if df.empty:
+        return []
+    df = df.sort_values(['Scanner', 'ICC Batch'])
+    batches = df['ICC Batch'].astype(int)
+    starts = batches - (batches - 1) % BATCHES_PER_CONTAINER
+    first_rows = df.assign(start=starts).drop_duplicates(['Scanner', 'start'])
+    group = (df['Scanner'].ne(df['Scanner'].shift()) | starts.ne(starts.shift())).cumsum().to_numpy() - 1
+    counts = np.full((len(first_rows), BATCHES_PER_CONTAINER), None, dtype=object)
+    counts[group, (batches - starts).to_numpy()] = [parse_count(count) for count in df['Ballot Count'].tolist()]
+    return [Container(county, scanner, start, container_number, seal_1, seal_2, tuple(container_counts))
+            for (county, scanner, container_number, seal_1, seal_2, start), container_counts
+            in zip(first_rows[['County', 'Scanner', 'Container Number', 'Seal 1', 'Seal 2', 'start']]
+                   .itertuples(index=False, name=None), counts.tolist())]
+
+
+# This function builds the sorted manifest data frame, indexed by County, Scanner and ICC Batch, from a dictionary of
+# containers in the same layout as the .csv file.
+def containers_to_frame(containers):
+    ordered = [containers[key] for key in sorted(containers)]
+    if not ordered:
+        return empty_frame().set_index(INDEX_NAMES)
+    counts = np.array([container.counts for container in ordered], dtype=object)
+    present = np.not_equal(counts, None)
+    rows = present.sum(axis=1)
+    fields = list(zip(*[container[:6] for container in ordered]))
+
+    # The text columns are made categorical from the one value per container before they are repeated for each batch.
+    def repeat_category(values):
+        codes, categories = pd.factorize(pd.Series(values, dtype=object).fillna(''))
+        return pd.Categorical.from_codes(np.repeat(codes, rows), categories)
+
+    df = pd.DataFrame({'County': repeat_category(fields[0]),
+                       'Scanner': np.repeat(np.array(fields[1]), rows),
+                       'ICC Batch': (np.array(fields[2])[:, None] + np.arange(BATCHES_PER_CONTAINER))[present],
+                       'Ballot Count': counts[present],
+                       'Container Number': repeat_category(fields[3]),
+                       'Seal 1': repeat_category(fields[4]),
+                       'Seal 2': repeat_category(fields[5])}, columns=COLUMN_NAMES)
+    return apply_schema(df).set_index(INDEX_NAMES)
+
+
+class ManifestStore:
+    def __init__(self, county='Arapahoe', journal=None):
+        self.county = county
+        self.containers = {}
+        self.journal = journal
+        self.writer = None
+        self.filename = None if journal is None else journal.manifest_filename
+        self.unsaved_changes = 0
+        self.index = None
+        self.search = None
+
+    def __len__(self):
+        return len(self.containers)
+
+    def __contains__(self, key):
+        return key in self.containers
+
+    def __iter__(self):
+        return iter(self.containers[key] for key in sorted(self.containers))
+
+    # This method returns the Container that starts at the given scanner and batch, or None if there isn't one.
+    def get(self, scanner, batch):
+        return self.containers.get((scanner, batch))
+
+    # This method inserts a container, replacing any container that already starts at the same scanner and batch. The
+    # counts are the ballot counts for each of the 15 batches in the container, as ints, strings of digits, or blank
+    # for an unused batch. At least one batch must have a count, because a batch without a count is not written to the
+    # manifest and a container with none would disappear (seals and all) when it is saved. The change is written to the
+    # journal if the store has one.
+    def put(self, scanner, batch, container_number, counts, seal_1, seal_2):
+        counts = tuple(parse_count(count) for count in counts)
+        if len(counts) != BATCHES_PER_CONTAINER:
+            raise ValueError('A container must have exactly {} ballot counts'.format(BATCHES_PER_CONTAINER))
+        if all(count is None for count in counts):
+            raise ValueError('A container must have a ballot count for at least one batch')
+        container = Container(self.county, scanner, batch, container_number, seal_1, seal_2, counts)
+        self.containers[(scanner, batch)] = container
+        if self.index is not None:
+            self.index.update(container)
+        if self.search is not None:
+            self.search.add(container)
+        self.record(save_record(container))
+        return container
+
+    # This method removes the container that starts at the given scanner and batch. It returns the removed Container,
+    # or None if there was nothing to remove. The change is written to the journal if the store has one.
+    def remove(self, scanner, batch):
+        container = self.containers.pop((scanner, batch), None)
+        if container is not None:
+            if self.index is not None:
+                self.index.remove(scanner, batch)
+            if self.search is not None:
+                self.search.remove(scanner, batch)
+            self.record(remove_record(self.county, scanner, batch))
+        return container
+
+    # This method merges many containers into the store at once, for example from a bulk import. Batches with a count
+    # of None and blank seals keep the values already in the store. All of the changes are journaled together.
+    def upsert(self, containers):
+        merged = []
+        for container in containers:
+            key = (container.scanner, container.batch)
+            existing = self.containers.get(key)
+            if existing is not None:
+                container = container._replace(
+                    seal_1=container.seal_1 or existing.seal_1,
+                    seal_2=container.seal_2 or existing.seal_2,
+                    counts=tuple(existing_count if count is None else count
+                                 for count, existing_count in zip(container.counts, existing.counts)))
+            self.containers[key] = container
+            merged.append(container)
+        if self.index is not None:
+            self.index.update_many(merged)
+        if self.search is not None:
+            for container in merged:
+                self.search.add(container)
+        self.record_many([save_record(container) for container in merged])
+        return len(merged)
+
+    # This method sends a journal record to the writer thread if there is one, otherwise straight to the journal.
+    def record(self, record):
+        self.record_many([record])
+
+    def record_many(self, records):
+        if self.writer is not None:
+            for record in records:
+                self.writer.append(record)
+        elif self.journal is not None:
+            self.journal.append_many(records)
+        self.unsaved_changes += len(records)
+
+    # This method applies the records read from a journal to the store without writing them back to the journal.
+    def replay(self, records):
+        for record in records:
+            key = (record['scanner'], record['batch'])
+            if record['op'] == 'save':
+                self.containers[key] = Container(record['county'], record['scanner'], record['batch'],
+                                                 record['container'], record['seal_1'], record['seal_2'],
+                                                 tuple(parse_count(count) for count in record['counts']))
+            else:
+                self.containers.pop(key, None)
+
+    # This method returns the BallotIndex used to find the ballots drawn for the RLA (see manifest_rla.py). It is built
+    # the first time it is needed, and put(), remove() and upsert() keep it up to date from then on.
+    def ballot_index(self):
+        if self.index is None:
+            from manifest_rla import BallotIndex
+            self.index = BallotIndex(self.containers.values())
+        return self.index
+
+    # This method returns the SearchIndex of seal numbers and container numbers (see manifest_search.py). It is built
+    # the first time it is needed, and put(), remove() and upsert() keep it up to date from then on.
+    def search_index(self):
+        if self.search is None:
+            from manifest_search import SearchIndex
+            self.search = SearchIndex(self.containers.values())
+        return self.search
+
+    # This method returns the containers with a seal number or container number matching text, sorted by scanner and
+    # first batch.
+    def search_containers(self, text):
+        return [self.containers[key] for key in self.search_index().find(text)]
+
+    # This method returns a (seal, Container) pair for each seal given that is already used on a container other than
+    # the one that starts at scanner and batch. Blank seals are ignored.
+    def seal_conflicts(self, scanner, batch, *seals):
+        index = self.search_index()
+        return [(seal, self.containers[key]) for seal in dict.fromkeys(seals) if seal
+                for key in index.seal_owners(seal, scanner, batch)]
+
+    # This method builds the sorted manifest data frame, indexed by County, Scanner and ICC Batch, in the same layout
+    # as the .csv file.
+    def to_frame(self):
+        with METRICS.section('df'):
+            return containers_to_frame(self.containers)
+
+    # This method writes the sorted manifest to a .csv file.
+    def to_csv(self, filename):
+        atomic_write_csv(self.to_frame(), filename)
+
+    # This method writes the full manifest to the .csv file and empties the journal. It does nothing if nothing has
+    # changed since the last compaction, unless the writer could not write the last one. With a writer thread the
+    # compaction is queued using a snapshot of the containers, so later changes to the store do not affect it.
+    def compact(self):
+        if self.journal is None:
+            return
+        if not self.unsaved_changes and (self.writer is None or not self.writer.compaction_failed):
+            return
+        if self.writer is not None:
+            self.writer.compact(partial(containers_to_frame, dict(self.containers)))
+        else:
+            self.to_csv(self.filename)
+            self.journal.clear()
+        self.unsaved_changes = 0
+
+    # This method starts a background ManifestWriter thread that takes over all writing for the store. The
+    # status_callback is called from the writer thread with a short message describing what is being written.
+    def start_writer(self, status_callback=None):
+        self.writer = ManifestWriter(self.journal, status_callback)
+        self.writer.start()
+        return self.writer
+
+    # This method compacts the manifest and waits for the writer thread, if there is one, to finish.
+    def close(self):
+        self.compact()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        elif self.journal is not None:
+            self.journal.close()
+
+    # This method closes a manifest that was only read. Nothing is compacted, so the .csv and the journal are left as
+    # they are for any other program that has the manifest open.
+    def close_without_compacting(self):
+        if self.journal is not None:
+            self.journal.close()
+
+    # This method estimates how many bytes of memory the containers in the store use. Values that are shared between
+    # containers (such as the county name) are only counted once.
+    def memory_usage(self):
+        seen = set()
+        total = sys.getsizeof(self.containers)
+        for key, container in self.containers.items():
+            total += sys.getsizeof(key) + sys.getsizeof(container) + sys.getsizeof(container.counts)
+            for value in container[:6] + container.counts:
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    total += sys.getsizeof(value)
+        return total
+
+    # This method loads the rows of a manifest data frame (indexed or not) into the store. Rows are grouped into
+    # containers by scanner and the first batch in the container.
+    def load_frame(self, df):
+        if df.index.names == INDEX_NAMES:
+            df = df.reset_index()
+        if df.empty:
+            return
+        counties = df['County'].unique()
+        if len(counties) > 1:
+            raise ValueError('A manifest store can only hold one county, found: ' + ', '.join(map(str, counties)))
+        self.county = counties[0]
+        for container in frame_to_containers(df):
+            self.containers[(container.scanner, container.batch)] = container
+
+    # This method opens an existing manifest .csv and replays any records left in its journal.
+    @classmethod
+    def open(cls, filename, county='Arapahoe'):
+        journal = ManifestJournal(filename)
+        store = cls(county, journal)
+        with METRICS.section('io'):
+            df = pd.read_csv(filename, dtype={'County': 'category', 'Container Number': 'category',
+                                              'Seal 1': 'category', 'Seal 2': 'category'})
+        with METRICS.section('df'):
+            store.load_frame(apply_schema(df[COLUMN_NAMES]))
+        with METRICS.section('io'):
+            records = journal.read()
+        store.replay(records)
+        journal.record_count = len(records)
+        store.unsaved_changes = len(records)
+        return store
+
+    # This method creates a new, empty manifest .csv from the column template and returns a store for it.
+    @classmethod
+    def create(cls, filename, county='Arapahoe'):
+        empty_frame().to_csv(filename, index=False)
+        journal = ManifestJournal(filename)
+        journal.clear()
+        return cls(county, journal)
+
+
+# This function opens an existing manifest, using an SqliteManifestStore for SQLite files and a ManifestStore for .csv
+# files.
+def open_manifest(filename, county='Arapahoe'):
+    if is_sqlite_manifest(filename):
+        from manifest_sqlite import SqliteManifestStore
+        return SqliteManifestStore.open(filename, county)
+    return ManifestStore.open(filename, county)
+
+
+# This function reads a whole manifest into a data frame indexed by County, Scanner and ICC Batch. For a .csv, records
+# left in the journal are replayed, the same as when the manifest is loaded. Nothing is written to the manifest or its
+# journal, so it is safe to use while another program has the manifest open.
+def read_manifest(filename, county='Arapahoe'):
+    store = open_manifest(filename, county)
+    try:
+        return store.to_frame()
+    finally:
+        store.close_without_compacting()
+
+
+# This function reads the rows of a manifest as they are stored, for the integrity check (see manifest_check.py). A .csv
+# is read as text, so duplicate batches, blank or invalid ballot counts and seals that differ between batches are all
+# kept to be reported. The records left in the journal are replayed on top of the rows without cleaning up the rest of
+# the manifest. Nothing is written to the manifest or its journal.
+def read_manifest_rows(filename, county='Arapahoe'):
+    if is_sqlite_manifest(filename):
+        from manifest_sqlite import SELECT_ALL
+        store = open_manifest(filename, county)
+        try:
+            with METRICS.section('io'):
+                return pd.read_sql_query(SELECT_ALL, store.connection)
+        finally:
+            store.close_without_compacting()
+    with METRICS.section('io'):
+        df = pd.read_csv(filename, dtype=str)
+        records = ManifestJournal(filename).read()
+    with METRICS.section('df'):
+        return replay_rows(df, records)
+
+
+# This function applies journal records to the text rows of a manifest .csv. A saved or removed container replaces every
+# row of its scanner and group of 15 batches, the same as when the journal is replayed into a ManifestStore. Rows whose
+# Scanner or ICC Batch is not a number are never replaced.
+def replay_rows(df, records):
+    latest = {(record['scanner'], record['batch']): record for record in records}
+    if not latest:
+        return df
+    scanner = pd.to_numeric(df['Scanner'], errors='coerce').to_numpy(dtype=float)
+    batch = pd.to_numeric(df['ICC Batch'], errors='coerce').to_numpy(dtype=float)
+    keys = scanner * 2 ** 32 + container_start(batch)
+    replaced = np.isin(keys, [scanner * 2 ** 32 + batch for scanner, batch in latest])
+    rows = [(record['county'], str(record['scanner']), str(record['batch'] + offset), str(count),
+             record['container'], record['seal_1'] or None, record['seal_2'] or None)
+            for record in latest.values() if record['op'] == 'save'
+            for offset, count in enumerate(record['counts']) if count is not None]
+    return pd.concat([df[~replaced], pd.DataFrame(rows, columns=COLUMN_NAMES, dtype=object)], ignore_index=True)
+
+
+# This function creates a new, empty manifest, using an SqliteManifestStore for SQLite files and a ManifestStore for
+# .csv files.
+def create_manifest(filename, county='Arapahoe'):
+    if is_sqlite_manifest(filename):
+        from manifest_sqlite import SqliteManifestStore
+        return SqliteManifestStore.create(filename, county)
+    return ManifestStore.create(filename, county)
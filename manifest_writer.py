@@ -0,0 +1,198 @@
+"""
+Ballot Manifest Writer
+
+Writing to the disk from the tkinter main thread freezes the window whenever the disk is slow, for example when the
+manifest is on a network share or the .csv is open in Excel. The ManifestWriter class is a background thread that does
+all of the writing for a ManifestStore so the operators can keep scanning while the previous container is saved.
+
+Journal records and compactions are put on a queue. The writer takes everything that is waiting on the queue at once,
+so a burst of saves is written with a single sync and several compactions in a row only write the newest one.
+The .csv is written to a temporary file that is then renamed over the manifest, so the .csv is never left half
+written. If the journal is locked the writer keeps retrying, since nothing after it can be reported as saved until it is
+written. If the .csv is locked (for example while it is open in Excel) the compaction is dropped instead, so journal
+records queued behind it are still written, and the store queues a new compaction at the next interval. The writer
+reports what it is doing through a status callback.
+"""
+
+
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from manifest_metrics import METRICS
+
+
+# This function writes a data frame to a temporary .csv in the same folder as filename and then renames it over
+# filename, so anyone reading the file sees either the old manifest or the new one and never a partial file.
+def atomic_write_csv(df, filename, **to_csv_args):
+    directory = os.path.dirname(os.path.abspath(filename))
+    with METRICS.section('io'):
+        handle, temp_name = tempfile.mkstemp(prefix='.manifest-', suffix='.csv.tmp', dir=directory)
+        try:
+            with os.fdopen(handle, 'w', newline='', encoding='utf-8') as temp_file:
+                df.to_csv(temp_file, **to_csv_args)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_name, filename)
+        except BaseException:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+            raise
+
+
+class ManifestWriter(threading.Thread):
+    def __init__(self, journal, status_callback=None, retry_delay=1.0, max_retry_delay=30.0):
+        super().__init__(name='ManifestWriter', daemon=True)
+        self.journal = journal
+        self.filename = journal.manifest_filename
+        self.status_callback = status_callback
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.tasks = queue.Queue()
+        self.stopping = False
+        self.error = None
+        self.compaction_failed = False
+        self.queued = 0
+        self.written = 0
+        self.written_changed = threading.Condition()
+
+    # This method queues a journal record (see manifest_journal.ManifestJournal) to be appended and synced. It returns
+    # the sequence number of the record, which can be passed to wait_for().
+    def append(self, record):
+        with self.written_changed:
+            self.queued += 1
+            self.tasks.put(('record', (self.queued, record)))
+            return self.queued
+
+    # This method queues a compaction. build_frame is called on the writer thread and must return the full, sorted
+    # manifest data frame, so it should only use a snapshot of the store and not the live store.
+    def compact(self, build_frame):
+        self.tasks.put(('compact', build_frame))
+
+    # This method finishes everything on the queue and stops the thread. While stopping, a locked file is only retried a
+    # few times. Anything that could not be compacted is still safe in the journal.
+    def close(self):
+        self.tasks.put(('stop', None))
+        self.join()
+
+    # This method waits until every task that has been queued so far is written.
+    def flush(self):
+        self.tasks.join()
+
+    # This method waits until the record with the given sequence number, and every record queued before it, is synced
+    # to the journal. Unlike flush() it does not wait for compactions or later records. It returns False if that did not
+    # happen within timeout seconds.
+    def wait_for(self, sequence, timeout=None):
+        with self.written_changed:
+            return self.written_changed.wait_for(lambda: self.written >= sequence, timeout)
+
+    def run(self):
+        running = True
+        while running:
+            tasks = [self.tasks.get()]
+            while True:
+                try:
+                    tasks.append(self.tasks.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                running = self.write(tasks)
+            finally:
+                for _ in tasks:
+                    self.tasks.task_done()
+
+    # This method writes one group of tasks taken off the queue. Records queued before a compaction are included in the
+    # compacted .csv, so the journal is only cleared by the newest compaction and records queued after it are appended
+    # to the fresh journal.
+    def write(self, tasks):
+        running = True
+        last_compaction = None
+        for index, (kind, _) in enumerate(tasks):
+            if kind == 'compact':
+                last_compaction = index
+            elif kind == 'stop':
+                running = False
+                self.stopping = True
+        records = [task for kind, task in tasks if kind == 'record']
+        if last_compaction is not None:
+            before = [task for kind, task in tasks[:last_compaction] if kind == 'record']
+            after = [task for kind, task in tasks[last_compaction:] if kind == 'record']
+            self.append_records(before)
+            self.status('Writing manifest...')
+            self.try_compaction(tasks[last_compaction][1])
+            records = after
+        if records:
+            self.append_records(records)
+        if self.tasks.empty() and self.error is None:
+            self.status('All changes saved')
+        if not running:
+            self.journal.close()
+        return running
+
+    # The writer's work is timed as its own actions (see manifest_metrics.py), apart from the operator actions.
+    def append_records(self, records):
+        if not records:
+            return
+        with METRICS.timer('write journal'):
+            saved = self.retry('Saving journal', self.journal.append_many, [record for _, record in records])
+        if saved:
+            with self.written_changed:
+                self.written = records[-1][0]
+                self.written_changed.notify_all()
+
+    def write_manifest(self, build_frame):
+        with METRICS.timer('write manifest'):
+            with METRICS.section('df'):
+                df = build_frame()
+            atomic_write_csv(df, self.filename)
+
+    # This method writes the compacted .csv and then empties the journal. A locked .csv is not retried here, because
+    # that would hold up the journal records queued behind it. The compaction is dropped and compaction_failed tells the
+    # store to queue a new one at the next interval; until then every change is still safe in the journal. While the
+    # writer is stopping, the compaction is tried a few times.
+    def try_compaction(self, build_frame):
+        attempts = 3 if self.stopping else 1
+        delay = self.retry_delay
+        for attempt in range(attempts):
+            try:
+                self.write_manifest(build_frame)
+                self.journal.clear()
+            except OSError as error:
+                self.error = error
+                self.compaction_failed = True
+                if attempt + 1 < attempts:
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.max_retry_delay)
+            else:
+                self.error = None
+                self.compaction_failed = False
+                return True
+        self.status('Writing manifest failed ({}), changes are saved in the journal and it will be tried again'.format(
+            self.error.strerror or self.error))
+        return False
+
+    # This method calls function until it succeeds, waiting a little longer after each failure (for example while the
+    # .csv is locked by another program). It returns False if the writer is stopping and the function still failed.
+    def retry(self, action, function, *args):
+        delay = self.retry_delay
+        attempts = 0
+        while True:
+            try:
+                function(*args)
+                self.error = None
+                return True
+            except OSError as error:
+                self.error = error
+                attempts += 1
+                if self.stopping and attempts >= 3:
+                    self.status('{} failed: {}'.format(action, error))
+                    return False
+                self.status('{} failed ({}), retrying in {:g}s'.format(action, error.strerror or error, delay))
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+    def status(self, message):
+        if self.status_callback is not None:
+            self.status_callback(message)
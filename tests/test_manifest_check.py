@@ -0,0 +1,63 @@
+import pandas as pd
+
+from manifest_check import check_manifest, main
+from manifest_store import create_manifest, read_manifest, read_manifest_rows
+
+
+def test_seal_changed_on_one_batch_is_a_duplicate(tmp_path):
+    store = create_manifest(str(tmp_path / 'Ballot Manifest.csv'))
+    store.put(1, 1, 'ICC 01-1', [10] * 15, 'A1', 'B1')
+    store.put(1, 16, 'ICC 01-2', [10] * 15, 'A2', 'B2')
+    df = store.to_frame().reset_index()
+    df['Seal 1'] = df['Seal 1'].astype(object)
+    df.loc[3, 'Seal 1'] = 'A2'
+
+    issues = check_manifest(df)
+    duplicates = issues[issues['Check'] == 'Duplicate seal']
+    assert sorted(duplicates['Container Number']) == ['ICC 01-1', 'ICC 01-2']
+
+
+def test_read_manifest_includes_the_journal(tmp_path):
+    store = create_manifest(str(tmp_path / 'Ballot Manifest.csv'))
+    store.put(1, 1, 'ICC 01-1', [10] * 15, 'A1', 'B1')
+    store.compact()
+    store.put(1, 16, 'ICC 01-2', [10] * 15, 'A2', 'B2')
+    store.journal.close()
+
+    assert len(read_manifest(store.filename)) == 30
+    assert check_manifest(read_manifest(store.filename)).empty
+    assert len(store.journal.read()) == 1
+
+
+def test_cli_reports_problems_in_the_raw_csv(tmp_path, capsys):
+    lines = ['County,Scanner,ICC Batch,Ballot Count,Container Number,Seal 1,Seal 2']
+    for batch in range(1, 31):
+        container = 1 if batch <= 15 else 2
+        lines.append('Arapahoe,1,{},10,ICC 01-{},A{},B{}'.format(batch, container, container, container))
+    lines[3] = 'Arapahoe,1,3,10,ICC 01-1,A2,B1'
+    lines[16] = 'Arapahoe,1,16,10,ICC 01-2,A2,B2\nArapahoe,1,16,12,ICC 01-2,A2,B2'
+    lines[20] = 'Arapahoe,1,20,,ICC 01-9,A2,B2'
+    manifest = tmp_path / 'Ballot Manifest.csv'
+    manifest.write_text('\n'.join(lines) + '\n')
+    output = tmp_path / 'Manifest Check.csv'
+
+    assert main([str(manifest), '--output', str(output)]) == 1
+    checks = set(pd.read_csv(output)['Check'])
+    assert {'Duplicate batch', 'Blank ballot count', 'Inconsistent seals', 'Mixed containers',
+            'Duplicate seal'} <= checks
+    assert 'No problems' not in capsys.readouterr().out
+
+
+def test_cli_replays_the_journal_without_cleaning_the_rows(tmp_path):
+    store = create_manifest(str(tmp_path / 'Ballot Manifest.csv'))
+    store.put(1, 1, 'ICC 01-1', [10] * 15, 'A1', 'B1')
+    store.compact()
+    with open(store.filename, 'a') as manifest:
+        manifest.write('Arapahoe,1,5,ten,ICC 01-1,A1,B1\n')
+    store.put(1, 16, 'ICC 01-2', [10] * 14 + [None], 'A2', 'B2')
+    store.journal.close()
+
+    rows = read_manifest_rows(store.filename)
+    assert len(rows) == 16 + 14
+    issues = check_manifest(rows)
+    assert set(issues['Check']) == {'Duplicate batch', 'Invalid ballot count'}
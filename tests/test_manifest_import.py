@@ -0,0 +1,49 @@
+import pandas as pd
+
+from manifest_import import main
+from manifest_store import open_manifest
+
+
+def test_csv_import_rejects_bad_rows(tmp_path):
+    lines = ['Label,ICC Batch,Ballot Count,Seal 1,Seal 2']
+    lines += ['01/L1/LICC 01-1,{},10,A1,B1'.format(batch) for batch in range(1, 16)]
+    lines += ['01/L16/LICC 01-2,16,10,A2,B2,extra',
+              '01/L16/LICC 01-2,17,ten,A2,B2',
+              '01/L16/LICC 01-2,18,10,A2,',
+              '01/L16/LICC 01-2,19,10,,B2',
+              '02/L1/LICC 02-1,1,10,C1,D1',
+              '02/L1/LICC 02-1,2,10,C9,D1',
+              '02/L16/LICC 02-2,16,10,E1,F1',
+              '02/L16/LICC 02-9,17,10,E1,F1']
+    counts = tmp_path / 'counts.csv'
+    counts.write_text('\n'.join(lines) + '\n')
+    manifest = str(tmp_path / 'Ballot Manifest.csv')
+    rejects = tmp_path / 'Rejects.csv'
+
+    assert main([manifest, str(counts), '--rejects', str(rejects)]) == 1
+    report = pd.read_csv(rejects)
+    assert list(report['Line']) == [17, 18, 21, 22, 23, 24]
+    assert 'fields' in report['Reason'][0] and 'whole number' in report['Reason'][1]
+
+    store = open_manifest(manifest)
+    assert sorted(store.containers) == [(1, 1), (1, 16)]
+    container = store.get(1, 16)
+    assert container.counts[2:4] == (10, 10)
+    assert (container.seal_1, container.seal_2) == ('A2', 'B2')
+
+
+def test_jsonl_import_rejects_malformed_lines(tmp_path):
+    counts = tmp_path / 'counts.jsonl'
+    counts.write_text('{"Label": "01/L1/LICC 01-1", "ICC Batch": 1, "Ballot Count": 10, "Seal 1": "A1"}\n'
+                      '{"Label": "01/L1/LICC 01-1", "ICC Batch": 2, "Ballot Count": 12\n'
+                      '[1, 2]\n'
+                      '\n'
+                      '{"Label": "01/L1/LICC 01-1", "ICC Batch": 3, "Ballot Count": 14, "Seal 2": 99}\n')
+    manifest = str(tmp_path / 'Ballot Manifest.sqlite')
+    rejects = tmp_path / 'Rejects.csv'
+
+    assert main([manifest, str(counts), '--rejects', str(rejects)]) == 1
+    assert list(pd.read_csv(rejects)['Line']) == [2, 3]
+    container = open_manifest(manifest).get(1, 1)
+    assert container.counts[:3] == (10, None, 14)
+    assert (container.seal_1, container.seal_2) == ('A1', '99')
@@ -0,0 +1,34 @@
+import os
+
+import pandas as pd
+
+from manifest_merge import merge_manifests
+from manifest_store import COLUMN_NAMES
+
+
+def write_county(filename, scanner, batches, county='Arapahoe'):
+    rows = [(county, scanner, batch, 10, 'ICC {:02d}-1'.format(scanner), 'A1', 'B1') for batch in batches]
+    pd.DataFrame(rows, columns=COLUMN_NAMES).to_csv(filename, index=False)
+    return str(filename)
+
+
+def test_county_split_over_files_is_merged_in_order(tmp_path):
+    files = [write_county(tmp_path / 'a.csv', 2, range(1, 16)), write_county(tmp_path / 'b.csv', 1, range(1, 16))]
+    output = str(tmp_path / 'Statewide.csv')
+
+    totals = merge_manifests(files, output, workers=1)
+    assert totals == {'Arapahoe': {'batches': 30, 'containers': 2, 'ballots': 300}}
+    df = pd.read_csv(output)
+    assert list(df['Scanner']) == [1] * 15 + [2] * 15
+
+
+def test_batch_in_two_files_names_both_and_writes_nothing(tmp_path, capsys):
+    files = [write_county(tmp_path / 'a.csv', 1, range(1, 16)), write_county(tmp_path / 'b.csv', 1, range(15, 31))]
+    output = str(tmp_path / 'Statewide.csv')
+
+    assert merge_manifests(files, output, workers=1) is None
+    assert not os.path.exists(output)
+    message = capsys.readouterr().out
+    assert 'scanner 1 batch 15 of Arapahoe is in both' in message
+    assert files[0] in message and files[1] in message
+    assert sorted(os.listdir(tmp_path)) == ['a.csv', 'b.csv']
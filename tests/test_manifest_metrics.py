@@ -0,0 +1,23 @@
+import json
+import time
+
+from manifest_metrics import ActionTimer, Metrics
+
+
+def test_write_to_missing_folder_does_not_raise(tmp_path):
+    metrics = Metrics()
+    metrics.enable(str(tmp_path / 'missing' / 'metrics.json'))
+    assert metrics.write() is False
+    assert isinstance(metrics.write_error, OSError)
+    assert metrics.write(str(tmp_path / 'metrics.json')) is True
+    assert metrics.write_error is None
+    assert 'actions' in json.loads((tmp_path / 'metrics.json').read_text())
+
+
+def test_paused_time_is_left_out_of_the_action():
+    metrics = Metrics()
+    metrics.enable()
+    with ActionTimer(metrics, 'submit_form'):
+        with metrics.paused():
+            time.sleep(0.2)
+    assert metrics.summary()['submit_form']['max_ms'] < 100
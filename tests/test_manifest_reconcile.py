@@ -0,0 +1,33 @@
+import pandas as pd
+
+from manifest_reconcile import main
+from manifest_store import create_manifest
+
+
+def test_reconcile_reads_the_journaled_manifest(tmp_path):
+    store = create_manifest(str(tmp_path / 'Ballot Manifest.csv'))
+    store.put(1, 1, 'ICC 01-1', [10] * 15, 'A1', 'B1')
+    store.compact()
+    store.put(1, 16, 'ICC 01-2', [10] * 15, 'A2', 'B2')
+    store.journal.close()
+    export = tmp_path / 'Tabulation Export.csv'
+    pd.DataFrame({'Tabulator': [1] * 30, 'Batch': range(1, 31), 'Ballots': [10] * 30}).to_csv(export, index=False)
+    output = tmp_path / 'Reconciliation.csv'
+
+    assert main([store.filename, str(export), '--output', str(output)]) == 0
+    assert pd.read_csv(output).empty
+
+
+def test_blank_county_is_an_invalid_row(tmp_path):
+    store = create_manifest(str(tmp_path / 'Ballot Manifest.csv'))
+    store.put(1, 1, 'ICC 01-1', [10] + [None] * 14, 'A1', 'B1')
+    store.close()
+    export = tmp_path / 'Tabulation Export.csv'
+    export.write_text('County,Scanner,Batch,Ballots\nArapahoe,1,1,10\n,1,2,5\n  ,1,3,5\nZ County,1,4,5\n')
+    output = tmp_path / 'Reconciliation.csv'
+
+    assert main([store.filename, str(export), '--output', str(output)]) == 1
+    report = pd.read_csv(output, keep_default_na=False)
+    assert report['Result'].tolist() == ['Not in manifest', 'Invalid row', 'Invalid row']
+    assert report['ICC Batch'].tolist() == [4, 2, 3]
+    assert report['County'].tolist() == ['Z County', '', '']
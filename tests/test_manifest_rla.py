@@ -0,0 +1,55 @@
+import numpy as np
+
+from manifest_rla import main
+from manifest_store import Container, ManifestStore, create_manifest
+
+
+def test_cli_leaves_the_manifest_and_journal_alone(tmp_path):
+    store = create_manifest(str(tmp_path / 'Ballot Manifest.csv'))
+    store.put(1, 1, 'ICC 01-1', [10] * 15, 'A1', 'B1')
+    store.journal.close()
+    files = [store.filename, store.journal.filename]
+    before = [open(filename, 'rb').read() for filename in files]
+    draws = tmp_path / 'draws.txt'
+    draws.write_text('1\n150\n')
+
+    assert main([store.filename, str(draws), '--output', str(tmp_path / 'Pull List.csv')]) == 0
+    assert [open(filename, 'rb').read() for filename in files] == before
+
+
+# This function lists every ballot of the store in manifest order as (scanner, batch, position, container number).
+def every_ballot(store):
+    return [(container.scanner, container.batch + offset, position, container.container_number)
+            for container in store
+            for offset, count in enumerate(container.counts)
+            for position in range(1, (count or 0) + 1)]
+
+
+def test_index_matches_brute_force_after_random_changes():
+    random = np.random.default_rng(2024)
+    store = ManifestStore()
+    index = store.ballot_index()
+    for step in range(300):
+        scanner = int(random.integers(1, 4))
+        batch = int(random.integers(0, 12)) * 15 + 1
+        action = random.random()
+        if action < 0.5:
+            counts = [int(count) if count >= 0 else None for count in random.integers(-2, 4, 15)]
+            counts[int(random.integers(0, 15))] = int(random.integers(0, 4))
+            store.put(scanner, batch, 'ICC {:02d}-{}'.format(scanner, step), counts, 'A', 'B')
+        elif action < 0.8:
+            store.remove(scanner, batch)
+        else:
+            store.upsert([Container(store.county, int(random.integers(1, 4)), int(random.integers(0, 12)) * 15 + 1,
+                                    'ICC bulk-{}-{}'.format(step, number), 'A', 'B',
+                                    tuple(int(count) for count in random.integers(0, 3, 15)))
+                          for number in range(int(random.integers(1, 6)))])
+        if step % 10 == 0:
+            index.total()
+
+        expected = every_ballot(store)
+        assert index.total() == len(expected)
+        if expected:
+            found = index.locate(np.arange(1, len(expected) + 1))
+            assert list(zip(found['Scanner'], found['ICC Batch'], found['Ballot Position'],
+                            found['Container Number'])) == expected
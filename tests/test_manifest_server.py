@@ -0,0 +1,141 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from manifest_server import TOKEN_VARIABLE, ManifestConflict, ManifestServer, RemoteManifestStore, main
+from manifest_store import create_manifest
+
+
+COUNTS = [25] * 15
+
+
+# This fixture runs a manifest server for a new .csv manifest on an event loop in a background thread. A test can pass
+# a token to the fixture (parametrize 'server' with indirect=True) to run a server that needs that token.
+@pytest.fixture
+def server(tmp_path, request):
+    store = create_manifest(str(tmp_path / 'Ballot Manifest.csv'))
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    token = getattr(request, 'param', None)
+    manifest_server = asyncio.run_coroutine_threadsafe(
+        ManifestServer(store, port=0, write_timeout=5, token=token).start(), loop).result(10)
+    yield manifest_server
+    asyncio.run_coroutine_threadsafe(manifest_server.stop(), loop).result(30)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+
+
+def connect(server, timeout=10):
+    return RemoteManifestStore('127.0.0.1', server.port, timeout=timeout)
+
+
+def test_several_clients_save_at_once(server):
+    errors = []
+
+    def enter_containers(scanner):
+        try:
+            client = connect(server)
+            for number in range(20):
+                batch = 1 + number * 15
+                assert client.get(scanner, batch) is None
+                client.put(scanner, batch, 'ICC {:02d}-{}'.format(scanner, number + 1), COUNTS, 'A', 'B')
+            client.close()
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=enter_containers, args=(scanner,)) for scanner in range(1, 6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert errors == []
+    assert len(server.store) == 100
+    assert len(server.store.journal.read()) == 100
+
+
+def test_overwrite_without_looking_is_a_conflict(server):
+    first = connect(server)
+    second = connect(server)
+    first.put(2, 16, 'ICC 02-2', COUNTS, 'A', 'B')
+
+    with pytest.raises(ManifestConflict):
+        second.put(2, 16, 'ICC 02-2', [1] * 15, 'C', 'D')
+    assert server.store.get(2, 16).seal_1 == 'A'
+
+    assert second.get(2, 16).seal_1 == 'A'
+    second.put(2, 16, 'ICC 02-2', [1] * 15, 'C', 'D')
+    with pytest.raises(ManifestConflict):
+        first.put(2, 16, 'ICC 02-2', COUNTS, 'E', 'F')
+    assert server.store.get(2, 16).seal_1 == 'C'
+    first.close()
+    second.close()
+
+
+def test_locked_csv_does_not_delay_answers(server, monkeypatch):
+    replace = os.replace
+
+    def locked(source, destination):
+        if destination == server.store.filename:
+            raise PermissionError(13, 'Permission denied', destination)
+        replace(source, destination)
+
+    monkeypatch.setattr(os, 'replace', locked)
+    client = connect(server, timeout=5)
+    client.get(1, 1)
+    client.put(1, 1, 'ICC 01-1', COUNTS, 'A', 'B')
+    frame = server.store.to_frame()
+    server.store.writer.compact(lambda: time.sleep(1) or frame)
+    start = time.perf_counter()
+    for number in range(1, 6):
+        client.get(1, 1 + number * 15)
+        client.put(1, 1 + number * 15, 'ICC 01-{}'.format(number + 1), COUNTS, 'A', 'B')
+    assert time.perf_counter() - start < 5
+    client.close()
+    server.store.writer.flush()
+    assert server.store.writer.compaction_failed
+    assert len(server.store.journal.read()) == 6
+    monkeypatch.setattr(os, 'replace', replace)
+
+
+def test_client_reconnects_after_a_timeout(server, monkeypatch):
+    journal = server.store.journal
+    append_many = journal.append_many
+
+    def slow_append(records):
+        time.sleep(1)
+        append_many(records)
+
+    client = connect(server, timeout=0.3)
+    assert client.get(3, 1) is None
+    monkeypatch.setattr(journal, 'append_many', slow_append)
+    with pytest.raises(OSError):
+        client.put(3, 1, 'ICC 03-1', COUNTS, 'A', 'B')
+    monkeypatch.setattr(journal, 'append_many', append_many)
+    time.sleep(1)
+
+    # The change was made even though the answer never arrived, so the next request on a new connection sees it.
+    assert client.get(3, 1).container_number == 'ICC 03-1'
+    client.close()
+
+
+@pytest.mark.parametrize('server', ['shared secret'], indirect=True)
+def test_server_with_a_token_refuses_other_clients(server):
+    with pytest.raises(PermissionError):
+        connect(server)
+    with pytest.raises(PermissionError):
+        RemoteManifestStore('127.0.0.1', server.port, timeout=10, token='wrong')
+    client = RemoteManifestStore('127.0.0.1', server.port, timeout=10, token='shared secret')
+    client.put(4, 1, 'ICC 04-1', COUNTS, 'A', 'B')
+    assert client.get(4, 1).container_number == 'ICC 04-1'
+    client.close()
+
+
+def test_server_needs_a_token_to_listen_on_the_network(tmp_path, monkeypatch):
+    monkeypatch.delenv(TOKEN_VARIABLE, raising=False)
+    with pytest.raises(SystemExit):
+        main([str(tmp_path / 'Ballot Manifest.csv'), '--host', '0.0.0.0'])
+    assert not os.path.exists(tmp_path / 'Ballot Manifest.csv')
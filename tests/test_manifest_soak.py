@@ -0,0 +1,23 @@
+from manifest_soak import check_reports
+
+
+def report(scans, widgets, memory_mb):
+    return {'scans': scans, 'widgets': widgets, 'memory_mb': memory_mb}
+
+
+def test_flat_run_passes():
+    assert check_reports([report(500, 120, 80.0), report(1000, 120, 90.0)], 25) == []
+
+
+def test_widget_growth_fails():
+    failures = check_reports([report(500, 120, 80.0), report(1000, 121, 80.0)], 25)
+    assert failures == ['The number of widgets grew from 120 to 121']
+
+
+def test_memory_growth_fails_unless_unknown():
+    assert len(check_reports([report(500, 120, 80.0), report(1000, 120, 106.0)], 25)) == 1
+    assert check_reports([report(500, 120, None), report(1000, 120, None)], 25) == []
+
+
+def test_one_report_is_not_enough():
+    assert len(check_reports([report(500, 120, 80.0)], 25)) == 1
@@ -0,0 +1,178 @@
+import pandas as pd
+import pytest
+
+from manifest_sqlite import SELECT_SEARCH, convert
+from manifest_store import COLUMN_NAMES, ManifestStore, create_manifest, open_manifest
+
+
+COUNTS = [10, 20, 30, None, None, None, None, None, None, None, None, None, None, None, None]
+
+
+def new_store(tmp_path, name='Ballot Manifest.csv'):
+    return create_manifest(str(tmp_path / name))
+
+
+def test_put_and_get(tmp_path):
+    store = new_store(tmp_path)
+    container = store.put(1, 16, 'ICC 01-2', ['10', 20, ' 30 ', ''] + [None] * 11, 'A1', 'B1')
+    assert store.get(1, 16) == container
+    assert container.counts == tuple(COUNTS)
+    assert (1, 16) in store and len(store) == 1
+    assert store.get(1, 1) is None
+
+
+def test_put_overwrites_container(tmp_path):
+    store = new_store(tmp_path)
+    store.put(1, 1, 'ICC 01-1', COUNTS, 'A1', 'B1')
+    store.put(1, 1, 'ICC 01-1', [5] * 15, 'A2', 'B2')
+    assert len(store) == 1
+    assert store.get(1, 1).seal_1 == 'A2'
+    assert store.get(1, 1).counts == (5,) * 15
+
+
+def test_put_rejects_bad_counts(tmp_path):
+    store = new_store(tmp_path)
+    with pytest.raises(ValueError):
+        store.put(1, 1, 'ICC 01-1', [1] * 14, 'A', 'B')
+    with pytest.raises(ValueError):
+        store.put(1, 1, 'ICC 01-1', ['ten'] + [None] * 14, 'A', 'B')
+    assert len(store) == 0
+
+
+@pytest.mark.parametrize('filename', ['Ballot Manifest.csv', 'Ballot Manifest.sqlite'])
+def test_put_rejects_container_without_counts(tmp_path, filename):
+    store = create_manifest(str(tmp_path / filename))
+    with pytest.raises(ValueError):
+        store.put(1, 1, 'ICC 01-1', [''] * 15, 'SEAL-A', 'SEAL-B')
+    store.close()
+
+    reopened = open_manifest(str(tmp_path / filename))
+    assert len(reopened) == 0
+    assert reopened.search_containers('SEAL-A') == []
+
+
+def test_remove(tmp_path):
+    store = new_store(tmp_path)
+    store.put(2, 31, 'ICC 02-3', COUNTS, 'A', 'B')
+    assert store.remove(2, 31).container_number == 'ICC 02-3'
+    assert store.remove(2, 31) is None
+    assert len(store) == 0
+
+
+def test_upsert_keeps_existing_counts_and_seals(tmp_path):
+    store = new_store(tmp_path)
+    store.put(1, 1, 'ICC 01-1', COUNTS, 'A1', 'B1')
+    existing = store.get(1, 1)
+    update = existing._replace(seal_1='', seal_2='B9', counts=(None, 25) + (None,) * 13)
+    added = existing._replace(batch=16, container_number='ICC 01-2', counts=(7,) * 15)
+    assert store.upsert([update, added]) == 2
+    assert store.get(1, 1).seal_1 == 'A1'
+    assert store.get(1, 1).seal_2 == 'B9'
+    assert store.get(1, 1).counts[:3] == (10, 25, 30)
+    assert store.get(1, 16).counts == (7,) * 15
+
+
+def test_compact_writes_sorted_csv_and_clears_journal(tmp_path):
+    store = new_store(tmp_path)
+    store.put(2, 1, 'ICC 02-1', COUNTS, 'A2', 'B2')
+    store.put(1, 1, 'ICC 01-1', COUNTS, 'A1', 'B1')
+    store.compact()
+    assert store.journal.read() == []
+    df = pd.read_csv(store.filename)
+    assert list(df.columns) == COLUMN_NAMES
+    assert list(zip(df['Scanner'], df['ICC Batch'])) == [(1, 1), (1, 2), (1, 3), (2, 1), (2, 2), (2, 3)]
+    assert df['Ballot Count'].tolist() == [10, 20, 30] * 2
+
+
+def test_reopen_replays_journal(tmp_path):
+    store = new_store(tmp_path)
+    store.put(1, 1, 'ICC 01-1', COUNTS, 'A1', 'B1')
+    store.compact()
+    store.put(1, 16, 'ICC 01-2', COUNTS, 'A2', 'B2')
+    store.remove(1, 1)
+    store.journal.close()
+
+    reopened = ManifestStore.open(store.filename)
+    assert [container.container_number for container in reopened] == ['ICC 01-2']
+    assert reopened.unsaved_changes == 2
+
+
+def test_reopen_ignores_partial_last_journal_line(tmp_path):
+    store = new_store(tmp_path)
+    store.put(1, 1, 'ICC 01-1', COUNTS, 'A1', 'B1')
+    store.journal.close()
+    with open(store.journal.filename, 'a', encoding='utf-8') as journal_file:
+        journal_file.write('{"op": "save", "county": "Arapahoe", "scanner": 1, "batch": 16, "cont')
+
+    reopened = ManifestStore.open(store.filename)
+    assert len(reopened) == 1
+    assert reopened.get(1, 1).counts == tuple(COUNTS)
+    assert reopened.get(1, 16) is None
+
+
+def test_append_after_partial_last_journal_line(tmp_path):
+    store = new_store(tmp_path)
+    store.put(1, 1, 'ICC 01-1', COUNTS, 'A1', 'B1')
+    store.journal.close()
+    with open(store.journal.filename, 'a', encoding='utf-8') as journal_file:
+        journal_file.write('{"op": "save", "county": "Arapahoe", "scanner": 1, "batch": 16, "cont')
+
+    reopened = ManifestStore.open(store.filename)
+    reopened.put(1, 16, 'ICC 01-2', COUNTS, 'A2', 'B2')
+    reopened.put(1, 31, 'ICC 01-3', COUNTS, 'A3', 'B3')
+    reopened.journal.close()
+
+    again = ManifestStore.open(store.filename)
+    assert sorted(again.containers) == [(1, 1), (1, 16), (1, 31)]
+    assert again.journal.torn_at is None
+
+
+def test_csv_sqlite_round_trip(tmp_path):
+    store = new_store(tmp_path)
+    store.put(1, 1, 'ICC 01-1', COUNTS, 'A1', 'B1')
+    store.put(3, 46, 'ICC 03-4', [100] * 15, 'A3', '')
+    store.close()
+    database = str(tmp_path / 'Ballot Manifest.sqlite')
+    exported = str(tmp_path / 'Ballot Manifest Export.csv')
+
+    assert convert(store.filename, database) == 2
+    assert convert(database, exported) == 2
+
+    sqlite_store = open_manifest(database)
+    assert sqlite_store.get(3, 46) == open_manifest(store.filename).get(3, 46)
+    sqlite_store.close()
+    pd.testing.assert_frame_equal(pd.read_csv(exported), pd.read_csv(store.filename))
+
+
+def test_sqlite_search_and_seal_conflicts_use_the_indexes(tmp_path):
+    store = create_manifest(str(tmp_path / 'Ballot Manifest.sqlite'))
+    store.put(1, 1, 'ICC 01-1', [10] * 15, 'A1 ', 'B1')
+    store.put(1, 16, 'ICC 01-2', [10] * 14 + [None], 'A2', 'b1')
+    store.put(2, 1, 'ICC 02-1', [None] * 3 + [10] * 12, 'C1', 'C2')
+
+    assert [container.batch for container in store.search_containers(' icc 01-2')] == [16]
+    assert [(container.scanner, container.batch) for container in store.search_containers('B1')] == [(1, 1), (1, 16)]
+    assert store.search_containers('ICC 02-1')[0].counts[3:] == (10,) * 12
+    assert store.search_containers('') == []
+    assert [(seal, container.batch) for seal, container in store.seal_conflicts(1, 1, 'a1', 'B1', '')] == [('B1', 16)]
+    assert store.containers.loaded is None
+    plan = ' '.join(row[-1] for row in store.connection.execute(
+        'EXPLAIN QUERY PLAN ' + SELECT_SEARCH, ('A1', store.county) * 3))
+    assert 'manifest_seal_1' in plan and 'manifest_container_number' in plan
+
+
+def test_search_cli_leaves_the_manifest_and_journal_alone(tmp_path):
+    from manifest_search import main
+    store = new_store(tmp_path)
+    store.put(1, 1, 'ICC 01-1', COUNTS, 'A1', 'B1')
+    store.journal.close()
+    with open(store.filename, 'rb') as manifest_file:
+        manifest = manifest_file.read()
+    with open(store.journal.filename, 'rb') as journal_file:
+        journal = journal_file.read()
+
+    assert main([store.filename, 'A1']) == 0
+    with open(store.filename, 'rb') as manifest_file:
+        assert manifest_file.read() == manifest
+    with open(store.journal.filename, 'rb') as journal_file:
+        assert journal_file.read() == journal
@@ -0,0 +1,68 @@
+import os
+import threading
+
+import pandas as pd
+
+from manifest_store import create_manifest
+
+
+COUNTS = [25] * 15
+
+
+# This function waits for everything queued on the writer, failing the test instead of hanging if it never finishes.
+def flush(writer, timeout=10):
+    thread = threading.Thread(target=writer.flush, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'the writer did not finish its queue'
+
+
+def test_locked_csv_does_not_hold_up_journal(tmp_path, monkeypatch):
+    store = create_manifest(str(tmp_path / 'Ballot Manifest.csv'))
+    writer = store.start_writer()
+    replace = os.replace
+
+    def locked(source, destination):
+        if destination == store.filename:
+            raise PermissionError(13, 'Permission denied', destination)
+        replace(source, destination)
+
+    monkeypatch.setattr(os, 'replace', locked)
+    store.put(1, 1, 'ICC 01-1', COUNTS, 'A1', 'B1')
+    store.compact()
+    store.put(1, 16, 'ICC 01-2', COUNTS, 'A2', 'B2')
+    store.put(2, 1, 'ICC 02-1', COUNTS, 'A3', 'B3')
+    flush(writer)
+
+    assert writer.compaction_failed
+    assert [(record['scanner'], record['batch']) for record in store.journal.read()] == [(1, 1), (1, 16), (2, 1)]
+    assert pd.read_csv(store.filename).empty
+
+    monkeypatch.setattr(os, 'replace', replace)
+    store.compact()
+    flush(writer)
+    assert not writer.compaction_failed
+    assert store.journal.read() == []
+    assert len(pd.read_csv(store.filename)) == 45
+    store.close()
+
+
+def test_failed_compaction_is_queued_again_without_new_changes(tmp_path, monkeypatch):
+    store = create_manifest(str(tmp_path / 'Ballot Manifest.csv'))
+    writer = store.start_writer()
+    replace = os.replace
+
+    def locked(source, destination):
+        raise PermissionError(13, 'Permission denied', destination)
+
+    monkeypatch.setattr(os, 'replace', locked)
+    store.put(1, 1, 'ICC 01-1', COUNTS, 'A1', 'B1')
+    store.compact()
+    flush(writer)
+    assert writer.compaction_failed
+
+    monkeypatch.setattr(os, 'replace', replace)
+    store.compact()
+    flush(writer)
+    assert len(pd.read_csv(store.filename)) == 15
+    store.close()